@@ -4,51 +4,154 @@ import smt_util
 import hashf
 import sim_config
 from tqdm import tqdm
-import pickle
 import logging
 from typing import List
 from os import path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from mapped_smt import OverlayNodes, DELETED
+import ca_wal
+import setup_cache
+import bisect
 import sys
+import time
+import asyncio
 import copy
 
 
 class CA:
     def __init__(self, config):
         self.c: sim_config.SimConfig = config
-        self.smtu = smt_util.SMTutil(self.c.hash_function, self.c.hash_depth)
+        self.smtu = smt_util.SMTutil(self.c.hash_function, self.c.hash_depth, self.c.intern_digests)
         self.smts = [SMT(self.c.hash_function, self.c.hash_depth) for _ in range(self.c.no_smt_parts)]
         self.prime_root = None  # tuple: prime_hash, parities
+        # LRU cache of PoIs: (slot, leaf pos) -> [poi, poi_bm], kept up to date on add_node
+        # trees keep their slot when the parts rotate, see tree_slot()
+        self.poi_cache = OrderedDict()
+        self.poi_index = [[] for _ in range(self.c.no_smt_parts)]  # sorted cached leaf positions per slot
+        self.rotations = 0
+        self.poi_cache_hits = 0
+        self.poi_cache_misses = 0
+        # admission queue of revocations & re-issues, applied in batches (see enqueue)
+        self.pending = []  # [(node, revoke, enqueue time)]
+        self.flush_waiters = []  # asyncio futures of submit(), resolved with the next update message
+        self.flush_timer = None
+        self.batch_sizes = []
+        self.batch_latencies = []  # enqueue -> publish per request, seconds
+        # journal of changed leaves per slot for delta requests (see get_poi_delta), kept if journal_size is set
+        self.version = 0  # no. of leaf changes so far
+        self.journal = [[] for _ in range(self.c.no_smt_parts)]  # [(version, leaf pos)] per slot
+        self.journal_dropped = [0] * self.c.no_smt_parts  # changes up to this version are no longer in the journal
+        self.root_versions = [{} for _ in range(self.c.no_smt_parts)]  # root -> latest version with it, per slot
+        # write-ahead log of all mutations after initialize (see ca_wal.WAL)
+        self.wal = ca_wal.WAL(self.c.wal_dir) if self.c.wal_dir else None
+        # changes of the next epoch's newest tree, built in the background (see prepare_next_epoch)
+        self.prebuild_executor = None
+        self.next_epoch = None
 
     def initialize(self):
+        # continue from the write-ahead log if there is one
+        if self.wal is not None and self.recover():
+            return
         # passive nodes
+        if self.c.setup_cache_dir:
+            self.smts = setup_cache.load_passive_smts(self.c)
         # if old passive smts file doesn't exist create it
-        if not path.exists(self.c.smt_setup_file):
+        elif not path.exists(self.c.smt_setup_file):
             for i in tqdm(range(self.c.passive_nodes)):
                 # get cert (hash)
                 cert = self.c.hash_function(str(10000000000 + i))
                 # insert to respective SMT
                 part = i % self.c.no_smt_parts
                 self.smts[part].add_node(cert)
-            # save to file
-            file = open(self.c.smt_setup_file, 'wb', pickle.HIGHEST_PROTOCOL)
-            pickle.dump(self.smts, file)
+            # save to file, with the params it was built with
+            setup_cache.save_setup_file(self.c, self.smts)
         else:
-            # load from file
-            file = open(self.c.smt_setup_file, 'rb')
-            basic_smts = pickle.load(file)
-            self.smts = basic_smts
+            # load from file, rejects files of other params
+            self.smts = setup_cache.load_setup_file(self.c)
 
         # actual nodes
         for i in tqdm(range(self.c.start_no_nodes)):
             # get cert (hash)
-            cert = self.c.hash_function(str(i))
+            cert = self.smtu.keep(self.c.hash_function(str(i)))
             # insert to respective SMT
             part = i % self.c.no_smt_parts
             self.smts[part].add_node(cert)
         self.calc_prime_root()
+        self.start_journal()
+        self.start_pooling()
+        if self.wal is not None:
+            self.wal.checkpoint(self.wal_state())
+
+    # from now on digests changed in the trees are pooled like the nodes' ones (SimConfig.intern_digests), the ones
+    # of the setup reach the nodes by reference & are not recomputed by them
+    def start_pooling(self):
+        for s in self.smts:
+            s.intern = self.c.intern_digests
+
+    def start_journal(self):
+        if self.c.journal_size:
+            for part, s in enumerate(self.smts):
+                self.root_versions[self.tree_slot(part)][s.roothash] = self.version
+
+    # key of the params the trees were built with, a log of other params is not recovered
+    def wal_key(self):
+        return setup_cache.forest_key(dict(setup_cache.forest_params(self.c), passive_nodes=self.c.passive_nodes))
+
+    # durable state, everything else (caches, journal) is rebuilt
+    def wal_state(self):
+        return {'params': self.wal_key(), 'smts': self.smts, 'rotations': self.rotations}
+
+    # load the latest snapshot & replay the log after it, returns False if there is nothing to recover
+    def recover(self):
+        state, records = self.wal.recover()
+        if state is None:
+            return False
+        if state.get('params') != self.wal_key():
+            raise ValueError(f'{self.c.wal_dir} holds a CA of other params '
+                             f'(hash_function, hash_depth, no_smt_parts, passive_nodes)')
+        self.smts = state['smts']
+        self.rotations = state['rotations']
+        wal, self.wal = self.wal, None  # do not log the replay
+        for record in records:
+            if record[0] == 'add':
+                _, node_id, part, revoke = record
+                self.add_node(node_id, part, revoke, calc_prime=False)
+            elif record[0] == 'rotate':
+                self.smts.append(self.smts.pop(0))
+                self.rotations += 1
+        self.wal = wal
+        self.calc_prime_root()
+        self.start_journal()
+        self.start_pooling()
+        logging.info(f'recovered CA from {self.c.wal_dir}, replayed {len(records)} log records')
+        return True
+
+    # make all logged mutations durable (one fsync for all of them, see ca_wal.WAL.sync) & write a snapshot now
+    # and then, before the new state is published
+    def commit(self):
+        if self.wal is None:
+            return
+        self.wal.sync()
+        if self.wal.seq - self.wal.snapshot_seq >= self.c.wal_checkpoint_every:
+            self.wal.checkpoint(self.wal_state())
+
+    # stop the pre-build & make the log durable & release it, no further mutations
+    def close(self):
+        if self.prebuild_executor is not None:
+            if self.next_epoch is not None:
+                self.next_epoch.cancel()
+                self.next_epoch = None
+            self.prebuild_executor.shutdown()
+            self.prebuild_executor = None
+        if self.wal is not None:
+            self.wal.close()
 
     def calc_prime_root(self):
         # calculate & set prime_root
+        if self.c.prime_layout == 'merkle':
+            self.prime_root = (self.smtu.merkle_levels(self.get_smt_roots())[-1][0], [], [])
+            return
         allroots = ''
         aggr_parities = ['' for _ in range(self.c.no_aggr_parities)]
         main_parities = ['' for _ in range(self.c.main_parities)]
@@ -85,17 +188,165 @@ class CA:
 
     def get_node_poi(self, node_id, part):
         cert = self.c.hash_function(str(node_id))
-        poi, poi_bm = self.smts[part].path(cert)
+        if self.c.poi_cache_size:
+            poi, poi_bm = self.get_cached_poi(cert, part)
+        else:
+            poi, poi_bm = self.smts[part].path(cert)
         if self.c.sanity_checks:
             for h in poi:
                 if h == '':
                     logging.error(f'Empty hash in poi of node: {node_id}, poi: {poi}')
         return poi.copy(), poi_bm
 
-    def add_node(self, node_id, part, revoke=False):
-        cert = self.c.hash_function(str(node_id))
+    # slot of the tree that currently is smt part, stays the same for the tree on epoch_tree_change
+    def tree_slot(self, part):
+        return (part + self.rotations) % self.c.no_smt_parts
+
+    def get_cached_poi(self, cert, part):
+        key = (self.tree_slot(part), hashf.get_int(cert))
+        entry = self.poi_cache.get(key)
+        if entry is not None:
+            self.poi_cache.move_to_end(key)
+            self.poi_cache_hits += 1
+            if self.c.sanity_checks and tuple(entry) != self.smts[part].path(cert):
+                logging.error(f'Cached poi of {cert} in part {part} is outdated: {entry}')
+            return entry
+        self.poi_cache_misses += 1
+        entry = self.poi_cache[key] = list(self.smts[part].path(cert))
+        bisect.insort(self.poi_index[key[0]], key[1])
+        if len(self.poi_cache) > self.c.poi_cache_size:
+            (old_slot, old_pos), _ = self.poi_cache.popitem(last=False)
+            index = self.poi_index[old_slot]
+            del index[bisect.bisect_left(index, old_pos)]
+        return entry
+
+    # a new (or revoked) leaf at pos changes exactly one element of every other PoI of the part:
+    # the sibling at the depth where the leaf's path splits from pos's path, ie. an ancestor of pos
+    # walk down pos's path & find the cached leaves splitting off at each depth via the prefix index
+    def update_cached_pois(self, part, pos):
+        slot = self.tree_slot(part)
+        index = self.poi_index[slot]
+        smt = self.smts[part]
+        depth = smt.depth
+        lo, hi = 0, len(index)  # cached leaves sharing pos's path down to the current depth
+        for d in range(1, depth + 1):
+            if lo >= hi:
+                break
+            shift = depth - d
+            mid = bisect.bisect_left(index, ((pos >> shift) | 1) << shift, lo, hi)
+            if (pos >> shift) & 1:
+                split_lo, split_hi, lo = lo, mid, mid
+            else:
+                split_lo, split_hi, hi = mid, hi, mid
+            if split_lo == split_hi:
+                continue
+            # new sibling of the split off leaves, '' if it became empty
+            new_hash = smt.get_hash(pos, d)
+            below = (1 << shift) - 1
+            for leaf in index[split_lo:split_hi]:
+                entry = self.poi_cache[(slot, leaf)]
+                poi, poi_bm = entry
+                # PoI is ordered bottom up, only non-empty siblings
+                i = bin(poi_bm & below).count('1')
+                if (poi_bm >> shift) & 1:
+                    if new_hash == '':
+                        del poi[i]
+                        entry[1] = poi_bm & ~(1 << shift)
+                    else:
+                        poi[i] = new_hash
+                elif new_hash != '':
+                    poi.insert(i, new_hash)
+                    entry[1] = poi_bm | (1 << shift)
+
+    # append a changed leaf of part to its journal, the part's new root is valid from this version on
+    # the journal keeps at least the last journal_size changes, older ones are dropped in bulk
+    def record_change(self, part, pos):
+        self.version += 1
+        slot = self.tree_slot(part)
+        journal = self.journal[slot]
+        journal.append((self.version, pos))
+        self.root_versions[slot][self.smts[part].roothash] = self.version
+        if len(journal) > 2 * self.c.journal_size:
+            dropped = len(journal) - self.c.journal_size
+            self.journal_dropped[slot] = journal[dropped - 1][0]
+            del journal[:dropped]
+            self.root_versions[slot] = {r: v for r, v in self.root_versions[slot].items()
+                                        if v >= self.journal_dropped[slot]}
+
+    # version of a root of part, eg. the root a node's PoI is valid for, None if unknown (or dropped)
+    def version_of_root(self, part, root):
+        return self.root_versions[self.tree_slot(part)].get(root)
+
+    # changed leaves of part since version, None if the journal does not reach back that far
+    def changes_since(self, part, version):
+        slot = self.tree_slot(part)
+        if version < self.journal_dropped[slot]:
+            return None
+        journal = self.journal[slot]
+        return [pos for _, pos in journal[bisect.bisect_left(journal, (version + 1,)):]]
+
+    # minimal delta moving a node's PoI from version to the current one, None if not possible
+    # returns {bit: sibling hash}, bit as in poi_bm (sibling at depth - bit), '' if the sibling became empty
+    # each changed leaf p only changes the sibling where p's path splits from the node's path
+    def get_poi_delta(self, node_id, part, version):
+        changes = self.changes_since(part, version)
+        if changes is None:
+            return None
+        smt = self.smts[part]
+        pos = hashf.get_int(self.c.hash_function(str(node_id)))
+        delta = {}
+        for p in changes:
+            if p == pos:  # own leaf, not part of the PoI
+                continue
+            bit = (p ^ pos).bit_length() - 1
+            if bit not in delta:
+                delta[bit] = smt.get_hash(pos ^ (1 << bit), smt.depth - bit)
+        return delta
+
+    # minimal delta moving a level-cache of part from version to the current one, None if not possible
+    # returns {index: hash}
+    def get_lvl_cache_delta(self, part, version, cache_level):
+        changes = self.changes_since(part, version)
+        if changes is None:
+            return None
+        smt = self.smts[part]
+        shift = smt.depth - cache_level
+        return {i: smt.get_hash(i << shift, cache_level) for i in {p >> shift for p in changes}}
+
+    # PoIs of many nodes, one walk per smt part (see SMT.all_paths)
+    # nodes: [(node_id, part)], returns [(poi, poi_bm)] in the same order
+    def get_node_pois(self, nodes):
+        certs = [self.c.hash_function(str(node_id)) for node_id, _ in nodes]
+        certs_per_part = {}
+        for cert, (_, part) in zip(certs, nodes):
+            certs_per_part.setdefault(part, []).append(cert)
+        paths = {part: self.smts[part].all_paths(part_certs) for part, part_certs in certs_per_part.items()}
+        pois = [paths[part][cert] for cert, (_, part) in zip(certs, nodes)]
+        if self.c.sanity_checks:
+            for (node_id, _), (poi, _) in zip(nodes, pois):
+                for h in poi:
+                    if h == '':
+                        logging.error(f'Empty hash in poi of node: {node_id}, poi: {poi}')
+        return pois
+
+    def add_node(self, node_id, part, revoke=False, calc_prime=True):
+        cert = self.smtu.keep(self.c.hash_function(str(node_id)))
+        if self.wal is not None:
+            self.wal.append(('add', node_id, part, revoke))
+        if part == 0 and self.next_epoch is not None:
+            # the pre-build reads the oldest tree, let it finish first, the switch then sees the changed root
+            wait([self.next_epoch])
         self.smts[part].add_node(cert, revoke)
-        self.calc_prime_root()
+        self.leaf_changed(part, hashf.get_int(cert))
+        if calc_prime:
+            self.calc_prime_root()
+
+    # keep cached PoIs & the journal up to date with a changed leaf of part
+    def leaf_changed(self, part, pos):
+        if self.poi_index[self.tree_slot(part)]:
+            self.update_cached_pois(part, pos)
+        if self.c.journal_size:
+            self.record_change(part, pos)
 
     def get_lvl_caches(self, cache_level):
         lvl_caches = []
@@ -107,13 +358,17 @@ class CA:
         for n in nodes:
             n.smt_part = self.c.no_smt_parts - 1  # put in latest SMT
             n.revoked = False
-            self.add_node(n.node_id, n.smt_part)
+            self.add_node(n.node_id, n.smt_part, calc_prime=False)
+        self.calc_prime_root()
+        self.commit()
         logging.info(f're-issued {len(nodes)} nodes: {[n.node_id for n in nodes]}')
 
     def revoke_nodes(self, nodes: List[Node]):
         for n in nodes:
             n.revoked = True
-            self.add_node(n.node_id, n.smt_part, True)
+            self.add_node(n.node_id, n.smt_part, True, calc_prime=False)
+        self.calc_prime_root()
+        self.commit()
         logging.info(f'revoked {len(nodes)} nodes: {[n.node_id for n in nodes]}')
 
     def construct_update(self, nodes: List[Node], revoke):
@@ -124,6 +379,88 @@ class CA:
             update.append((n.smt_part, n.cert, poi, poi_bm, revoke))
         return update
 
+    # apply revocations & re-issues as one tree mutation with a single prime root calculation
+    # requests: [(node, revoke)], returns the update message (update, prime_root),
+    # update = [(part, hash, poi, bm, revoked)] in request order, all PoIs valid for the new roots
+    def apply_batch(self, requests):
+        for n, revoke in requests:
+            if revoke:
+                n.revoked = True
+            else:
+                n.smt_part = self.c.no_smt_parts - 1  # put in latest SMT
+                n.revoked = False
+            self.add_node(n.node_id, n.smt_part, revoke, calc_prime=False)
+        self.calc_prime_root()
+        self.commit()
+        update = []
+        for n, revoke in requests:
+            poi, poi_bm = self.get_node_poi(n.node_id, n.smt_part)
+            update.append((n.smt_part, n.cert, poi, poi_bm, revoke))
+        logging.info(f'applied batch of {len(requests)} requests, '
+                     f'{sum(1 for _, revoke in requests if revoke)} revocations')
+        return update, self.prime_root
+
+    # queue revocations (revoke=True) or re-issues of nodes, flushes once batch_max_size requests are queued
+    # or the oldest one waited batch_max_delay, returns the update message of the flush or None
+    def enqueue(self, nodes: List[Node], revoke):
+        now = time.perf_counter()
+        self.pending.extend((n, revoke, now) for n in nodes)
+        if len(self.pending) >= self.c.batch_max_size:
+            return self.flush()
+        return self.poll()
+
+    # flush if the deadline of the oldest queued request has passed
+    def poll(self):
+        if self.pending and time.perf_counter() - self.pending[0][2] >= self.c.batch_max_delay:
+            return self.flush()
+        return None
+
+    # apply all queued requests now, returns the update message or None if nothing was queued
+    def flush(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if not self.pending:
+            return None
+        pending = self.pending
+        self.pending = []
+        message = self.apply_batch([(n, revoke) for n, revoke, _ in pending])
+        now = time.perf_counter()
+        self.batch_sizes.append(len(pending))
+        self.batch_latencies.extend(now - t for _, _, t in pending)
+        waiters = self.flush_waiters
+        self.flush_waiters = []
+        for w in waiters:
+            if not w.done():
+                w.set_result(message)
+        return message
+
+    # asyncio version of enqueue, returns the update message of the batch the nodes were published in
+    async def submit(self, nodes: List[Node], revoke):
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self.flush_waiters.append(waiter)
+        self.enqueue(nodes, revoke)
+        if self.pending and self.flush_timer is None:
+            delay = self.c.batch_max_delay - (time.perf_counter() - self.pending[0][2])
+            self.flush_timer = loop.call_later(max(0, delay), self.flush)
+        return await waiter
+
+    # enqueue -> publish latency of all flushed requests
+    def batch_stats(self):
+        if not self.batch_latencies:
+            return None
+        latencies = sorted(self.batch_latencies)
+        return {
+            'batches': len(self.batch_sizes),
+            'requests': len(latencies),
+            'avg_batch_size': len(latencies) / len(self.batch_sizes),
+            'avg_latency': sum(latencies) / len(latencies),
+            'p50_latency': latencies[len(latencies) // 2],
+            'p99_latency': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            'max_latency': latencies[-1]
+        }
+
     def get_unique_hash_count(self, update):
         unique_hashes = set()
         for u in update:
@@ -131,17 +468,84 @@ class CA:
                 unique_hashes.add(h)
         return unique_hashes
 
+    # start building the newest tree of the next epoch in the background: the oldest tree plus the certs of
+    # known new issues, only the changed LUT entries are built (on top of the oldest tree's LUT), the switch
+    # merges them; writes to the oldest tree wait for the build & make the switch insert synchronously
+    def prepare_next_epoch(self, node_ids):
+        if self.prebuild_executor is None:
+            self.prebuild_executor = ThreadPoolExecutor(1)
+        elif self.next_epoch is not None:
+            self.next_epoch.cancel()  # replaced, never merged
+        oldest = self.smts[0]
+        self.next_epoch = self.prebuild_executor.submit(self.build_next_epoch, oldest.nodes, oldest.roothash,
+                                                        list(node_ids))
+
+    # returns (base root, node ids, certs, changed LUT entries, new root)
+    def build_next_epoch(self, base_nodes, base_root, node_ids):
+        incoming = SMT(self.c.hash_function, self.c.hash_depth)
+        incoming.intern = self.c.intern_digests
+        incoming.nodes = OverlayNodes(base_nodes)
+        incoming.roothash = base_root
+        certs = [self.smtu.keep(self.c.hash_function(str(node_id))) for node_id in node_ids]
+        for cert in certs:
+            incoming.add_node(cert)
+        return base_root, node_ids, certs, incoming.nodes.delta, incoming.roothash
+
+    # insert the pre-built new issues into the oldest tree, in place
+    def merge_next_epoch(self):
+        base_root, node_ids, certs, delta, roothash = self.next_epoch.result()
+        self.next_epoch = None
+        oldest = self.smts[0]
+        if oldest.roothash != base_root:
+            # the oldest tree changed since, insert synchronously
+            for node_id in node_ids:
+                self.add_node(node_id, 0, calc_prime=False)
+            return
+        for key, val in delta.items():
+            if val is DELETED:
+                oldest.nodes.pop(key)
+            else:
+                oldest.nodes[key] = val
+        oldest.roothash = roothash
+        for node_id, cert in zip(node_ids, certs):
+            if self.wal is not None:
+                self.wal.append(('add', node_id, 0, False))
+            self.leaf_changed(0, hashf.get_int(cert))
+
     def epoch_tree_change(self):
-        tmp_smt = self.smts[0]
-        # shift all smts
-        for i in range(self.c.no_smt_parts - 1):
-            self.smts[i] = self.smts[i + 1]
-        self.smts[-1] = tmp_smt
+        if self.next_epoch is not None:
+            self.merge_next_epoch()
+        if self.wal is not None:
+            self.wal.append(('rotate',))
+        # the oldest tree becomes the newest part, its storage is reused & its nodes keep their leaves
+        # (see BigNetSim.epoch_update_nodes), shift all smts, cached PoIs stay with their trees
+        self.smts.append(self.smts.pop(0))
+        self.rotations += 1
         self.calc_prime_root()  # recalculate prime
+        self.commit()
+
+    # sub-tree caches of a cacher's hybrid cache for part (see Cacher.sub_caches), along the position of the
+    # cacher's cert: the i-th one is below the parent of the i-th non-empty sibling of that path from depth
+    # cache_level - depths[0] + 1 on & reaches depths[i] levels down
+    def get_sub_caches(self, node_id, part, cache_level, depths):
+        smt = self.smts[part]
+        pos = hashf.get_int(self.c.hash_function(str(node_id)))
+        sub_caches = []
+        j = max(0, cache_level - depths[0] + 1) if depths else smt.depth
+        for d in depths:
+            # next non-empty sibling, at depth j + 1
+            while j + d <= smt.depth and smt.get_hash(pos ^ (1 << smt.depth - 1 - j), j + 1) == '':
+                j += 1
+            if j + d > smt.depth:
+                break
+            sub_cache = smt.construct_sub_cache(pos, j, d)
+            sub_caches.append((pos & ~(2 ** (smt.depth - j) - 1), j, j + d, sub_cache))
+            j += 1
+        return sub_caches
 
-    def get_some_lvl_caches(self, outdated_roots):
+    def get_some_lvl_caches(self, outdated_roots, cache_level=None):
         # some_lvl_caches = (smt_part, lvl_cache)
-        lvl_caches = self.get_lvl_caches(self.c.cache_level)
+        lvl_caches = self.get_lvl_caches(self.c.cache_level if cache_level is None else cache_level)
         some_lvl_caches = []
         for r in outdated_roots:
             some_lvl_caches.append((r, lvl_caches[r]))
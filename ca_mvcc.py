@@ -0,0 +1,167 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ca import CA
+from smt import SMT
+
+
+# multi-version LUT of a SMT: own changes on top of older versions, newest layer first
+# published versions are never changed, writers only write to a fresh child version
+class VersionNodes:
+    __slots__ = ('layers',)
+
+    def __init__(self, layers):
+        self.layers = layers  # tuple of dicts, '' marks entries removed in that version
+
+    def get(self, key, default=None):
+        for layer in self.layers:
+            val = layer.get(key)
+            if val is not None:
+                return default if val == '' else val
+        return default
+
+    def __getitem__(self, key):
+        result = self.get(key)
+        if result is None:
+            raise KeyError(key)
+        return result
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    # entries of this version, newest layer wins & removed entries are skipped
+    def items(self):
+        seen = set()
+        last = len(self.layers) - 1
+        for i, layer in enumerate(self.layers):
+            for key, val in layer.items():
+                if key in seen:
+                    continue
+                if i < last:
+                    seen.add(key)
+                if val != '':
+                    yield key, val
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return (val for _, val in self.items())
+
+    def __len__(self):
+        return sum(1 for _ in self.items())
+
+    def __setitem__(self, key, val):
+        self.layers[0][key] = val
+
+    def pop(self, key):
+        result = self[key]
+        self.layers[0][key] = ''
+        return result
+
+    # new writable version on top of this one
+    def child(self):
+        return VersionNodes(({},) + self.layers)
+
+    # finish a written version: drop it if nothing changed, merge the delta layers if there are too many
+    # the base stays shared, so merging only costs the changes on top of it, removal marks have to stay
+    def freeze(self, max_layers):
+        if not self.layers[0]:
+            return VersionNodes(self.layers[1:])
+        if len(self.layers) <= max_layers:
+            return self
+        merged = {}
+        for layer in reversed(self.layers[:-1]):
+            merged.update(layer)
+        return VersionNodes((merged, self.layers[-1]))
+
+
+# consistent read-only state of the CA: trees, roots & prime root of one version
+class Snapshot:
+    def __init__(self, version, smts, prime_root):
+        self.version = version
+        self.smts = smts
+        self.smt_roots = [s.roothash for s in smts]
+        self.prime_root = prime_root
+
+
+# serves PoIs, level-caches & prime roots from a thread pool while the CA changes (MVCC):
+# writers change the CA one at a time on new versions of all trees & publish a new snapshot atomically,
+# readers take the current snapshot without any lock & answer from it, tagged with its version
+# note: on a GIL build of CPython reads only overlap with writes, they only scale with free-threading
+class MVCCServer:
+    def __init__(self, ca: CA, workers=4, max_layers=8):
+        self.ca = ca
+        self.max_layers = max_layers
+        self.write_lock = threading.Lock()  # only taken by writers
+        for s in self.ca.smts:
+            s.nodes = VersionNodes((s.nodes,))
+        self.version = 0
+        self.snapshot = self.take_snapshot()
+        self.executor = ThreadPoolExecutor(workers)
+
+    def take_snapshot(self):
+        smts = []
+        for s in self.ca.smts:
+            # read-only tree, sharing the published version of the LUT
+            view = SMT(s.hash_function, s.depth)
+            view.nodes = s.nodes
+            view.roothash = s.roothash
+            smts.append(view)
+        return Snapshot(self.version, smts, self.ca.get_prime())
+
+    # run a CA mutation, e.g. write(ca.revoke_nodes, nodes), readers see all of its changes or none
+    # all changes of the CA have to go through here once the server is running
+    def write(self, mutation, *args):
+        with self.write_lock:
+            for s in self.ca.smts:
+                s.nodes = s.nodes.child()
+            try:
+                return mutation(*args)
+            finally:
+                for s in self.ca.smts:
+                    s.nodes = s.nodes.freeze(self.max_layers)
+                self.version += 1
+                self.snapshot = self.take_snapshot()  # publish
+
+    def revoke_nodes(self, nodes):
+        return self.write(self.ca.revoke_nodes, nodes)
+
+    def reissue_nodes(self, nodes):
+        return self.write(self.ca.reissue_nodes, nodes)
+
+    def epoch_tree_change(self):
+        return self.write(self.ca.epoch_tree_change)
+
+    # returns (poi, poi_bm, version, smt_root, prime_root), the PoI is valid for exactly this root & prime
+    def get_node_poi(self, node_id, part):
+        snapshot = self.snapshot
+        poi, poi_bm = snapshot.smts[part].path(self.ca.c.hash_function(str(node_id)))
+        return poi, poi_bm, snapshot.version, snapshot.smt_roots[part], snapshot.prime_root
+
+    # returns (lvl_caches, version, prime_root)
+    def get_lvl_caches(self, cache_level):
+        snapshot = self.snapshot
+        return [s.construct_lvl_cache(cache_level) for s in snapshot.smts], snapshot.version, snapshot.prime_root
+
+    # returns (prime_root, version)
+    def get_prime(self):
+        snapshot = self.snapshot
+        return snapshot.prime_root, snapshot.version
+
+    # answer requests on the thread pool, returns futures
+    def submit_node_poi(self, node_id, part):
+        return self.executor.submit(self.get_node_poi, node_id, part)
+
+    def submit_lvl_caches(self, cache_level):
+        return self.executor.submit(self.get_lvl_caches, cache_level)
+
+    # nodes: [(node_id, part)], answers in the same order
+    def get_node_pois(self, nodes):
+        return list(self.executor.map(lambda n: self.get_node_poi(*n), nodes))
+
+    def shutdown(self):
+        self.executor.shutdown()
@@ -0,0 +1,148 @@
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+# write-ahead log of CA mutations with group commit & snapshots
+# records are appended in memory & made durable by sync(): one write + fsync covers all records appended so far,
+# concurrent callers wait for the running sync & are covered by the next one (group commit)
+# files in wal_dir: snapshot.pkl (state & seq of the last record it contains) & log segments <first seq - 1>.log,
+# a checkpoint writes a new snapshot & starts a new segment, older segments are deleted
+# record: payload length (u32) | crc32 of payload (u32) | seq (u64) | pickled payload
+
+RECORD = struct.Struct('<IIQ')
+SNAPSHOT = 'snapshot.pkl'
+
+
+def fsync_dir(path):
+    # not possible on every OS, renames are still atomic there
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class WAL:
+    def __init__(self, wal_dir):
+        self.wal_dir = wal_dir
+        os.makedirs(wal_dir, exist_ok=True)
+        self.cond = threading.Condition()
+        self.buffer = []  # encoded records not written yet
+        self.seq = 0  # last appended record
+        self.durable = 0  # last record on disk
+        self.snapshot_seq = 0  # last record contained in the snapshot
+        self.syncing = False
+        self.file = None
+
+    def segments(self):
+        return sorted(int(f[:-4]) for f in os.listdir(self.wal_dir) if f.endswith('.log'))
+
+    def segment_path(self, start):
+        return os.path.join(self.wal_dir, f'{start:020d}.log')
+
+    def open_segment(self, start):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.segment_path(start), 'ab')
+
+    # returns (state, [records after the snapshot]) or (None, []) if there is no snapshot
+    # a torn record at the end of the log (crash during a write) is cut off
+    def recover(self):
+        snapshot_path = os.path.join(self.wal_dir, SNAPSHOT)
+        if not os.path.exists(snapshot_path):
+            # records without a snapshot to apply them to (crash before the first checkpoint)
+            for start in self.segments():
+                os.remove(self.segment_path(start))
+            return None, []
+        with open(snapshot_path, 'rb') as fp:
+            snapshot = pickle.load(fp)
+        self.seq = self.durable = self.snapshot_seq = snapshot['seq']
+        records = []
+        segments = self.segments()
+        for i, start in enumerate(segments):
+            path = self.segment_path(start)
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            off = 0
+            while off + RECORD.size <= len(data):
+                length, crc, seq = RECORD.unpack_from(data, off)
+                payload = data[off + RECORD.size:off + RECORD.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                if seq > self.seq:
+                    records.append(pickle.loads(payload))
+                    self.seq = self.durable = seq
+                off += RECORD.size + length
+            if off < len(data):
+                with open(path, 'r+b') as fp:
+                    fp.truncate(off)
+                # nothing after a torn record is valid
+                for later in segments[i + 1:]:
+                    os.remove(self.segment_path(later))
+                segments = segments[:i + 1]
+                break
+        self.open_segment(segments[-1] if segments else self.snapshot_seq)
+        return snapshot['state'], records
+
+    # returns the record's seq, the record is only durable after sync()
+    def append(self, record):
+        payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        with self.cond:
+            self.seq += 1
+            self.buffer.append(RECORD.pack(len(payload), zlib.crc32(payload), self.seq) + payload)
+            return self.seq
+
+    # make all records appended so far durable
+    def sync(self):
+        with self.cond:
+            target = self.seq
+            while self.durable < target:
+                if self.syncing:
+                    self.cond.wait()
+                    continue
+                self.syncing = True
+                data = b''.join(self.buffer)
+                self.buffer = []
+                last = self.seq
+                self.cond.release()
+                written = False
+                try:
+                    if self.file is None:
+                        self.open_segment(self.snapshot_seq)
+                    self.file.write(data)
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                    written = True
+                finally:
+                    self.cond.acquire()
+                    self.syncing = False
+                    if written:
+                        self.durable = last
+                    self.cond.notify_all()
+
+    # write a snapshot of state, which has to contain all records appended so far (no concurrent appends)
+    def checkpoint(self, state):
+        self.sync()
+        seq = self.durable
+        snapshot_path = os.path.join(self.wal_dir, SNAPSHOT)
+        with open(snapshot_path + '.tmp', 'wb') as fp:
+            pickle.dump({'seq': seq, 'state': state}, fp, pickle.HIGHEST_PROTOCOL)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(snapshot_path + '.tmp', snapshot_path)
+        fsync_dir(self.wal_dir)
+        self.snapshot_seq = seq
+        # older segments only hold records of the snapshot
+        self.open_segment(seq)
+        for start in self.segments():
+            if start < seq:
+                os.remove(self.segment_path(start))
+
+    def close(self):
+        self.sync()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
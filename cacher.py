@@ -1,15 +1,29 @@
 from node import Node
+import hashf
 import logging
 
 
 class Cacher(Node):
-    def __init__(self, cache_level, lvl_caches, node_id, smt_part, poi, poi_bm, smt_roots, prime_root, config):
+    def __init__(self, cache_level, lvl_caches, node_id, smt_part, poi, poi_bm, smt_roots, prime_root, config,
+                 sub_caches=None):
         super().__init__(node_id, smt_part, poi, poi_bm, smt_roots, prime_root, config)
         self.cache_level = cache_level
         self.lvl_caches = lvl_caches  # level-cache per smt_part
+        # sub-tree caches of the hybrid cache per smt_part (see CA.get_sub_caches), kept up to date from updates
+        # [(root pos, root depth, entry depth, {(pos, depth): hash})], empty if not (no longer) known
+        self.sub_caches = sub_caches if sub_caches is not None else [[] for _ in lvl_caches]
         self.outdated_lvlc = False
         self.outdated_roots = []
         self.update_try_lvlc = 0
+        # PoI segments served for lvl-cache repairs, part -> (lvl-cache version, {prefix: segment})
+        # a part's version is increased on every change of its lvl-cache (see lvl_cache_changed)
+        self.lvl_cache_versions = [0] * len(lvl_caches)
+        self.lvlc_memo = {}
+        self.lvlc_memo_hits = 0
+        self.lvlc_memo_misses = 0
+        # tree above each lvl-cache up to the part root (see SMTutil.lvl_cache_tree), None if not built since the last
+        # change of the lvl-cache
+        self.lvl_cache_trees = [None] * len(lvl_caches)
 
     def __str__(self):
         return super().__str__() + f', outdated_lvlc: {self.outdated_lvlc}'
@@ -21,10 +35,76 @@ class Cacher(Node):
             some_lvl_caches.append((r, self.lvl_caches[r]))
         return some_lvl_caches
 
+    # set an entry of each sub-tree cache of part the leaf of an update PoI is in
+    def update_sub_caches(self, part, cert, poi, poi_bm, revoked=False):
+        depth = self.smtu.depth
+        pos = hashf.get_int(cert)
+        for root_pos, root_depth, entry_depth, sub_cache in self.sub_caches[part]:
+            if pos & ~(2 ** (depth - root_depth) - 1) != root_pos:
+                continue
+            entry_pos = pos & ~(2 ** (depth - entry_depth) - 1)
+            entry = self.smtu.calc_path_root(cert, poi, poi_bm, entry_depth, revoked)
+            if entry == '':
+                sub_cache.pop((entry_pos, entry_depth), None)
+            else:
+                sub_cache[(entry_pos, entry_depth)] = self.smtu.keep(entry)
+
+    # sub-tree caches of parts whose root changed without an update, until the CA sends them again
+    def drop_sub_caches(self, parts):
+        for p in parts:
+            self.sub_caches[p] = []
+
+    # has to be called after changing the lvl-cache of part, None = all parts
+    def lvl_cache_changed(self, part=None):
+        for p in range(len(self.lvl_caches)) if part is None else [part]:
+            self.lvl_cache_versions[p] += 1
+            self.lvl_cache_trees[p] = None
+
+    # root of the lvl-cache of part, only hashed again after a change
+    def lvl_cache_root(self, part):
+        if self.lvl_cache_trees[part] is None:
+            self.lvl_cache_trees[part] = self.smtu.lvl_cache_tree(self.lvl_caches[part], self.cache_level)
+        return self.lvl_cache_trees[part][0][0]
+
+    def lvl_caches_outdated(self):
+        return any(self.lvl_cache_root(i) != self.smt_roots[i] for i in range(self.c.no_smt_parts))
+
+    # merge the PoI of a leaf of part into the lvl-cache: the entry above the leaf & its sibling entry (part of the PoI)
+    # are set, only they & their ancestors are hashed
+    # returns if the lvl-cache of part matches its root now
+    def merge_poi(self, part, cert, poi, poi_bm, revoked=False):
+        entry = self.smtu.calc_path_root(cert, poi, poi_bm, self.cache_level, revoked)
+        self.lvl_cache_root(part)
+        index = self.smtu.lvl_cache_prefix(cert, self.cache_level)
+        levels = self.lvl_cache_trees[part]
+        # sibling on the cache level, PoI is ordered bottom up with only non-empty siblings
+        bit = self.smtu.depth - self.cache_level
+        sibling = poi[bin(poi_bm & ((1 << bit) - 1)).count('1')] if (poi_bm >> bit) & 1 else ''
+        levels[-1][index ^ 1] = self.smtu.keep(sibling)
+        root = self.smtu.update_lvl_cache_tree(levels, index, entry)
+        self.lvl_cache_versions[part] += 1  # the tree stays valid
+        return root == self.smt_roots[part]
+
+    # top cache_level PoI hashes of leaves of part with this prefix (see SMTutil.lvl_cache_segment), computed once per
+    # prefix & lvl-cache version
+    def get_lvlc_segment(self, part, prefix):
+        version = self.lvl_cache_versions[part]
+        memo = self.lvlc_memo.get(part)
+        if memo is None or memo[0] != version:
+            memo = self.lvlc_memo[part] = (version, {})
+        segment = memo[1].get(prefix)
+        if segment is None:
+            self.lvlc_memo_misses += 1
+            segment = memo[1][prefix] = self.smtu.lvl_cache_segment(prefix, self.lvl_caches[part], self.cache_level)
+        else:
+            self.lvlc_memo_hits += 1
+        return segment
+
     def update_some_lvl_caches(self, some_lvl_caches):
         # some_lvl_caches = (smt_part, lvl_cache)
         for c in some_lvl_caches:
             self.lvl_caches[c[0]] = c[1]
+            self.lvl_cache_changed(c[0])
 
         # DEBUG sanity-check:
         if self.c.sanity_checks and not self.outdated_prime:
@@ -37,15 +117,24 @@ class Cacher(Node):
     def process_update(self, update):
         # update each lvl-cache
         for u in update:
-            self.smtu.update_lvl_cache_with_poi(u[1], u[2], u[3], self.lvl_caches[u[0]], self.cache_level, u[4])
+            if self.sub_caches[u[0]]:
+                self.update_sub_caches(u[0], u[1], u[2], u[3], u[4])
+            if self.c.lvlc_poi_merge:
+                self.merge_poi(u[0], u[1], u[2], u[3], u[4])
+            else:
+                self.smtu.update_lvl_cache_with_poi(u[1], u[2], u[3], self.lvl_caches[u[0]], self.cache_level, u[4])
+                self.lvl_cache_changed(u[0])
 
         # check if level-cache is now good
         if self.outdated_lvlc and not self.outdated_prime:
-            any_outdated = False
-            for i in range(self.c.no_smt_parts):
-                if self.smt_roots[i] != self.smtu.lvl_cache_helper(0, 0, self.lvl_caches[i], self.cache_level):
-                    any_outdated = True
-            self.outdated_lvlc = any_outdated
+            if self.c.lvlc_poi_merge:
+                self.outdated_lvlc = self.lvl_caches_outdated()
+            else:
+                any_outdated = False
+                for i in range(self.c.no_smt_parts):
+                    if self.smt_roots[i] != self.smtu.lvl_cache_helper(0, 0, self.lvl_caches[i], self.cache_level):
+                        any_outdated = True
+                self.outdated_lvlc = any_outdated
 
         # DEBUG sanity-check:
         if self.c.sanity_checks and not self.outdated_lvlc and not self.outdated_prime:
@@ -63,6 +152,12 @@ class Cacher(Node):
             self.outdated_lvlc = True
         return super().set_prime_id_wrong_parts(prime_root)
 
+    def set_prime_merkle_wrong_parts(self, prime_root, helper_smt_roots):
+        # check if outdated in some regard
+        if prime_root != self.prime_root:
+            self.outdated_lvlc = True
+        return super().set_prime_merkle_wrong_parts(prime_root, helper_smt_roots)
+
     def set_ided_smt_roots(self, selected_smt_roots):
         # identify outdated roots to update cache
         outdated_roots = []
@@ -70,4 +165,5 @@ class Cacher(Node):
             if r[1] != self.smt_roots[r[0]]:
                 outdated_roots.append(r[0])
         self.outdated_roots = outdated_roots
+        self.drop_sub_caches(outdated_roots)
         return super().set_ided_smt_roots(selected_smt_roots)
@@ -1,6 +1,8 @@
 import hashlib
 import random
 import time
+import contextvars
+from contextlib import contextmanager
 
 
 # mini-version with 32Bit digest for testing
@@ -24,6 +26,10 @@ def minhash(text):
     return hashlib.sha256(text.encode("UTF-8")).hexdigest()
 
 
+# available hash functions by name
+hash_functions = {'minihash': minihash, 'miniminhash': miniminhash, 'minhash': minhash}
+
+
 def hashadd(hash_function, hash1, hash2):
     return hash_function(hash1 + hash2)
 
@@ -53,3 +59,104 @@ def get_empty_hash_list(hf, bit_length):
         tmp = hashadd(hf, tmp, tmp)
         result.append(tmp)
     return result
+
+
+# hash accounting: attribute hash calls & hashed bytes to a node and a logical operation
+# only active for hash functions wrapped via HashAccounting.wrap(), raw functions have no overhead
+acc_node = contextvars.ContextVar('acc_node', default=None)
+acc_op = contextvars.ContextVar('acc_op', default=None)
+
+
+class HashAccounting:
+    def __init__(self):
+        self.counts = {}  # (node, op) -> [calls, bytes], current epoch
+        self.epochs = []  # closed epochs, same layout as counts
+
+    # wrap a hash function, so each call is counted for the current node & op
+    def wrap(self, hash_function):
+        if isinstance(hash_function, CountedHash):
+            hash_function = hash_function.hash_function
+        return CountedHash(hash_function, self)
+
+    # attribute all hashes inside the scope to node & op
+    @contextmanager
+    def scope(self, node, op):
+        node_token = acc_node.set(node)
+        op_token = acc_op.set(op)
+        try:
+            yield
+        finally:
+            acc_op.reset(op_token)
+            acc_node.reset(node_token)
+
+    # close current epoch and start counting a new one
+    def close_epoch(self):
+        self.epochs.append(self.counts)
+        self.counts = {}
+
+    # all counts over closed & current epochs
+    def all_epochs(self):
+        epochs = self.epochs.copy()
+        if self.counts:
+            epochs.append(self.counts)
+        return epochs
+
+    # totals per op: op -> [calls, bytes]
+    def per_op(self, counts=None):
+        result = {}
+        for epoch in ([counts] if counts is not None else self.all_epochs()):
+            for (_, op), v in epoch.items():
+                total = result.setdefault(op, [0, 0])
+                total[0] += v[0]
+                total[1] += v[1]
+        return result
+
+    # totals per node: node -> [calls, bytes]
+    def per_node(self, counts=None, op=None):
+        result = {}
+        for epoch in ([counts] if counts is not None else self.all_epochs()):
+            for (node, k_op), v in epoch.items():
+                if op is not None and k_op != op:
+                    continue
+                total = result.setdefault(node, [0, 0])
+                total[0] += v[0]
+                total[1] += v[1]
+        return result
+
+    # histogram of hash calls per node, power of two buckets: bucket -> no. of nodes
+    # bucket b holds nodes with 2**(b-1) < calls <= 2**b, bucket 0 holds nodes with 0 or 1 calls
+    def node_histogram(self, counts=None, op=None):
+        histogram = {}
+        for node, v in self.per_node(counts, op).items():
+            if node is None:  # not attributed to any node
+                continue
+            bucket = max(0, (v[0] - 1).bit_length())
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+        return dict(sorted(histogram.items()))
+
+    # one histogram per epoch
+    def epoch_histograms(self, op=None):
+        return [self.node_histogram(e, op) for e in self.all_epochs()]
+
+
+# counting wrapper for a hash function, pickles as the raw hash function
+class CountedHash:
+    def __init__(self, hash_function, accounting):
+        self.hash_function = hash_function
+        self.accounting = accounting
+
+    def __call__(self, text):
+        key = (acc_node.get(), acc_op.get())
+        count = self.accounting.counts.get(key)
+        if count is None:
+            count = self.accounting.counts[key] = [0, 0]
+        count[0] += 1
+        count[1] += len(text)
+        return self.hash_function(text)
+
+    def __reduce__(self):
+        return _raw_hash_function, (self.hash_function,)
+
+
+def _raw_hash_function(hash_function):
+    return hash_function
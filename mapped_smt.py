@@ -0,0 +1,264 @@
+import bisect
+import mmap
+import os
+import pickle
+import struct
+
+import hashf
+from test_smt import TestSMT
+
+# read-only, memory-mapped SMT LUT for big tests: the base tree is written once to a file & mapped by all
+# worker processes (shared page cache, no per-process copy), each worker keeps its own changes in an overlay
+# overlays work on any base LUT and reset() simply drops their changes
+# file layout: header | open addressing hash table of (level + 1, pos) -> hash | sorted leaves
+# level + 1 is stored, so an all-zero record is an empty slot
+
+MAGIC = b'VCERMAP1'
+HEADER = struct.Struct('<8sI16sIIQQQ')  # magic, depth, hf name, key bytes, val bytes, capacity, count, leaves
+EMPTY = b'\0\0'
+LOAD_FACTOR = 0.7
+DELETED = object()  # tombstone in an overlay delta, hides the entry of the base
+
+
+def slot_of(pos, level, depth, capacity):
+    # use (up to) the top 64 bits of the position & mix in the level
+    h = (pos >> max(0, depth - 64)) ^ (level * 0x9E3779B97F4A7C15)
+    h = (h * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    h ^= h >> 31
+    return h % capacity
+
+
+# write LUT & leaves of a TestSMT into a mapped file
+def write_mapped_smt(smt: TestSMT, file_name):
+    depth = smt.depth
+    if depth % 8 != 0:
+        raise ValueError(f'depth {depth} is not a multiple of 8')
+    hf_names = [k for k, v in hashf.hash_functions.items() if v is smt.hash_function]
+    if not hf_names:
+        raise ValueError(f'hash function {smt.hash_function} is not in hashf.hash_functions')
+    key_bytes = depth // 8
+    val_bytes = len(next(iter(smt.nodes.values()))) // 2
+    rec_size = 2 + key_bytes + val_bytes
+    count = len(smt.nodes)
+    capacity = int(count / LOAD_FACTOR) + 1
+    leaves = sorted(smt.int_sort_leaves)
+    table_off = HEADER.size
+    leaves_off = table_off + capacity * rec_size
+    size = leaves_off + len(leaves) * key_bytes
+
+    tmp_name = file_name + '.tmp'
+    with open(tmp_name, 'w+b') as fp:
+        fp.truncate(size)
+        mm = mmap.mmap(fp.fileno(), size)
+        mm[:HEADER.size] = HEADER.pack(MAGIC, depth, hf_names[0].encode(), key_bytes, val_bytes,
+                                       capacity, count, len(leaves))
+        for (pos, level), val in smt.nodes.items():
+            slot = slot_of(pos, level, depth, capacity)
+            while True:
+                off = table_off + slot * rec_size
+                if mm[off:off + 2] == EMPTY:
+                    break
+                slot = (slot + 1) % capacity
+            mm[off:off + rec_size] = (level + 1).to_bytes(2, 'little') + pos.to_bytes(key_bytes, 'big') + \
+                bytes.fromhex(val)
+        for i, leaf in enumerate(leaves):
+            mm[leaves_off + i * key_bytes:leaves_off + (i + 1) * key_bytes] = leaf.to_bytes(key_bytes, 'big')
+        mm.flush()
+        mm.close()
+    os.replace(tmp_name, file_name)
+
+
+# convert a pickled TestSMT file once, returns the name of the mapped file
+def prepare_mapped_smt(smt_file):
+    mapped_file = smt_file + '.map'
+    if not os.path.exists(mapped_file) or os.path.getmtime(mapped_file) < os.path.getmtime(smt_file):
+        with open(smt_file, 'rb') as fp:
+            smt = pickle.load(fp)
+        write_mapped_smt(smt, mapped_file)
+    return mapped_file
+
+
+class MappedFile:
+    def __init__(self, file_name):
+        with open(file_name, 'rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.depth, hf_name, self.key_bytes, self.val_bytes, self.capacity, self.count, self.no_leaves = \
+            HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{file_name} is not a mapped SMT file')
+        self.hash_function = hashf.hash_functions[hf_name.rstrip(b'\0').decode()]
+        self.nodes = MappedNodes(self)
+        self.leaves = MappedLeaves(self)
+
+
+# read-only dict-like view on the mapped LUT, key: (pos, level)
+class MappedNodes:
+    def __init__(self, mf: MappedFile):
+        self.mm = mf.mm
+        self.depth = mf.depth
+        self.key_bytes = mf.key_bytes
+        self.rec_size = 2 + mf.key_bytes + mf.val_bytes
+        self.rec_key_size = 2 + mf.key_bytes
+        self.capacity = mf.capacity
+        self.count = mf.count
+        self.table_off = HEADER.size
+        self.table_end = self.table_off + mf.capacity * self.rec_size
+        self.pos_shift = max(0, self.depth - 64)
+        self.level_mix = [level * 0x9E3779B97F4A7C15 for level in range(self.depth + 1)]
+
+    def get(self, key, default=None):
+        pos, level = key
+        mm = self.mm
+        rec_size = self.rec_size
+        rec_key_size = self.rec_key_size
+        # level & pos as stored, compared in one go
+        rec_key = (level + 1).to_bytes(2, 'little') + pos.to_bytes(self.key_bytes, 'big')
+        # slot_of, inlined
+        h = (((pos >> self.pos_shift) ^ self.level_mix[level]) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        off = self.table_off + (h ^ (h >> 31)) % self.capacity * rec_size
+        while True:
+            rec = mm[off:off + rec_key_size]
+            if rec == rec_key:
+                return mm[off + rec_key_size:off + rec_size].hex()
+            if not rec[0] and not rec[1]:
+                return default
+            off += rec_size
+            if off == self.table_end:
+                off = self.table_off
+
+    def __getitem__(self, key):
+        result = self.get(key)
+        if result is None:
+            raise KeyError(key)
+        return result
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return self.count
+
+
+# read-only sequence of sorted leaf positions
+class MappedLeaves:
+    def __init__(self, mf: MappedFile):
+        self.mm = mf.mm
+        self.key_bytes = mf.key_bytes
+        self.no_leaves = mf.no_leaves
+        self.leaves_off = HEADER.size + mf.capacity * (2 + mf.key_bytes + mf.val_bytes)
+
+    def __len__(self):
+        return self.no_leaves
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.no_leaves
+        if not 0 <= i < self.no_leaves:
+            raise IndexError(i)
+        off = self.leaves_off + i * self.key_bytes
+        return int.from_bytes(self.mm[off:off + self.key_bytes], 'big')
+
+
+# LUT overlay, reads fall through to the read-only base, writes & removals only go to delta
+class OverlayNodes:
+    def __init__(self, base, delta=None):
+        self.base = base
+        self.delta = {} if delta is None else delta
+
+    def get(self, key, default=None):
+        result = self.delta.get(key)
+        if result is None:
+            return self.base.get(key, default)
+        if result is DELETED:
+            return default
+        return result
+
+    def __getitem__(self, key):
+        result = self.get(key)
+        if result is None:
+            raise KeyError(key)
+        return result
+
+    def __setitem__(self, key, val):
+        self.delta[key] = val
+
+    def pop(self, key, *default):
+        result = self.get(key)
+        if result is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        if key in self.base:
+            self.delta[key] = DELETED
+        else:
+            del self.delta[key]
+        return result
+
+    def __contains__(self, key):
+        result = self.delta.get(key)
+        if result is None:
+            return key in self.base
+        return result is not DELETED
+
+
+# leaf overlay, base & delta are sorted each, only used for len() & random.choice()
+class OverlayLeaves:
+    def __init__(self, base, delta=None):
+        self.base = base
+        self.delta = [] if delta is None else delta
+
+    def __len__(self):
+        return len(self.base) + len(self.delta)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        no_base = len(self.base)
+        if i < no_base:
+            return self.base[i]
+        return self.delta[i - no_base]
+
+    def insort(self, leaf):
+        bisect.insort(self.delta, leaf)
+
+
+# TestSMT on top of a read-only base LUT, only own changes are held in memory
+class OverlaySMT(TestSMT):
+    def __init__(self, hash_function, depth, base_nodes, base_leaves):
+        super().__init__(hash_function, depth)
+        self.nodes = OverlayNodes(base_nodes)
+        self.int_sort_leaves = OverlayLeaves(base_leaves)
+        self.roothash = self.nodes.get((0, 0), '')
+
+    def insert_leaf(self, hash_bm):
+        self.int_sort_leaves.insort(hash_bm)
+
+    # discard all own changes, back to the base tree in O(1)
+    def reset(self):
+        self.nodes.delta = {}
+        self.int_sort_leaves.delta = []
+        self.roothash = self.nodes.get((0, 0), '')
+
+    # copies share the base, only the delta is copied
+    def __deepcopy__(self, memo):
+        result = OverlaySMT(self.hash_function, self.depth, self.nodes.base, self.int_sort_leaves.base)
+        result.nodes.delta = self.nodes.delta.copy()
+        result.int_sort_leaves.delta = self.int_sort_leaves.delta.copy()
+        result.roothash = self.roothash
+        return result
+
+
+# overlay on top of any TestSMT (pickled, mapped or another overlay), the given tree must not change afterwards
+def overlay_smt(smt: TestSMT):
+    return OverlaySMT(smt.hash_function, smt.depth, smt.nodes, smt.int_sort_leaves)
+
+
+# mapped files opened by this process, shared by all trees on top of them
+opened_files = {}
+
+
+def open_overlay_smt(mapped_file):
+    mf = opened_files.get(mapped_file)
+    if mf is None:
+        mf = opened_files[mapped_file] = MappedFile(mapped_file)
+    return OverlaySMT(mf.hash_function, mf.depth, mf.nodes, mf.leaves)
@@ -0,0 +1,245 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import hashf
+import setup_cache
+import smt_util
+from ca import CA
+from cacher import Cacher
+from sim import BigNetSim
+from sim_config import SimConfig
+
+# memory footprint & scaling benchmark of SMT forests, the CA & BigNetSim populations
+# e.g. forests & populations of 1k to 1M leaves/nodes, predict the footprint of 10M:
+# python3 mem_bench.py --leaves 1000 10000 100000 1000000 --nodes 1000 10000 100000 1000000 --predict 10000000
+# each measurement runs in a fresh process, so RSS is not distorted by memory freed by earlier ones
+# component sizes are deep sizes (sys.getsizeof), objects shared between components are counted for the first one
+# (tree LUT, PoIs, level-caches, roots, node objects), so PoI elements taken from the CA's trees count for the tree
+# traced = allocated during the build (tracemalloc), RSS = growth of the resident size of the process during the build
+# build & step times and RSS include the tracemalloc overhead, use --no-tracemalloc for clean ones
+
+# hash function per depth, digest length determines the tree depth
+DEPTH_HASH = {32: 'miniminhash', 256: 'minhash'}
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None  # not linux
+
+
+# deep sizes of containers, each object is only counted the first time it is seen
+class Sizer:
+    def __init__(self):
+        self.seen = set()
+
+    def size(self, obj):
+        total = 0
+        stack = [obj]
+        while stack:
+            o = stack.pop()
+            if id(o) in self.seen:
+                continue
+            self.seen.add(id(o))
+            total += sys.getsizeof(o)
+            if isinstance(o, dict):
+                stack.extend(o.keys())
+                stack.extend(o.values())
+            elif isinstance(o, (list, tuple, set, frozenset)):
+                stack.extend(o)
+        return total
+
+
+class Measurement:
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        gc.collect()
+        if self.trace:
+            tracemalloc.start()
+        self.rss = rss_bytes()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        self.traced = self.peak = None
+        if self.trace:
+            self.traced, self.peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        rss = rss_bytes()
+        self.rss = rss - self.rss if rss is not None and self.rss is not None else None
+
+
+# run a benchmark in a fresh process
+def isolated(bench, *args):
+    with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(bench, *args).result()
+
+
+def forest_config(depth):
+    c = SimConfig()
+    c.hash_function = hashf.hash_functions[DEPTH_HASH[depth]]
+    c.hash_depth = depth
+    c.recalc_fields()
+    return c
+
+
+# CA forest of leaves certs, split over the parts like the passive certs
+def bench_forest(depth, leaves, trace):
+    c = forest_config(depth)
+    with Measurement(trace) as m:
+        ca = CA(c)
+        for i in range(leaves):
+            ca.smts[i % c.no_smt_parts].add_node(c.hash_function(str(setup_cache.CERT_OFFSET + i)))
+        ca.calc_prime_root()
+    lut = Sizer().size([s.nodes for s in ca.smts])
+    return {'bench': 'forest', 'depth': depth, 'size': leaves, 'build_s': m.seconds, 'traced_bytes': m.traced,
+            'peak_bytes': m.peak, 'rss_bytes': m.rss, 'components': {'tree_lut': lut},
+            'per_unit': {'tree_lut': lut / leaves}}
+
+
+def population_config(nodes, args):
+    c = SimConfig()
+    c.sanity_checks = False
+    c.start_no_nodes = nodes
+    c.passive_nodes = args.passive_nodes
+    c.cache_level = args.cache_level
+    c.setup_cache_dir = args.setup_cache_dir
+    c.intern_digests = args.intern_digests
+    c.crn_seed = 1
+    c.recalc_fields()
+    return c
+
+
+# a BigNetSim with nodes active nodes, then steps time steps of its first sub-epoch
+def bench_population(nodes, args):
+    c = population_config(nodes, args)
+    with Measurement(args.tracemalloc) as m:
+        s = BigNetSim(c)
+
+    sizer = Sizer()
+    components = {'tree_lut': sizer.size([t.nodes for t in s.ca.smts]), 'pois': 0, 'lvl_caches': 0, 'roots': 0,
+                  'node_objects': 0, 'digest_pool': sizer.size(smt_util.digest_pool.refs)}
+    kinds = {'node': [0, 0], 'cacher': [0, 0]}  # kind -> [count, bytes]
+    for n in s.all_nodes:
+        sizes = {'pois': sizer.size(n.poi), 'lvl_caches': sizer.size(n.lvl_caches) if isinstance(n, Cacher) else 0,
+                 'roots': sizer.size(n.smt_roots) + sizer.size(n.prime_root),
+                 'node_objects': sizer.size(n) + sizer.size(n.__dict__)}
+        kind = kinds['cacher' if isinstance(n, Cacher) else 'node']
+        kind[0] += 1
+        for k, v in sizes.items():
+            components[k] += v
+            kind[1] += v
+
+    # step timing, as in BigNetSim.sim: a sub-epoch starts with a revocation update
+    # RSS growth over the steps: digests the nodes compute from updates (see SimConfig.intern_digests)
+    step_times = []
+    steps_rss = rss_bytes()
+    for t in range(args.steps):
+        start = time.perf_counter()
+        if t % c.time_steps_per_sub_epoch == 0:
+            revoke_nodes = s.sample_revoke_nodes(t)
+            update, _ = s.ca.apply_batch([(n, False) for n in s.revoked_nodes] + [(n, True) for n in revoke_nodes])
+            s.revocation_step(update, revoke_nodes, t)
+        s.encounter_step(t)
+        step_times.append(time.perf_counter() - start)
+    steps_rss = rss_bytes() - steps_rss if steps_rss is not None else None
+
+    per_unit = {k: v / nodes for k, v in components.items() if k != 'tree_lut'}
+    for k, (count, size) in kinds.items():
+        per_unit[k] = size / count if count else None
+    return {'bench': 'population', 'depth': c.hash_depth, 'size': nodes, 'build_s': m.seconds,
+            'step_s': sum(step_times) / len(step_times) if step_times else None, 'traced_bytes': m.traced,
+            'peak_bytes': m.peak, 'rss_bytes': m.rss, 'steps_rss_bytes': steps_rss, 'components': components,
+            'per_unit': per_unit}
+
+
+# least squares fit bytes = fixed + per_unit * size, per bench & depth & component
+def fit_curves(results):
+    series = {}
+    for r in results:
+        for k, v in list(r['components'].items()) + [('traced', r['traced_bytes']), ('rss', r['rss_bytes'])]:
+            if v is not None:
+                series.setdefault((r['bench'], r['depth'], k), []).append((r['size'], v))
+    curves = []
+    for (bench, depth, component), points in sorted(series.items()):
+        if len(points) < 2:
+            continue
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in points)
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x if var_x else 0
+        curves.append({'bench': bench, 'depth': depth, 'component': component, 'per_unit_bytes': slope,
+                       'fixed_bytes': mean_y - slope * mean_x})
+    return curves
+
+
+def print_result(r):
+    traced = '' if r['traced_bytes'] is None else f', traced {r["traced_bytes"] / 2 ** 20:1.2f}MB'
+    rss = '' if r['rss_bytes'] is None else f', RSS +{r["rss_bytes"] / 2 ** 20:1.2f}MB'
+    step = '' if r.get('step_s') is None else f', step {r["step_s"] * 1000:1.2f}ms'
+    if r.get('steps_rss_bytes') is not None:
+        step += f' (RSS +{r["steps_rss_bytes"] / 2 ** 20:1.2f}MB over all steps)'
+    print(f'{r["bench"]} (depth {r["depth"]}, size {r["size"]}): build {r["build_s"]:1.2f}s{step}{traced}{rss}')
+    for k, v in r['components'].items():
+        print(f'  {k}: {v / 2 ** 20:1.2f}MB')
+    print('  per ' + ('leaf' if r['bench'] == 'forest' else 'node') + ': ' +
+          ', '.join(f'{k} {v:1.0f}B' for k, v in r['per_unit'].items() if v is not None))
+
+
+def print_curves(curves, predict):
+    print('scaling curves (bytes = fixed + per unit * size):')
+    for c in curves:
+        prediction = ''.join(f', {size}: {(c["fixed_bytes"] + c["per_unit_bytes"] * size) / 2 ** 20:1.1f}MB'
+                             for size in predict)
+        print(f'  {c["bench"]} depth {c["depth"]} {c["component"]}: {c["per_unit_bytes"]:1.1f}B per unit '
+              f'{c["fixed_bytes"] / 2 ** 20:+1.2f}MB{prediction}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='memory footprint & scaling benchmark')
+    parser.add_argument('--depths', nargs='+', type=int, default=[32, 256], choices=list(DEPTH_HASH))
+    parser.add_argument('--leaves', nargs='*', type=int, default=[1000, 10000], help='forest sizes')
+    parser.add_argument('--nodes', nargs='*', type=int, default=[1000, 10000, 100000],
+                        help='population sizes (start_no_nodes), at depth 32')
+    parser.add_argument('--passive-nodes', type=int, default=100000)
+    parser.add_argument('--cache-level', type=int, default=7)
+    parser.add_argument('--setup-cache-dir', default='setup_cache', help='passive forests are built once, here')
+    parser.add_argument('--intern-digests', action='store_true', help='see SimConfig.intern_digests')
+    parser.add_argument('--steps', type=int, default=24, help='time steps timed per population')
+    parser.add_argument('--no-tracemalloc', dest='tracemalloc', action='store_false')
+    parser.add_argument('--predict', nargs='+', type=int, default=[1000000], help='sizes to extrapolate to')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args(argv)
+
+    runs = [(bench_forest, depth, leaves, args.tracemalloc) for depth in args.depths for leaves in args.leaves]
+    runs += [(bench_population, nodes, args) for nodes in args.nodes]
+    results = []
+    for bench, *bench_args in runs:
+        results.append(isolated(bench, *bench_args))
+        print_result(results[-1])
+    curves = fit_curves(results)
+    print_curves(curves, args.predict)
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'args': vars(args), 'results': results,
+                       'curves': curves}, fp, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,12 +8,12 @@ import copy
 class Node:
     def __init__(self, node_id, smt_part, poi, poi_bm, smt_roots, prime_root, config):
         self.c: sim_config.SimConfig = config
-        self.smtu = smt_util.SMTutil(self.c.hash_function, self.c.hash_depth)
+        self.smtu = smt_util.SMTutil(self.c.hash_function, self.c.hash_depth, self.c.intern_digests)
         self.smt_roots = smt_roots
         self.prime_root = prime_root
 
         self.node_id = node_id
-        self.cert = self.c.hash_function(str(node_id))
+        self.cert = self.smtu.keep(self.c.hash_function(str(node_id)))
         self.smt_part = smt_part
         self.poi = poi
         self.poi_bm = poi_bm
@@ -59,6 +59,20 @@ class Node:
         else:
             return [], []
 
+    # merkle prime layout: find the wrong parts by descending the Merkle trees of my & the helper's roots
+    # returns ([wrong parts], no. of digests the helper sent)
+    def set_prime_merkle_wrong_parts(self, prime_root, helper_smt_roots):
+        if prime_root != self.prime_root:
+            wrong_parts, sent_digests = self.smtu.merkle_diff(self.smt_roots, helper_smt_roots)
+            self.prime_root = copy.deepcopy(prime_root)
+            self.outdated_prime = False
+            return wrong_parts, sent_digests
+        else:
+            return [], 0
+
+    def get_merkle_smt_roots(self, wrong_parts):
+        return [(p, self.smt_roots[p]) for p in wrong_parts]
+
     def get_ided_smt_roots(self, wrong_aggr_par_parts, wrong_main_par_parts):
         selected_smt_roots = []
         for p in wrong_aggr_par_parts:
@@ -90,6 +104,8 @@ class Node:
 
     def calc_prime_root(self):
         # calculate & set prime_root
+        if self.c.prime_layout == 'merkle':
+            return self.smtu.merkle_levels(self.smt_roots)[-1][0], [], []
         allroots = ''
         aggr_parities = ['' for _ in range(self.c.no_aggr_parities)]
         main_parities = ['' for _ in range(self.c.main_parities)]
@@ -124,6 +140,17 @@ class Node:
         # check if successful, if so set flag & reset try counter (return it)
         return self.smt_roots[self.smt_part] == self.smtu.calc_path_root(self.cert, self.poi, self.poi_bm)
 
+    # like try_lvlc_repair, with the PoI segment a cacher computed from its level-cache (see Cacher.get_lvlc_segment)
+    def try_segment_repair(self, segment):
+        self.smtu.update_poi_with_segment(self.poi, segment)
+        return self.smt_roots[self.smt_part] == self.smtu.calc_path_root(self.cert, self.poi, self.poi_bm)
+
+    # like try_lvlc_repair, with the sub-tree caches of a cacher's hybrid cache for my part (see Cacher.sub_caches)
+    def try_sub_cache_repair(self, sub_caches):
+        for _, root_depth, _, sub_cache in sub_caches:
+            self.poi_bm = self.smtu.update_poi_with_sub_cache(self.cert, self.poi, self.poi_bm, root_depth, sub_cache)
+        return self.smt_roots[self.smt_part] == self.smtu.calc_path_root(self.cert, self.poi, self.poi_bm)
+
     def process_update(self, update):
         # update = [(part, hash, poi, bm, revoked)]
         previous_set = False
@@ -0,0 +1,284 @@
+import argparse
+import copy
+import json
+import platform
+import sys
+import time
+
+import hashf
+from ca import CA
+from sim_config import SimConfig
+from node import Node
+from smt_util import SMTutil
+
+# parametrized micro-benchmarks of individual operations (processing overhead)
+# e.g. run defaults and compare to a saved baseline:
+# python3 ops_bench.py --json bench.json --baseline bench_baseline.json
+# save new baseline:
+# python3 ops_bench.py --json bench_baseline.json
+
+PERCENTILES = [50, 90, 99]
+
+
+# fixture: CA forest where the benchmarked smt_part holds tree_size leaves, other parts only a single leaf
+class BenchSetup:
+    def __init__(self, hf_name, depth, tree_size):
+        self.hf_name = hf_name
+        self.config = SimConfig()
+        self.config.hash_function = hashf.hash_functions[hf_name]
+        self.config.hash_depth = depth
+        self.config.recalc_fields()
+        self.hf = self.config.hash_function
+        self.tree_size = tree_size
+        self.smt_part = self.config.no_smt_parts - 2
+        self.ca = CA(self.config)
+        self.smtu = SMTutil(self.hf, depth)
+        for i in range(tree_size):
+            self.ca.smts[self.smt_part].add_node(self.hf(str(10000000000 + i)))
+        for part in range(self.config.no_smt_parts):
+            if part != self.smt_part:
+                self.ca.smts[part].add_node(self.hf(str(20000000000 + part)))
+        self.ca.calc_prime_root()
+        self.next_id = 1000000
+
+    # add a fresh active node to the benchmarked part, returns (node_id, cert, poi, poi_bm)
+    def new_node(self, part=None):
+        part = self.smt_part if part is None else part
+        self.next_id += 1
+        self.ca.add_node(self.next_id, part)
+        poi, poi_bm = self.ca.get_node_poi(self.next_id, part)
+        return self.next_id, self.hf(str(self.next_id)), poi, poi_bm
+
+
+# time op(*args) for each args of setup(), one sample is the mean over inner calls
+def measure(op, samples, inner, setup=None):
+    times = []
+    for _ in range(samples):
+        args = [setup() for _ in range(inner)] if setup is not None else [()] * inner
+        start = time.perf_counter()
+        for a in args:
+            op(*a)
+        times.append((time.perf_counter() - start) / inner)
+    return times
+
+
+def percentile(sorted_values, p):
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def bench_sig_prime(bs, samples, inner, cache_level):
+    # ECDSA is optional, only needed for this benchmark
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives import hashes
+    import secrets
+    private_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    public_key = private_key.public_key()
+    msg = secrets.token_bytes(32 + 14 + 4)  # hash + 7x2 Bytes parity + timestamp
+    sig = private_key.sign(msg, ec.ECDSA(hashes.SHA256()))
+
+    # outdated node, then outdate 1 main and 2 aggr parts
+    c = bs.config
+    node_id, _, poi, poi_bm = bs.new_node(1)
+    outdated_node = Node(node_id, 1, poi, poi_bm, bs.ca.get_smt_roots(), copy.deepcopy(bs.ca.get_prime()), c)
+    for part in [c.no_smt_parts - 1, 5, 32 % c.no_smt_parts]:
+        bs.new_node(part)
+    main_id, _, main_poi, main_poi_bm = bs.new_node(c.no_smt_parts - 1)
+    main_node = Node(main_id, c.no_smt_parts - 1, main_poi, main_poi_bm, bs.ca.get_smt_roots(),
+                     copy.deepcopy(bs.ca.get_prime()), c)
+    wrong_aggr, wrong_main = copy.deepcopy(outdated_node).set_prime_id_wrong_parts(main_node.prime_root)
+    selected_smt_roots = main_node.get_ided_smt_roots(wrong_aggr, wrong_main)
+
+    def op(n):
+        public_key.verify(sig, msg, ec.ECDSA(hashes.SHA256()))
+        n.set_prime_id_wrong_parts(main_node.prime_root)
+        n.set_ided_smt_roots(selected_smt_roots)
+    return measure(op, samples, inner, lambda: (copy.deepcopy(outdated_node),))
+
+
+def bench_poi_auth(bs, samples, inner, cache_level):
+    _, cert, poi, poi_bm = bs.new_node()
+    return measure(bs.smtu.calc_path_root, samples, inner, lambda: (cert, poi, poi_bm))
+
+
+def bench_poi_updates(bs, samples, inner, cache_level, x=20):
+    _, cert, poi, poi_bm = bs.new_node()
+    update = [bs.new_node()[1:] for _ in range(x)]
+    # pois of update, after all x are inserted
+    update = [(u[0],) + bs.ca.smts[bs.smt_part].path(u[0]) for u in update]
+
+    def op(my_poi, my_poi_bm):
+        for u in update:
+            my_poi_bm = bs.smtu.update_poi_with_poi(cert, my_poi, my_poi_bm, u[0], u[1], u[2])
+        bs.smtu.calc_path_root(cert, my_poi, my_poi_bm)
+    return measure(op, samples, inner, lambda: (poi.copy(), poi_bm))
+
+
+def bench_poi_repair(bs, samples, inner, cache_level):
+    _, cert, poi, poi_bm = bs.new_node()
+    _, new_cert, new_poi, new_poi_bm = bs.new_node()
+
+    def op(my_poi, my_poi_bm):
+        my_poi_bm = bs.smtu.update_poi_with_poi(cert, my_poi, my_poi_bm, new_cert, new_poi, new_poi_bm)
+        bs.smtu.calc_path_root(cert, my_poi, my_poi_bm)
+    return measure(op, samples, inner, lambda: (poi.copy(), poi_bm))
+
+
+def bench_lvlc_repair(bs, samples, inner, cache_level):
+    _, cert, poi, poi_bm = bs.new_node()
+    for _ in range(10):
+        bs.new_node()
+    lvl_cache = bs.ca.smts[bs.smt_part].construct_lvl_cache(cache_level)
+
+    def op(my_poi):
+        bs.smtu.update_poi_with_lvl_cache(cert, my_poi, lvl_cache, cache_level)
+        bs.smtu.calc_path_root(cert, my_poi, poi_bm)
+    return measure(op, samples, inner, lambda: (poi.copy(),))
+
+
+def bench_add_node(bs, samples, inner, cache_level):
+    smt = bs.ca.smts[bs.smt_part]
+
+    def setup():
+        bs.next_id += 1
+        return (bs.hf(str(bs.next_id)),)
+    return measure(smt.add_node, samples, inner, setup)
+
+
+def bench_path(bs, samples, inner, cache_level):
+    _, cert, _, _ = bs.new_node()
+    return measure(bs.ca.smts[bs.smt_part].path, samples, inner, lambda: (cert,))
+
+
+def bench_construct_lvl_cache(bs, samples, inner, cache_level):
+    return measure(bs.ca.smts[bs.smt_part].construct_lvl_cache, samples, inner, lambda: (cache_level,))
+
+
+def bench_calc_prime_root(bs, samples, inner, cache_level):
+    return measure(bs.ca.calc_prime_root, samples, inner)
+
+
+# name -> (benchmark, depends on cache level)
+BENCHMARKS = {
+    'sig_prime_check': (bench_sig_prime, False),
+    'poi_auth': (bench_poi_auth, False),
+    'poi_updates_20': (bench_poi_updates, False),
+    'poi_repair': (bench_poi_repair, False),
+    'lvlc_repair': (bench_lvlc_repair, True),
+    'smt_add_node': (bench_add_node, False),
+    'smt_path': (bench_path, False),
+    'construct_lvl_cache': (bench_construct_lvl_cache, True),
+    'calc_prime_root': (bench_calc_prime_root, False),
+}
+
+
+def result_key(r):
+    return r['op'], r['hash_function'], r['depth'], r['tree_size'], r['cache_level']
+
+
+def run(ops, hash_functions, depths, tree_sizes, cache_levels, samples, inner):
+    results = []
+    for hf_name in hash_functions:
+        digest_bits = len(hashf.hash_functions[hf_name]('x')) * 4
+        for depth in depths:
+            # digest length determines the tree depth
+            if digest_bits != depth:
+                print(f'skipping depth {depth} for {hf_name}: its digests have {digest_bits} bits')
+                continue
+            for tree_size in tree_sizes:
+                print(f'setting up {hf_name}, depth {depth}, tree size {tree_size}...')
+                for op in ops:
+                    bench, with_cache = BENCHMARKS[op]
+                    for cache_level in (cache_levels if with_cache else [None]):
+                        # fresh setup per op, as some ops modify the tree
+                        bs = BenchSetup(hf_name, depth, tree_size)
+                        try:
+                            times = bench(bs, samples, inner, cache_level)
+                        except ImportError as e:
+                            print(f'skipping {op}: {e}')
+                            break
+                        results.append(summarize(op, hf_name, depth, tree_size, cache_level, times, inner))
+                        print_result(results[-1])
+    return results
+
+
+def summarize(op, hf_name, depth, tree_size, cache_level, times, inner):
+    times_ms = sorted(t * 1000 for t in times)
+    result = {'op': op, 'hash_function': hf_name, 'depth': depth, 'tree_size': tree_size,
+              'cache_level': cache_level, 'samples': len(times), 'inner': inner,
+              'mean_ms': sum(times_ms) / len(times_ms), 'min_ms': times_ms[0], 'max_ms': times_ms[-1]}
+    for p in PERCENTILES:
+        result[f'p{p}_ms'] = percentile(times_ms, p)
+    return result
+
+
+def print_result(r):
+    clvl = '' if r['cache_level'] is None else f', clvl {r["cache_level"]}'
+    print(f'{r["op"]} ({r["hash_function"]}, depth {r["depth"]}, size {r["tree_size"]}{clvl}): '
+          f'p50 {r["p50_ms"]:1.4f}ms, p90 {r["p90_ms"]:1.4f}ms, p99 {r["p99_ms"]:1.4f}ms, '
+          f'mean {r["mean_ms"]:1.4f}ms')
+
+
+# compare p50 to baseline, returns list of (key, baseline_p50, p50, ratio) of regressions
+def compare(results, baseline, threshold, metric='p50_ms'):
+    base = {result_key(r): r for r in baseline['results']}
+    regressions = []
+    print(f'comparison with baseline ({metric}, threshold {threshold * 100:1.0f}%):')
+    covered = {result_key(r) for r in results} & set(base)
+    if len(covered) < len(base):
+        print(f'  {len(base) - len(covered)} of {len(base)} baseline results were not run')
+    for r in results:
+        b = base.get(result_key(r))
+        if b is None:
+            continue
+        ratio = r[metric] / b[metric] if b[metric] > 0 else float('inf')
+        if ratio > 1 + threshold:
+            status = 'REGRESSION'
+            regressions.append((result_key(r), b[metric], r[metric], ratio))
+        elif ratio < 1 - threshold:
+            status = 'improved'
+        else:
+            status = 'ok'
+        print(f'  {status:<10} {"/".join(str(k) for k in result_key(r) if k is not None)}: '
+              f'{b[metric]:1.4f}ms -> {r[metric]:1.4f}ms ({ratio:1.2f}x)')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='micro-benchmarks of individual operations')
+    parser.add_argument('--ops', nargs='+', default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument('--hash-functions', nargs='+', default=['minhash'], choices=list(hashf.hash_functions))
+    parser.add_argument('--depths', nargs='+', type=int, default=[256])
+    parser.add_argument('--tree-sizes', nargs='+', type=int, default=[10000])
+    parser.add_argument('--cache-levels', nargs='+', type=int, default=[7])
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--inner', type=int, default=100, help='calls per sample')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare with results of a previous run')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown flagged as regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.ops, args.hash_functions, args.depths, args.tree_sizes, args.cache_levels,
+                  args.samples, args.inner)
+    if not results:
+        print('no benchmark ran, check that --depths match the digest lengths of --hash-functions')
+        return 2
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, fp, indent=1)
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,3 @@
-import copy
 import time
 import random
 import pickle
@@ -9,24 +8,97 @@ from tqdm import tqdm
 import hashf
 from test_smt import TestSMT
 from smt_util import SMTutil
+import mapped_smt
+
+
+# trees loaded before the worker processes were forked (see share_smt), inherited by them copy-on-write
+shared_smts = {}
+
+
+# load a pickled TestSMT, or an overlay on a shared tree: inherited from the parent process (see share_smt) or
+# memory-mapped (see mapped_smt)
+def load_smt(smt_file):
+    shared = shared_smts.get(smt_file)
+    if shared is not None:
+        return mapped_smt.overlay_smt(shared)
+    if smt_file.endswith('.map'):
+        return mapped_smt.open_overlay_smt(smt_file)
+    with open(smt_file, 'rb') as file:
+        return pickle.load(file)
+
+
+# load smt_file once in this process, forked worker processes read it without an own copy: the OS only copies
+# the pages they write to (refcounts of the nodes they touch), gc.freeze() keeps the gc from writing to all of them
+def share_smt(smt_file):
+    with open(smt_file, 'rb') as file:
+        shared_smts[smt_file] = pickle.load(file)
+    gc.freeze()
+
+
+# running estimates with confidence intervals for early stopping of big tests
+# target_ci: {metric: max. CI half-width}, rates in percentage points (Wilson), means in their unit (normal)
+class EarlyStop:
+    def __init__(self, target_ci=None, min_rounds=100, z=1.96):
+        self.target_ci = target_ci or {}
+        self.min_rounds = min_rounds
+        self.z = z
+        self.rounds = 0
+        self.stats = {}  # metric -> [n, mean, m2, is_rate]
+
+    # add one round's observations, bools are rates, None means no observation for that metric
+    def add_round(self, **values):
+        self.rounds += 1
+        for metric, value in values.items():
+            if value is None:
+                continue
+            stat = self.stats.get(metric)
+            if stat is None:
+                stat = self.stats[metric] = [0, 0.0, 0.0, isinstance(value, bool)]
+            # welford update
+            stat[0] += 1
+            delta = value - stat[1]
+            stat[1] += delta / stat[0]
+            stat[2] += delta * (value - stat[1])
+
+    # round outcome of a repair test, tries is None on overload
+    def add_tries(self, tries):
+        self.add_round(avg_try=tries, first_tries=tries == 1, first_ten=tries is not None and tries <= 10,
+                       overloads=tries is None)
+
+    def half_width(self, metric):
+        stat = self.stats.get(metric)
+        if stat is None or stat[0] < 2:
+            return math.inf
+        n, mean, m2, is_rate = stat
+        z = self.z
+        if is_rate:
+            # wilson score interval
+            return z * math.sqrt(mean * (1 - mean) / n + z * z / (4 * n * n)) / (1 + z * z / n) * 100
+        return z * math.sqrt(m2 / (n - 1) / n)
+
+    def reached(self):
+        if not self.target_ci or self.rounds < self.min_rounds:
+            return False
+        return all(self.half_width(m) <= w for m, w in self.target_ci.items())
 
 
 # reconstruct outdated local PoI with help of random neighbors
-def bigtest_repair_rnd_nodes(smt_file, hf, missed_updates, overload_at, entropy, print_results=False):
+def bigtest_repair_rnd_nodes(smt_file, hf, missed_updates, overload_at, entropy, target_ci=None, min_rounds=100,
+                             print_results=False):
     # simply randomly ask if someone can provide the necessary hash
     # simply use poi-update procedure on PoIs until we repaired ours (reached current root)
     random.seed()
     # load large tree
-    file = open(smt_file, 'rb')
-    smt: TestSMT = pickle.load(file)
+    smt: TestSMT = load_smt(smt_file)
     smtu = SMTutil(hf, smt.depth)
-    file.close()
     # insert our own node
     target = hf('4')
+    target_int = hashf.get_int(target)
     smt.add_node(target)
-    target_path, target_path_bm = smt.path(target)
-    # backup reference SMT for reloading
-    smt_bak = copy.deepcopy(smt)
+    # following changes only go to an overlay, reset() discards them
+    smt = mapped_smt.overlay_smt(smt)
+    target_path_bak, target_path_bm_bak = smt.path(target)
+    target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
     smt_size = len(smt.int_sort_leaves)
 
     # measurements
@@ -37,17 +109,18 @@ def bigtest_repair_rnd_nodes(smt_file, hf, missed_updates, overload_at, entropy,
     first_ten = 0
     overloads = 0
     smt_total_loading = 0
+    early_stop = EarlyStop(target_ci, min_rounds)
     start = time.process_time()
     for _ in tqdm(range(entropy)):
+        if early_stop.reached():
+            break
         # reset SMT
         if len(smt.int_sort_leaves) > (smt_size * 2):
             tmp_start = time.process_time()
-            smt = copy.deepcopy(smt_bak)
-            target_path, target_path_bm = smt.path(target)
+            smt.reset()
+            target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
             tmp_stop = time.process_time()
             smt_total_loading += tmp_stop - tmp_start
-            # free up memory
-            gc.collect()
 
         # missed updates
         actual_root = ''
@@ -64,8 +137,12 @@ def bigtest_repair_rnd_nodes(smt_file, hf, missed_updates, overload_at, entropy,
                 # repair path
                 target_path, target_path_bm = smt.path(target)
                 overloads += 1
+                early_stop.add_tries(None)
                 break
-            leaf_int = random.choice(smt.int_sort_leaves)
+            # a node does not meet itself
+            leaf_int = target_int
+            while leaf_int == target_int:
+                leaf_int = random.choice(smt.int_sort_leaves)
             leaf_hash = hashf.from_int(leaf_int, smt.depth)
             add_path, add_path_bm = smt.path(leaf_hash)
             target_path_bm = smtu.update_poi_with_poi(target, target_path, target_path_bm,
@@ -80,16 +157,18 @@ def bigtest_repair_rnd_nodes(smt_file, hf, missed_updates, overload_at, entropy,
                 avg += i + 1
                 mini = min(mini, i)
                 maxi = max(maxi, i)
+                early_stop.add_tries(i + 1)
                 break
     stop = time.process_time()
+    rounds = early_stop.rounds
     if print_results:
         print('bigtest_repair_rnd_nodes(' + smt_file + ', ' + str(missed_updates) + ', ' + str(entropy) + ')')
-        print('Avg. worked on ' + str('{0:.3g}'.format(avg / max(1, (entropy - overloads)))) +
+        print('Avg. worked on ' + str('{0:.3g}'.format(avg / max(1, (rounds - overloads)))) +
               's try. Min: ' + str(mini) + ' Max: ' + str(maxi) +
-              ' First Tries: ' + str(first_tries) + ' (' + '{0:.3g}'.format(first_tries/entropy*100) + '%)' +
-              ' First 10 Tries: ' + str(first_ten) + ' (' + '{0:.3g}'.format(first_ten/entropy*100) + '%)' +
-              ' Overloads: ' + str(overloads) + ' (' + '{0:.3g}'.format(overloads/entropy*100) + '%)')
-        print('Total Elapsed Time: ' + str(stop - start) + 's.')
+              ' First Tries: ' + str(first_tries) + ' (' + '{0:.3g}'.format(first_tries/rounds*100) + '%)' +
+              ' First 10 Tries: ' + str(first_ten) + ' (' + '{0:.3g}'.format(first_ten/rounds*100) + '%)' +
+              ' Overloads: ' + str(overloads) + ' (' + '{0:.3g}'.format(overloads/rounds*100) + '%)')
+        print('Total Elapsed Time: ' + str(stop - start) + 's, ' + str(rounds) + ' rounds.')
         print('Reloading SMTs took ' + str(smt_total_loading) + 's in total (' +
               '{0:.3g}'.format(smt_total_loading/(stop - start)*100) + '%).')
     else:
@@ -99,44 +178,169 @@ def bigtest_repair_rnd_nodes(smt_file, hf, missed_updates, overload_at, entropy,
             'missed_updates': missed_updates,
             'overload_at': overload_at,
             'entropy': entropy,
+            'target_ci': target_ci,
             # values
-            'avg_try': avg / max(1, (entropy - overloads)),
-            'first_tries': first_tries / entropy * 100,
-            'first_ten': first_ten / entropy * 100,
-            'overloads': overloads / entropy * 100
+            'rounds': rounds,
+            'avg_try': avg / max(1, (rounds - overloads)),
+            'first_tries': first_tries / rounds * 100,
+            'first_ten': first_ten / rounds * 100,
+            'overloads': overloads / rounds * 100
         }
         # free memory, so waiting processes won't reserve it
         smt = None
-        smt_bak = None
+        gc.collect()
+        return results
+
+
+# bigtest_repair_rnd_nodes for a list of missed updates in one pass: missed updates of a round are nested, so each
+# round inserts max(missed_updates) leaves once & repairs a copy of the outdated PoI at every checkpoint
+# checkpoints of one round are correlated, but each follows the same distribution as its separate test
+def bigtest_repair_rnd_nodes_sweep(smt_file, hf, missed_updates, overload_at, entropy, target_ci=None,
+                                   min_rounds=100, print_results=False):
+    random.seed()
+    checkpoints = sorted(set(missed_updates))
+    # load large tree
+    smt: TestSMT = load_smt(smt_file)
+    smtu = SMTutil(hf, smt.depth)
+    # insert our own node
+    target = hf('4')
+    target_int = hashf.get_int(target)
+    smt.add_node(target)
+    # following changes only go to an overlay, reset() discards them
+    smt = mapped_smt.overlay_smt(smt)
+    target_path_bak, target_path_bm_bak = smt.path(target)
+    target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
+    smt_size = len(smt.int_sort_leaves)
+
+    # measurements per checkpoint
+    avg = dict.fromkeys(checkpoints, 0)
+    mini = dict.fromkeys(checkpoints, 999999999)
+    maxi = dict.fromkeys(checkpoints, 0)
+    first_tries = dict.fromkeys(checkpoints, 0)
+    first_ten = dict.fromkeys(checkpoints, 0)
+    overloads = dict.fromkeys(checkpoints, 0)
+    smt_total_loading = 0
+    early_stops = {k: EarlyStop(target_ci, min_rounds) for k in checkpoints}
+    start = time.process_time()
+    for _ in tqdm(range(entropy)):
+        if all(e.reached() for e in early_stops.values()):
+            break
+        # reset SMT
+        if len(smt.int_sort_leaves) > (smt_size * 2):
+            tmp_start = time.process_time()
+            smt.reset()
+            target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
+            tmp_stop = time.process_time()
+            smt_total_loading += tmp_stop - tmp_start
+
+        inserted = 0
+        actual_root = ''
+        for k in checkpoints:
+            # missed updates up to this checkpoint
+            while inserted < k:
+                rnd = random.random()
+                new_root = smt.add_node(hf(str(rnd)))
+                if new_root is not None:
+                    actual_root = new_root
+                    inserted += 1
+            if early_stops[k].reached():
+                continue
+
+            # meet nodes, with a copy of the outdated PoI
+            path, path_bm = target_path.copy(), target_path_bm
+            for i in range(overload_at + 2):
+                if i > overload_at:
+                    overloads[k] += 1
+                    early_stops[k].add_tries(None)
+                    break
+                # a node does not meet itself
+                leaf_int = target_int
+                while leaf_int == target_int:
+                    leaf_int = random.choice(smt.int_sort_leaves)
+                leaf_hash = hashf.from_int(leaf_int, smt.depth)
+                add_path, add_path_bm = smt.path(leaf_hash)
+                path_bm = smtu.update_poi_with_poi(target, path, path_bm, leaf_hash, add_path, add_path_bm)
+                # check root
+                newroot = smtu.calc_path_root(target, path, path_bm)
+                if actual_root == newroot:
+                    if i == 0:
+                        first_tries[k] += 1
+                    if i < 10:
+                        first_ten[k] += 1
+                    avg[k] += i + 1
+                    mini[k] = min(mini[k], i)
+                    maxi[k] = max(maxi[k], i)
+                    early_stops[k].add_tries(i + 1)
+                    break
+
+        # next round starts up to date
+        target_path, target_path_bm = smt.path(target)
+    stop = time.process_time()
+    if print_results:
+        print('bigtest_repair_rnd_nodes_sweep(' + smt_file + ', ' + str(checkpoints) + ', ' + str(entropy) + ')')
+        for k in checkpoints:
+            rounds = early_stops[k].rounds
+            print(str(k) + ' missed updates: Avg. worked on ' +
+                  str('{0:.3g}'.format(avg[k] / max(1, (rounds - overloads[k])))) +
+                  's try. Min: ' + str(mini[k]) + ' Max: ' + str(maxi[k]) +
+                  ' First Tries: ' + str(first_tries[k]) + ' (' + '{0:.3g}'.format(first_tries[k]/rounds*100) + '%)' +
+                  ' First 10 Tries: ' + str(first_ten[k]) + ' (' + '{0:.3g}'.format(first_ten[k]/rounds*100) + '%)' +
+                  ' Overloads: ' + str(overloads[k]) + ' (' + '{0:.3g}'.format(overloads[k]/rounds*100) + '%), ' +
+                  str(rounds) + ' rounds.')
+        print('Total Elapsed Time: ' + str(stop - start) + 's.')
+        print('Reloading SMTs took ' + str(smt_total_loading) + 's in total (' +
+              '{0:.3g}'.format(smt_total_loading/(stop - start)*100) + '%).')
+    else:
+        # one result per checkpoint, same as bigtest_repair_rnd_nodes
+        results = []
+        for k in checkpoints:
+            rounds = early_stops[k].rounds
+            results.append({
+                # params
+                'smt_file': smt_file,
+                'missed_updates': k,
+                'overload_at': overload_at,
+                'entropy': entropy,
+                'target_ci': target_ci,
+                # values
+                'rounds': rounds,
+                'avg_try': avg[k] / max(1, (rounds - overloads[k])),
+                'first_tries': first_tries[k] / rounds * 100,
+                'first_ten': first_ten[k] / rounds * 100,
+                'overloads': overloads[k] / rounds * 100
+            })
+        # free memory, so waiting processes won't reserve it
+        smt = None
         gc.collect()
         return results
 
 
 # check how often level-cache can successfully reconstruct a PoI
-def bigtest_repair_lvl_cache(smt_file, hf, cache_level, missed_updates, entropy, print_results=False):
+def bigtest_repair_lvl_cache(smt_file, hf, cache_level, missed_updates, entropy, target_ci=None, min_rounds=100,
+                             print_results=False):
     random.seed()
     # load large tree
-    file = open(smt_file, 'rb')
-    smt: TestSMT = pickle.load(file)
+    smt: TestSMT = load_smt(smt_file)
     smtu = SMTutil(hf, smt.depth)
-    file.close()
     # insert our own node
     target = hf('4')
     smt.add_node(target)
-    target_path, target_path_bm = smt.path(target)
-    # backup reference SMT for reloading
-    smt_bak = copy.deepcopy(smt)
+    # following changes only go to an overlay, reset() discards them
+    smt = mapped_smt.overlay_smt(smt)
+    target_path_bak, target_path_bm_bak = smt.path(target)
+    target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
     smt_size = len(smt.int_sort_leaves)
 
     fails = 0
+    early_stop = EarlyStop(target_ci, min_rounds)
     start = time.process_time()
     for _ in tqdm(range(entropy)):
+        if early_stop.reached():
+            break
         # reset SMT
         if len(smt.int_sort_leaves) > (smt_size * 2):
-            smt = copy.deepcopy(smt_bak)
-            target_path, target_path_bm = smt.path(target)
-            # free up memory
-            gc.collect()
+            smt.reset()
+            target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
 
         # update & get root
         actual_root = ''
@@ -157,17 +361,19 @@ def bigtest_repair_lvl_cache(smt_file, hf, cache_level, missed_updates, entropy,
 
         # check if root is good
         constr_root = smtu.calc_path_root(target, target_path, target_path_bm)
+        early_stop.add_round(success=constr_root == actual_root)
         if constr_root != actual_root:
             fails += 1
             # update PoIs, otherwise all subsequent will fail
             target_path, target_path_bm = smt.path(target)
 
     stop = time.process_time()
+    rounds = early_stop.rounds
     if print_results:
         print('bigtest_repair_lvl_cache(' + smt_file + ', ' + str(cache_level) + ', ' +
               str(missed_updates) + ', ' + str(entropy) + ')')
-        print('Failed ' + str(fails) + ' times (' + '{0:.3g}'.format(fails/entropy*100) + '%).')
-        print('Total Elapsed Time: ' + str(stop - start) + 's.')
+        print('Failed ' + str(fails) + ' times (' + '{0:.3g}'.format(fails/rounds*100) + '%).')
+        print('Total Elapsed Time: ' + str(stop - start) + 's, ' + str(rounds) + ' rounds.')
     else:
         results = {
             # params
@@ -175,24 +381,114 @@ def bigtest_repair_lvl_cache(smt_file, hf, cache_level, missed_updates, entropy,
             'cache_level': cache_level,
             'missed_updates': missed_updates,
             'entropy': entropy,
+            'target_ci': target_ci,
             # values
-            'success': 100 - (fails / entropy * 100)
+            'rounds': rounds,
+            'success': 100 - (fails / rounds * 100)
         }
         # free memory, so waiting processes won't reserve it
         smt = None
-        smt_bak = None
+        gc.collect()
+        return results
+
+
+# bigtest_repair_lvl_cache for lists of cache levels & missed updates in one pass: missed updates of a round are
+# nested, so each round inserts max(missed_updates) leaves once & checks all cache levels at every checkpoint
+def bigtest_repair_lvl_cache_sweep(smt_file, hf, cache_level, missed_updates, entropy, target_ci=None,
+                                   min_rounds=100, print_results=False):
+    random.seed()
+    cache_levels = sorted(set(cache_level))
+    checkpoints = sorted(set(missed_updates))
+    # load large tree
+    smt: TestSMT = load_smt(smt_file)
+    smtu = SMTutil(hf, smt.depth)
+    # insert our own node
+    target = hf('4')
+    smt.add_node(target)
+    # following changes only go to an overlay, reset() discards them
+    smt = mapped_smt.overlay_smt(smt)
+    target_path_bak, target_path_bm_bak = smt.path(target)
+    target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
+    smt_size = len(smt.int_sort_leaves)
+
+    # measurements per (cache level, checkpoint)
+    fails = {(c, k): 0 for c in cache_levels for k in checkpoints}
+    early_stops = {(c, k): EarlyStop(target_ci, min_rounds) for c in cache_levels for k in checkpoints}
+    start = time.process_time()
+    for _ in tqdm(range(entropy)):
+        if all(e.reached() for e in early_stops.values()):
+            break
+        # reset SMT
+        if len(smt.int_sort_leaves) > (smt_size * 2):
+            smt.reset()
+            target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
+
+        inserted = 0
+        actual_root = ''
+        for k in checkpoints:
+            # missed updates up to this checkpoint
+            while inserted < k:
+                rnd = random.random()
+                new_root = smt.add_node(hf(str(rnd)))
+                if new_root is not None:
+                    actual_root = new_root
+                    inserted += 1
+
+            for c in cache_levels:
+                if early_stops[(c, k)].reached():
+                    continue
+                lvl_cache = smt.construct_lvl_cache(c)
+                # reconstruct a copy of the outdated PoI for target
+                path = target_path.copy()
+                smtu.update_poi_with_lvl_cache(target, path, lvl_cache, c)
+                # check if root is good
+                constr_root = smtu.calc_path_root(target, path, target_path_bm)
+                early_stops[(c, k)].add_round(success=constr_root == actual_root)
+                if constr_root != actual_root:
+                    fails[(c, k)] += 1
+
+        # next round starts up to date
+        target_path, target_path_bm = smt.path(target)
+    stop = time.process_time()
+    if print_results:
+        print('bigtest_repair_lvl_cache_sweep(' + smt_file + ', ' + str(cache_levels) + ', ' +
+              str(checkpoints) + ', ' + str(entropy) + ')')
+        for c in cache_levels:
+            for k in checkpoints:
+                rounds = early_stops[(c, k)].rounds
+                print('Cache level ' + str(c) + ', ' + str(k) + ' missed updates: Failed ' + str(fails[(c, k)]) +
+                      ' times (' + '{0:.3g}'.format(fails[(c, k)]/rounds*100) + '%), ' + str(rounds) + ' rounds.')
+        print('Total Elapsed Time: ' + str(stop - start) + 's.')
+    else:
+        # one result per cache level & checkpoint, same as bigtest_repair_lvl_cache
+        results = []
+        for c in cache_levels:
+            for k in checkpoints:
+                rounds = early_stops[(c, k)].rounds
+                results.append({
+                    # params
+                    'smt_file': smt_file,
+                    'cache_level': c,
+                    'missed_updates': k,
+                    'entropy': entropy,
+                    'target_ci': target_ci,
+                    # values
+                    'rounds': rounds,
+                    'success': 100 - (fails[(c, k)] / rounds * 100)
+                })
+        # free memory, so waiting processes won't reserve it
+        smt = None
         gc.collect()
         return results
 
 
 # try to construct a complete level-cache with random PoIs
-def bigtest_construct_rnd_lvl_cache(smt_file, hf, cache_level, overload_at, entropy, print_results=False):
+def bigtest_construct_rnd_lvl_cache(smt_file, hf, cache_level, overload_at, entropy, target_ci=None, min_rounds=100,
+                                    print_results=False):
     random.seed()
     # load large tree
-    file = open(smt_file, 'rb')
-    smt: TestSMT = pickle.load(file)
+    smt: TestSMT = load_smt(smt_file)
     smtu = SMTutil(hf, smt.depth)
-    file.close()
     # evaluation cache
     target_cache_size = 2 ** cache_level
 
@@ -209,8 +505,11 @@ def bigtest_construct_rnd_lvl_cache(smt_file, hf, cache_level, overload_at, entr
     mini = 999999999
     maxi = 0
     overloads = 0
+    early_stop = EarlyStop(target_ci, min_rounds)
     start = time.process_time()
     for _ in tqdm(range(entropy)):
+        if early_stop.reached():
+            break
         new_lvl_cache = [None] * target_cache_size
         avg50b = True
         avg75b = True
@@ -220,6 +519,7 @@ def bigtest_construct_rnd_lvl_cache(smt_file, hf, cache_level, overload_at, entr
         for i in range(overload_at + 2):
             if i > overload_at:  # check all overloads
                 overloads += 1
+                early_stop.add_round(avg_try=None, overloads=True)
                 if avg50b:
                     avg50o += 1
                 if avg75b:
@@ -253,14 +553,16 @@ def bigtest_construct_rnd_lvl_cache(smt_file, hf, cache_level, overload_at, entr
                 avg += i + 1
                 mini = min(mini, i)
                 maxi = max(maxi, i)
+                early_stop.add_round(avg_try=i + 1, overloads=False)
                 break
 
     stop = time.process_time()
+    rounds = early_stop.rounds
     if print_results:
         print('bigtest_construct_rnd_lvl_cache(' + smt_file + ', ' + str(cache_level) + ', ' + str(entropy) + ')')
-        print('Avg. worked on ' + str('{0:.3g}'.format(avg / max(1, (entropy - overloads)))) + 's try. Min: ' + str(mini) +
+        print('Avg. worked on ' + str('{0:.3g}'.format(avg / max(1, (rounds - overloads)))) + 's try. Min: ' + str(mini) +
               ' Max: ' + str(maxi) + ' Overloads: ' + str(overloads))
-        print('Total Elapsed Time: ' + str(stop - start) + 's.')
+        print('Total Elapsed Time: ' + str(stop - start) + 's, ' + str(rounds) + ' rounds.')
     else:
         results = {
             # params
@@ -268,36 +570,36 @@ def bigtest_construct_rnd_lvl_cache(smt_file, hf, cache_level, overload_at, entr
             'cache_level': cache_level,
             'overload_at': overload_at,
             'entropy': entropy,
+            'target_ci': target_ci,
             # values
-            'avg_try': avg / max(1, (entropy - overloads)),
-            'avg50': avg50 / max(1, (entropy - avg50o)),
-            'avg75': avg75 / max(1, (entropy - avg75o)),
-            'avg90': avg90 / max(1, (entropy - avg90o)),
-            'avg95': avg95 / max(1, (entropy - avg95o)),
-            'overloads': overloads / entropy * 100
+            'rounds': rounds,
+            'avg_try': avg / max(1, (rounds - overloads)),
+            'avg50': avg50 / max(1, (rounds - avg50o)),
+            'avg75': avg75 / max(1, (rounds - avg75o)),
+            'avg90': avg90 / max(1, (rounds - avg90o)),
+            'avg95': avg95 / max(1, (rounds - avg95o)),
+            'overloads': overloads / rounds * 100
         }
         # free memory, so waiting processes won't reserve it
         smt = None
-        smt_bak = None
         gc.collect()
         return results
 
 
 # try to repair PoI with random sub-tree-caches
 def bigtest_repair_sub_cache(smt_file, hf, sub_depth, poi_depth, missed_updates, overload_at, entropy,
-                             print_results=False):
+                             target_ci=None, min_rounds=100, print_results=False):
     random.seed()
     # load large tree
-    file = open(smt_file, 'rb')
-    smt: TestSMT = pickle.load(file)
+    smt: TestSMT = load_smt(smt_file)
     smtu = SMTutil(hf, smt.depth)
-    file.close()
     # insert our own node
     target = hf('4')
     smt.add_node(target)
-    target_path, target_path_bm = smt.path(target)
-    # backup reference SMT for reloading
-    smt_bak = copy.deepcopy(smt)
+    # following changes only go to an overlay, reset() discards them
+    smt = mapped_smt.overlay_smt(smt)
+    target_path_bak, target_path_bm_bak = smt.path(target)
+    target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
     smt_size = len(smt.int_sort_leaves)
 
     # measurements
@@ -307,14 +609,15 @@ def bigtest_repair_sub_cache(smt_file, hf, sub_depth, poi_depth, missed_updates,
     first_tries = 0
     first_ten = 0
     overloads = 0
+    early_stop = EarlyStop(target_ci, min_rounds)
     start = time.process_time()
     for _ in tqdm(range(entropy)):
+        if early_stop.reached():
+            break
         # reset SMT
         if len(smt.int_sort_leaves) > (smt_size * 2):
-            smt = copy.deepcopy(smt_bak)
-            target_path, target_path_bm = smt.path(target)
-            # free up memory
-            gc.collect()
+            smt.reset()
+            target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
 
         # update & get root
         actual_root = ''
@@ -331,6 +634,7 @@ def bigtest_repair_sub_cache(smt_file, hf, sub_depth, poi_depth, missed_updates,
                 # update so subsequent things work
                 target_path, target_path_bm = smt.path(target)
                 overloads += 1
+                early_stop.add_tries(None)
                 break
 
             # meet a random node
@@ -381,19 +685,21 @@ def bigtest_repair_sub_cache(smt_file, hf, sub_depth, poi_depth, missed_updates,
                 avg += i + 1
                 mini = min(mini, i)
                 maxi = max(maxi, i)
+                early_stop.add_tries(i + 1)
                 break
 
     stop = time.process_time()
+    rounds = early_stop.rounds
     if print_results:
         print('bigtest_repair_sub_cache(' + smt_file + ', ' + str(sub_depth) + ', ' + str(poi_depth) +
               ', ' + str(missed_updates) + ', ' + str(entropy) + ')')
         print('Sub-Cache is ' + str(2**sub_depth * poi_depth) + ' in size.')
-        print('Avg. worked on ' + str('{0:.3g}'.format(avg / max(1, (entropy - overloads)))) +
+        print('Avg. worked on ' + str('{0:.3g}'.format(avg / max(1, (rounds - overloads)))) +
               's try. Min: ' + str(mini) + ' Max: ' + str(maxi) +
-              ' First Tries: ' + str(first_tries) + ' (' + '{0:.3g}'.format(first_tries / entropy * 100) + '%)' +
-              ' First 10 Tries: ' + str(first_ten) + ' (' + '{0:.3g}'.format(first_ten / entropy * 100) + '%)' +
-              ' Overloads: ' + str(overloads) + ' (' + '{0:.3g}'.format(overloads / entropy * 100) + '%)')
-        print('Total Elapsed Time: ' + str(stop - start) + 's.')
+              ' First Tries: ' + str(first_tries) + ' (' + '{0:.3g}'.format(first_tries / rounds * 100) + '%)' +
+              ' First 10 Tries: ' + str(first_ten) + ' (' + '{0:.3g}'.format(first_ten / rounds * 100) + '%)' +
+              ' Overloads: ' + str(overloads) + ' (' + '{0:.3g}'.format(overloads / rounds * 100) + '%)')
+        print('Total Elapsed Time: ' + str(stop - start) + 's, ' + str(rounds) + ' rounds.')
     else:
         results = {
             # params
@@ -403,35 +709,35 @@ def bigtest_repair_sub_cache(smt_file, hf, sub_depth, poi_depth, missed_updates,
             'missed_updates': missed_updates,
             'overload_at': overload_at,
             'entropy': entropy,
+            'target_ci': target_ci,
             # values
+            'rounds': rounds,
             'cache_size': 2**sub_depth * poi_depth,
-            'avg_try': avg / max(1, (entropy - overloads)),
-            'first_tries': first_tries / entropy * 100,
-            'first_ten': first_ten / entropy * 100,
-            'overloads': overloads / entropy * 100
+            'avg_try': avg / max(1, (rounds - overloads)),
+            'first_tries': first_tries / rounds * 100,
+            'first_ten': first_ten / rounds * 100,
+            'overloads': overloads / rounds * 100
         }
         # free memory, so waiting processes won't reserve it
         smt = None
-        smt_bak = None
         gc.collect()
         return results
 
 
 # try to repair PoI with random incremental sub-tree-caches
 def bigtest_repair_sub_cache_incr(smt_file, hf, sub_depth, poi_depth, missed_updates, overload_at, entropy,
-                             print_results=False):
+                                  target_ci=None, min_rounds=100, print_results=False):
     random.seed()
     # load large tree
-    file = open(smt_file, 'rb')
-    smt: TestSMT = pickle.load(file)
+    smt: TestSMT = load_smt(smt_file)
     smtu = SMTutil(hf, smt.depth)
-    file.close()
     # insert our own node
     target = hf('4')
     smt.add_node(target)
-    target_path, target_path_bm = smt.path(target)
-    # backup reference SMT for reloading
-    smt_bak = copy.deepcopy(smt)
+    # following changes only go to an overlay, reset() discards them
+    smt = mapped_smt.overlay_smt(smt)
+    target_path_bak, target_path_bm_bak = smt.path(target)
+    target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
     smt_size = len(smt.int_sort_leaves)
 
     # measurements
@@ -443,14 +749,15 @@ def bigtest_repair_sub_cache_incr(smt_file, hf, sub_depth, poi_depth, missed_upd
     overloads = 0
     cache_size = 0
     cache_size_set = False
+    early_stop = EarlyStop(target_ci, min_rounds)
     start = time.process_time()
     for x in tqdm(range(entropy)):
+        if early_stop.reached():
+            break
         # reset SMT
         if len(smt.int_sort_leaves) > (smt_size * 2):
-            smt = copy.deepcopy(smt_bak)
-            target_path, target_path_bm = smt.path(target)
-            # free up memory
-            gc.collect()
+            smt.reset()
+            target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
 
         # update & get root
         actual_root = ''
@@ -467,6 +774,7 @@ def bigtest_repair_sub_cache_incr(smt_file, hf, sub_depth, poi_depth, missed_upd
                 # update so subsequent things work
                 target_path, target_path_bm = smt.path(target)
                 overloads += 1
+                early_stop.add_tries(None)
                 break
 
             # meet a random node
@@ -524,19 +832,21 @@ def bigtest_repair_sub_cache_incr(smt_file, hf, sub_depth, poi_depth, missed_upd
                 avg += i + 1
                 mini = min(mini, i)
                 maxi = max(maxi, i)
+                early_stop.add_tries(i + 1)
                 break
 
     stop = time.process_time()
+    rounds = early_stop.rounds
     if print_results:
         print('bigtest_repair_sub_cache_incr(' + smt_file + ', ' + str(sub_depth) + ', ' + str(poi_depth) +
               ', ' + str(missed_updates) + ', ' + str(entropy) + ')')
         print('Sub-Cache is ' + str(cache_size) + ' in size.')
-        print('Avg. worked on ' + str('{0:.3g}'.format(avg / max(1, (entropy - overloads)))) +
+        print('Avg. worked on ' + str('{0:.3g}'.format(avg / max(1, (rounds - overloads)))) +
               's try. Min: ' + str(mini) + ' Max: ' + str(maxi) +
-              ' First Tries: ' + str(first_tries) + ' (' + '{0:.3g}'.format(first_tries / entropy * 100) + '%)' +
-              ' First 10 Tries: ' + str(first_ten) + ' (' + '{0:.3g}'.format(first_ten / entropy * 100) + '%)' +
-              ' Overloads: ' + str(overloads) + ' (' + '{0:.3g}'.format(overloads / entropy * 100) + '%)')
-        print('Total Elapsed Time: ' + str(stop - start) + 's.')
+              ' First Tries: ' + str(first_tries) + ' (' + '{0:.3g}'.format(first_tries / rounds * 100) + '%)' +
+              ' First 10 Tries: ' + str(first_ten) + ' (' + '{0:.3g}'.format(first_ten / rounds * 100) + '%)' +
+              ' Overloads: ' + str(overloads) + ' (' + '{0:.3g}'.format(overloads / rounds * 100) + '%)')
+        print('Total Elapsed Time: ' + str(stop - start) + 's, ' + str(rounds) + ' rounds.')
     else:
         results = {
             # params
@@ -546,35 +856,35 @@ def bigtest_repair_sub_cache_incr(smt_file, hf, sub_depth, poi_depth, missed_upd
             'missed_updates': missed_updates,
             'overload_at': overload_at,
             'entropy': entropy,
+            'target_ci': target_ci,
             # values
+            'rounds': rounds,
             'cache_size': 2**sub_depth * poi_depth,
-            'avg_try': avg / max(1, (entropy - overloads)),
-            'first_tries': first_tries / entropy * 100,
-            'first_ten': first_ten / entropy * 100,
-            'overloads': overloads / entropy * 100
+            'avg_try': avg / max(1, (rounds - overloads)),
+            'first_tries': first_tries / rounds * 100,
+            'first_ten': first_ten / rounds * 100,
+            'overloads': overloads / rounds * 100
         }
         # free memory, so waiting processes won't reserve it
         smt = None
-        smt_bak = None
         gc.collect()
         return results
 
 
 # try to repair PoI with random sub-tree-caches & additional level-cache
 def bigtest_repair_mix_cache(smt_file, hf, cache_level, sub_depth, poi_depth, missed_updates, overload_at, entropy,
-                             print_results=False):
+                             target_ci=None, min_rounds=100, print_results=False):
     random.seed()
     # load large tree
-    file = open(smt_file, 'rb')
-    smt: TestSMT = pickle.load(file)
+    smt: TestSMT = load_smt(smt_file)
     smtu = SMTutil(hf, smt.depth)
-    file.close()
     # insert our own node
     target = hf('4')
     smt.add_node(target)
-    target_path, target_path_bm = smt.path(target)
-    # backup reference SMT for reloading
-    smt_bak = copy.deepcopy(smt)
+    # following changes only go to an overlay, reset() discards them
+    smt = mapped_smt.overlay_smt(smt)
+    target_path_bak, target_path_bm_bak = smt.path(target)
+    target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
     smt_size = len(smt.int_sort_leaves)
 
     avg = 0
@@ -583,14 +893,15 @@ def bigtest_repair_mix_cache(smt_file, hf, cache_level, sub_depth, poi_depth, mi
     first_tries = 0
     first_ten = 0
     overloads = 0
+    early_stop = EarlyStop(target_ci, min_rounds)
     start = time.process_time()
     for _ in tqdm(range(entropy)):
+        if early_stop.reached():
+            break
         # reset SMT
         if len(smt.int_sort_leaves) > (smt_size * 2):
-            smt = copy.deepcopy(smt_bak)
-            target_path, target_path_bm = smt.path(target)
-            # free up memory
-            gc.collect()
+            smt.reset()
+            target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
 
         # update & get root
         for i in range(missed_updates):
@@ -609,6 +920,7 @@ def bigtest_repair_mix_cache(smt_file, hf, cache_level, sub_depth, poi_depth, mi
             first_tries += 1
             first_ten += 1
             avg += 1
+            early_stop.add_tries(1)
             continue
 
         # meet nodes
@@ -617,6 +929,7 @@ def bigtest_repair_mix_cache(smt_file, hf, cache_level, sub_depth, poi_depth, mi
                 # update so subsequent things work
                 target_path, target_path_bm = smt.path(target)
                 overloads += 1
+                early_stop.add_tries(None)
                 break
 
             # meet a random node
@@ -670,19 +983,21 @@ def bigtest_repair_mix_cache(smt_file, hf, cache_level, sub_depth, poi_depth, mi
                 avg += i + 1
                 mini = min(mini, i)
                 maxi = max(maxi, i)
+                early_stop.add_tries(i + 1)
                 break
 
     stop = time.process_time()
+    rounds = early_stop.rounds
     if print_results:
         print('bigtest_repair_mix_cache(' + smt_file + ', ' + str(cache_level) + ', ' + str(sub_depth) +
               ', ' + str(poi_depth) + ', ' + str(missed_updates) + ', ' + str(entropy) + ')')
         print('Mix-Cache is ' + str(2**cache_level + 2**sub_depth * poi_depth) + ' in size.')
-        print('Avg. worked on ' + str('{0:.3g}'.format(avg / max(1, (entropy - overloads)))) +
+        print('Avg. worked on ' + str('{0:.3g}'.format(avg / max(1, (rounds - overloads)))) +
               's try. Min: ' + str(mini) + ' Max: ' + str(maxi) +
-              ' First Tries: ' + str(first_tries) + ' (' + '{0:.3g}'.format(first_tries / entropy * 100) + '%)' +
-              ' First 10 Tries: ' + str(first_ten) + ' (' + '{0:.3g}'.format(first_ten / entropy * 100) + '%)' +
-              ' Overloads: ' + str(overloads) + ' (' + '{0:.3g}'.format(overloads / entropy * 100) + '%)')
-        print('Total Elapsed Time: ' + str(stop - start) + 's.')
+              ' First Tries: ' + str(first_tries) + ' (' + '{0:.3g}'.format(first_tries / rounds * 100) + '%)' +
+              ' First 10 Tries: ' + str(first_ten) + ' (' + '{0:.3g}'.format(first_ten / rounds * 100) + '%)' +
+              ' Overloads: ' + str(overloads) + ' (' + '{0:.3g}'.format(overloads / rounds * 100) + '%)')
+        print('Total Elapsed Time: ' + str(stop - start) + 's, ' + str(rounds) + ' rounds.')
     else:
         results = {
             # params
@@ -693,35 +1008,35 @@ def bigtest_repair_mix_cache(smt_file, hf, cache_level, sub_depth, poi_depth, mi
             'missed_updates': missed_updates,
             'overload_at': overload_at,
             'entropy': entropy,
+            'target_ci': target_ci,
             # values
+            'rounds': rounds,
             'cache_size': 2**cache_level + 2**sub_depth * poi_depth,
-            'avg_try': avg / max(1, (entropy - overloads)),
-            'first_tries': first_tries / entropy * 100,
-            'first_ten': first_ten / entropy * 100,
-            'overloads': overloads / entropy * 100
+            'avg_try': avg / max(1, (rounds - overloads)),
+            'first_tries': first_tries / rounds * 100,
+            'first_ten': first_ten / rounds * 100,
+            'overloads': overloads / rounds * 100
         }
         # free memory, so waiting processes won't reserve it
         smt = None
-        smt_bak = None
         gc.collect()
         return results
 
 
 # try to repair PoI with random incremental sub-tree-caches & additional level-cache
-def bigtest_repair_mix_cache_incr(smt_file, hf, cache_level, sub_depth, poi_depth, missed_updates, overload_at, entropy,
-                             print_results=False):
+def bigtest_repair_mix_cache_incr(smt_file, hf, cache_level, sub_depth, poi_depth, missed_updates, overload_at,
+                                  entropy, target_ci=None, min_rounds=100, print_results=False):
     random.seed()
     # load large tree
-    file = open(smt_file, 'rb')
-    smt: TestSMT = pickle.load(file)
+    smt: TestSMT = load_smt(smt_file)
     smtu = SMTutil(hf, smt.depth)
-    file.close()
     # insert our own node
     target = hf('4')
     smt.add_node(target)
-    target_path, target_path_bm = smt.path(target)
-    # backup reference SMT for reloading
-    smt_bak = copy.deepcopy(smt)
+    # following changes only go to an overlay, reset() discards them
+    smt = mapped_smt.overlay_smt(smt)
+    target_path_bak, target_path_bm_bak = smt.path(target)
+    target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
     smt_size = len(smt.int_sort_leaves)
 
     # measurements
@@ -733,14 +1048,15 @@ def bigtest_repair_mix_cache_incr(smt_file, hf, cache_level, sub_depth, poi_dept
     overloads = 0
     cache_size = 0
     cache_size_set = False
+    early_stop = EarlyStop(target_ci, min_rounds)
     start = time.process_time()
     for x in tqdm(range(entropy)):
+        if early_stop.reached():
+            break
         # reset SMT
         if len(smt.int_sort_leaves) > (smt_size * 2):
-            smt = copy.deepcopy(smt_bak)
-            target_path, target_path_bm = smt.path(target)
-            # free up memory
-            gc.collect()
+            smt.reset()
+            target_path, target_path_bm = target_path_bak.copy(), target_path_bm_bak
 
         # update & get root
         actual_root = ''
@@ -761,6 +1077,7 @@ def bigtest_repair_mix_cache_incr(smt_file, hf, cache_level, sub_depth, poi_dept
             first_ten += 1
             avg += 1
             if x > 0:
+                early_stop.add_tries(1)
                 continue
 
         # meet nodes
@@ -769,6 +1086,7 @@ def bigtest_repair_mix_cache_incr(smt_file, hf, cache_level, sub_depth, poi_dept
                 # update so subsequent things work
                 target_path, target_path_bm = smt.path(target)
                 overloads += 1
+                early_stop.add_tries(None)
                 break
 
             # meet a random node
@@ -827,19 +1145,21 @@ def bigtest_repair_mix_cache_incr(smt_file, hf, cache_level, sub_depth, poi_dept
                 avg += i + 1
                 mini = min(mini, i)
                 maxi = max(maxi, i)
+                early_stop.add_tries(i + 1)
                 break
 
     stop = time.process_time()
+    rounds = early_stop.rounds
     if print_results:
         print('bigtest_repair_mix_cache_incr(' + smt_file + ', ' + str(cache_level) + ', ' + str(sub_depth) +
               ', ' + str(poi_depth) + ', ' + str(missed_updates) + ', ' + str(entropy) + ')')
         print('Mix-Cache is ' + str(2**cache_level + cache_size) + ' in size.')
-        print('Avg. worked on ' + str('{0:.3g}'.format(avg / max(1, (entropy - overloads)))) +
+        print('Avg. worked on ' + str('{0:.3g}'.format(avg / max(1, (rounds - overloads)))) +
               's try. Min: ' + str(mini) + ' Max: ' + str(maxi) +
-              ' First Tries: ' + str(first_tries) + ' (' + '{0:.3g}'.format(first_tries / entropy * 100) + '%)' +
-              ' First 10 Tries: ' + str(first_ten) + ' (' + '{0:.3g}'.format(first_ten / entropy * 100) + '%)' +
-              ' Overloads: ' + str(overloads) + ' (' + '{0:.3g}'.format(overloads / entropy * 100) + '%)')
-        print('Total Elapsed Time: ' + str(stop - start) + 's.')
+              ' First Tries: ' + str(first_tries) + ' (' + '{0:.3g}'.format(first_tries / rounds * 100) + '%)' +
+              ' First 10 Tries: ' + str(first_ten) + ' (' + '{0:.3g}'.format(first_ten / rounds * 100) + '%)' +
+              ' Overloads: ' + str(overloads) + ' (' + '{0:.3g}'.format(overloads / rounds * 100) + '%)')
+        print('Total Elapsed Time: ' + str(stop - start) + 's, ' + str(rounds) + ' rounds.')
     else:
         results = {
             # params
@@ -850,16 +1170,17 @@ def bigtest_repair_mix_cache_incr(smt_file, hf, cache_level, sub_depth, poi_dept
             'missed_updates': missed_updates,
             'overload_at': overload_at,
             'entropy': entropy,
+            'target_ci': target_ci,
             # values
+            'rounds': rounds,
             'cache_size': 2**cache_level + 2**sub_depth * poi_depth,
-            'avg_try': avg / max(1, (entropy - overloads)),
-            'first_tries': first_tries / entropy * 100,
-            'first_ten': first_ten / entropy * 100,
-            'overloads': overloads / entropy * 100
+            'avg_try': avg / max(1, (rounds - overloads)),
+            'first_tries': first_tries / rounds * 100,
+            'first_ten': first_ten / rounds * 100,
+            'overloads': overloads / rounds * 100
         }
         # free memory, so waiting processes won't reserve it
         smt = None
-        smt_bak = None
         gc.collect()
         return results
 
@@ -868,10 +1189,8 @@ def bigtest_repair_mix_cache_incr(smt_file, hf, cache_level, sub_depth, poi_dept
 def bigtest_merge_poi_savings(smt_file, hf, poi_updates, cache_level, entropy, print_results=False):
     random.seed()
     # load large tree
-    file = open(smt_file, 'rb')
-    smt: TestSMT = pickle.load(file)
+    smt: TestSMT = load_smt(smt_file)
     smtu = SMTutil(hf, smt.depth)
-    file.close()
 
     # measurements
     avg_complete_size = 0
@@ -921,10 +1240,8 @@ def bigtest_merge_poi_savings(smt_file, hf, poi_updates, cache_level, entropy, p
 def bigtest_new_poi_savings(smt_file, hf, poi_updates, entropy, print_results=False):
     random.seed()
     # load large tree
-    file = open(smt_file, 'rb')
-    smt: TestSMT = pickle.load(file)
+    smt: TestSMT = load_smt(smt_file)
     smtu = SMTutil(hf, smt.depth)
-    file.close()
 
     # measurements
     avg_complete_size = 0
@@ -1,12 +1,19 @@
 import sys
+import os
 import csv
+import inspect
+import itertools
 import hashf
-from multiprocessing import Pool
+from multiprocessing import get_all_start_methods, get_context
 import ops_big_tests
+import mapped_smt
+
+FORK = 'fork' in get_all_start_methods()  # not on Windows
 
 # class to execute large simulation campaigns
 # execute with, e.g., test-case 4, 20 threads, results-csv, output-file:
 # nohup python3 eval.py 4 20 test4.csv > h4.out &
+# results are appended to the csv as soon as a job finishes, re-running the same command skips finished jobs
 
 def main():
     if len(sys.argv) < 4:
@@ -18,33 +25,62 @@ def main():
 
     # common params
     smt_file = '100kN256.smt'
+    # share one base tree across all processes instead of a copy per process: loaded once & inherited by the forked
+    # workers (copy-on-write, lookups as fast as in an own copy, see ops_big_tests.share_smt), where processes are
+    # not forked a memory-mapped tree is shared instead (mapped_smt, lookups ~4x slower)
+    shared_smt = True
     hf = hashf.minhash
     overload_at = 100
-    entropy = 10000
+    entropy = 10000  # max. rounds per job
+    early_stopping = False  # stop a job once the CIs of its main metrics are within target_ci
+    # cases 1 & 2: evaluate missed updates in incremental runs over chunks of them (one per process, see
+    # sweep_chunks), instead of a job each, far less total work while all processes still have a job
+    sweep = True
 
     # for respective case, construct parameter list
     job = None  # function pointer
     param_list = []  # list of tuples, e.g.: [(1, 1), (2, 1), (3, 1)]
+    cost = None  # estimated relative runtime of a parameter tuple, longest jobs are started first
     if case == 1:
         job = ops_big_tests.bigtest_repair_rnd_nodes
+        cost = lambda p: top(p[2]) + p[3]  # missed updates + encounters
+        target_ci = {'avg_try': 0.5, 'overloads': 0.5}
         missed_updates = [1, 2, 3, 5, 10, 20, 30, 50, 100, 200, 300, 500, 1000]
-        for i in missed_updates:
-            param_list.append((smt_file, hf, i, overload_at, entropy))
+        if sweep:
+            job = ops_big_tests.bigtest_repair_rnd_nodes_sweep
+            for chunk in sweep_chunks(missed_updates, processes):
+                param_list.append((smt_file, hf, chunk, overload_at, entropy))
+        else:
+            for i in missed_updates:
+                param_list.append((smt_file, hf, i, overload_at, entropy))
     elif case == 2:
         job = ops_big_tests.bigtest_repair_lvl_cache
+        cost = lambda p: top(p[3]) + 2 ** top(p[2])  # missed updates + cache size
+        target_ci = {'success': 0.5}
         cache_level = [7, 8, 9, 10, 11, 12, 13]
         missed_updates = [1, 2, 3, 5, 10, 20, 30, 50, 100, 200, 300, 500, 1000]
-        for i in cache_level:
-            for j in missed_updates:
-                param_list.append((smt_file, hf, i, j, entropy))
+        if sweep:
+            # a job per cache level, missed updates are chunked if there are more processes than cache levels
+            job = ops_big_tests.bigtest_repair_lvl_cache_sweep
+            for i in cache_level:
+                for chunk in sweep_chunks(missed_updates, -(-processes // len(cache_level))):
+                    param_list.append((smt_file, hf, [i], chunk, entropy))
+        else:
+            for i in cache_level:
+                for j in missed_updates:
+                    param_list.append((smt_file, hf, i, j, entropy))
     elif case == 3:
         job = ops_big_tests.bigtest_construct_rnd_lvl_cache
         overload_at = 1000
+        cost = lambda p: 2 ** p[2]  # encounters needed grow with cache size
+        target_ci = {'avg_try': 5, 'overloads': 0.5}
         cache_level = [5, 6, 7, 8, 9, 10]
         for i in cache_level:
             param_list.append((smt_file, hf, i, overload_at, entropy))
     elif case == 4:
         job = ops_big_tests.bigtest_repair_sub_cache
+        cost = lambda p: p[4] + 2 ** p[2] * p[3]  # missed updates + sub-cache size
+        target_ci = {'avg_try': 0.5, 'overloads': 0.5}
         sub_depth = [2, 3, 4, 5, 6, 7, 8]
         poi_depth = [2, 4, 8]
         missed_updates = [1, 2, 3, 5, 10, 20, 30, 50, 100, 200, 300, 500, 1000]
@@ -54,6 +90,8 @@ def main():
                     param_list.append((smt_file, hf, i, j, k, overload_at, entropy))
     elif case == 5:
         job = ops_big_tests.bigtest_repair_mix_cache
+        cost = lambda p: p[5] + 2 ** p[2] + 2 ** p[3] * p[4]  # missed updates + cache size
+        target_ci = {'avg_try': 0.5, 'overloads': 0.5}
         # 100 updates, 1024 cache size (clvl=10)
         param_list.append((smt_file, hf, 9, 7, 4, 100, overload_at, entropy))
         param_list.append((smt_file, hf, 9, 6, 8, 100, overload_at, entropy))
@@ -69,22 +107,88 @@ def main():
         param_list.append((smt_file, hf, 12, 12, 8, 10000, overload_at, entropy))
         param_list.append((smt_file, hf, 11, 13, 6, 10000, overload_at, entropy))
         param_list.append((smt_file, hf, 11, 12, 12, 10000, overload_at, entropy))
+    if early_stopping:
+        param_list = [p + (target_ci,) for p in param_list]
     print('created ' + str(len(param_list)) + ' jobs.')
 
-    # execute job-queue
-    pool = Pool(processes)
-    results = pool.starmap(job, param_list)  # returns list of return values (dicts), blocking
+    # all workers share one read-only tree & keep only own changes
+    if shared_smt and FORK:
+        ops_big_tests.share_smt(smt_file)
+    elif shared_smt:
+        mapped_file = mapped_smt.prepare_mapped_smt(smt_file)
+        param_list = [(mapped_file,) + p[1:] for p in param_list]
+
+    run_jobs(job, param_list, processes, csv_file, cost)
+
+
+# biggest value of a param, list params of sweep jobs are evaluated up to their max.
+def top(v):
+    return max(v) if isinstance(v, list) else v
+
+
+# split sorted values into (at most) no_chunks contiguous chunks of about the same length, each one a sweep job
+def sweep_chunks(values, no_chunks):
+    values = sorted(values)
+    no_chunks = max(1, min(no_chunks, len(values)))
+    return [values[len(values) * i // no_chunks:len(values) * (i + 1) // no_chunks] for i in range(no_chunks)]
+
+
+# names of the given job parameters as they appear in its result dict (everything but the hash function)
+def key_names(job, params):
+    names = list(inspect.signature(job).parameters)[:len(params)]
+    return [n for n in names if n != 'hf']
+
+
+# keys of all result rows of a job, list params of sweep jobs give one row per combination
+def job_keys(job, params):
+    names = list(inspect.signature(job).parameters)
+    values = [v if isinstance(v, list) else [v] for n, v in zip(names, params) if n != 'hf']
+    return [tuple(str(v) for v in key) for key in itertools.product(*values)]
+
+
+def run_job(job_params):
+    job, params = job_params
+    return params, job(*params)
+
+
+# execute job-queue, longest first, append each result to the csv on arrival, skip jobs already in the csv
+def run_jobs(job, param_list, processes, csv_file, cost=None):
+    fieldnames = None
+    done = set()
+    if param_list and os.path.exists(csv_file) and os.path.getsize(csv_file) > 0:
+        names = key_names(job, param_list[0])
+        with open(csv_file, newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            fieldnames = reader.fieldnames
+            for row in reader:
+                done.add(tuple(row.get(n) for n in names))
+    todo = [p for p in param_list if not all(key in done for key in job_keys(job, p))]
+    print(f'{len(param_list) - len(todo)} jobs already done, {len(todo)} to go.')
+    if cost is not None:
+        todo.sort(key=cost, reverse=True)
 
-    # write results into csv
+    # forked workers inherit the trees shared by this process (see ops_big_tests.share_smt)
+    pool = get_context('fork' if FORK else None).Pool(processes)
     try:
-        with open(csv_file, 'w', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=results[0].keys())
-            writer.writeheader()
-            for data in results:
-                writer.writerow(data)
+        with open(csv_file, 'a', newline='') as csvfile:
+            writer = None if fieldnames is None else csv.DictWriter(csvfile, fieldnames=fieldnames)
+            # chunksize 1, so no worker idles while others still hold queued jobs
+            for i, (params, result) in enumerate(pool.imap_unordered(run_job, [(job, p) for p in todo], 1)):
+                # sweep jobs return a list of results
+                rows = result if isinstance(result, list) else [result]
+                if writer is None:
+                    writer = csv.DictWriter(csvfile, fieldnames=rows[0].keys())
+                    writer.writeheader()
+                writer.writerows(rows)
+                csvfile.flush()
+                os.fsync(csvfile.fileno())
+                print(f'finished job {i + 1}/{len(todo)}: {params[2:]}')
     except IOError:
         print("error while writing csv!")
         quit()
+    finally:
+        pool.close()
+        pool.join()
 
 
 if __name__ == "__main__":
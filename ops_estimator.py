@@ -0,0 +1,180 @@
+import argparse
+import bisect
+import math
+import sys
+import time
+
+import numpy as np
+
+import hashf
+import ops_big_tests
+
+# prefix-level estimator for repair success, much faster than the exact big tests (no hashing, no trees)
+# whether a repair works only depends on the common prefix lengths of the target & the new leaves:
+# - missed update j changes the target's PoI sibling at depth p_j + 1, p_j = common prefix length (clz of XOR)
+# - level-cache repair replaces the siblings at depth 1..cache_level -> success iff max(p_j) < cache_level
+# - PoI repair via a random leaf y fixes all siblings down to depth p_y + 1 -> needs one y with p_y >= max(p_j),
+#   so the no. of tries is geometric with the share of such helpful leaves in the tree
+# leaf positions are uniform (hash outputs), only the top 64 bits are drawn
+# e.g. estimate & cross-check against exact big tests on a small tree:
+# python3 ops_estimator.py --missed-updates 1 2 3 --cache-levels 3 5 --crosscheck 20kN256.smt --entropy 2000
+
+POS_BITS = 64
+
+
+# leading zeros of uint64 values (binary search over shifts)
+def clz64(x):
+    x = x.copy()
+    n = np.zeros(x.shape, dtype=np.int64)
+    for s in (32, 16, 8, 4, 2, 1):
+        m = (x >> np.uint64(POS_BITS - s)) == 0
+        n += m * s
+        x[m] <<= np.uint64(s)
+    n[x == 0] = POS_BITS
+    return n
+
+
+# common prefix lengths of target & positions, positions hold the top min(depth, 64) bits
+def prefix_lengths(target, positions, depth):
+    bits = min(depth, POS_BITS)
+    return clz64(np.uint64(target) ^ positions) - (POS_BITS - bits)
+
+
+def random_positions(rng, shape, depth):
+    return rng.integers(0, 2 ** min(depth, POS_BITS), size=shape, dtype=np.uint64, endpoint=False)
+
+
+# no. of leaves (other than target) sharing at least p prefix bits with target, p = 0..min(depth, 64)
+def tree_prefix_counts(leaves, target_pos, depth):
+    counts = []
+    for p in range(min(depth, POS_BITS) + 1):
+        lo = target_pos >> (depth - p) << (depth - p)
+        hi = lo + (1 << (depth - p))
+        counts.append(bisect.bisect_left(leaves, hi) - bisect.bisect_left(leaves, lo))
+    counts = np.array(counts, dtype=np.int64)
+    if bisect.bisect_left(leaves, target_pos) < len(leaves) and \
+            leaves[bisect.bisect_left(leaves, target_pos)] == target_pos:
+        counts -= 1
+    return counts
+
+
+# estimate repair success for k missed updates
+# no_leaves: leaves in the tree besides target, prefix_counts: exact neighborhood of target (tree_prefix_counts),
+# otherwise the other leaves are uniform, i.e. binomial
+# returns dict with 'lvlc_success' per cache level & avg_try/first_tries/first_ten/overloads of PoI repair
+def estimate_repair(depth, no_leaves, missed_updates, cache_levels, overload_at, samples, prefix_counts=None,
+                    seed=None, chunk_positions=2 ** 22):
+    rng = np.random.default_rng(seed)
+    target = int(rng.integers(0, 2 ** min(depth, POS_BITS), dtype=np.uint64))
+    # leaves to choose an encounter from (a node does not meet itself): others + new
+    total_leaves = no_leaves + missed_updates
+    lvlc_success = dict.fromkeys(cache_levels, 0)
+    tries_sum = 0
+    successes = 0
+    first_tries = 0
+    first_ten = 0
+    overloads = 0
+    done = 0
+    chunk = max(1, chunk_positions // missed_updates)
+    while done < samples:
+        n = min(chunk, samples - done)
+        p = prefix_lengths(target, random_positions(rng, (n, missed_updates), depth), depth)
+        p_max = p.max(axis=1)
+        for c in cache_levels:
+            lvlc_success[c] += int(np.count_nonzero(p_max < c))
+
+        # helpful leaves: new ones diverging at p_max & others sharing at least p_max bits
+        helpful = np.count_nonzero(p == p_max[:, None], axis=1)
+        if prefix_counts is None:
+            helpful += rng.binomial(no_leaves, np.exp2(-p_max.astype(np.float64)))
+        else:
+            helpful += prefix_counts[p_max]
+        tries = rng.geometric(helpful / total_leaves)
+        ok = tries <= overload_at + 1
+        successes += int(np.count_nonzero(ok))
+        tries_sum += int(tries[ok].sum())
+        first_tries += int(np.count_nonzero(tries == 1))
+        first_ten += int(np.count_nonzero(tries <= 10))
+        overloads += n - int(np.count_nonzero(ok))
+        done += n
+    return {
+        # params
+        'depth': depth,
+        'no_leaves': no_leaves,
+        'missed_updates': missed_updates,
+        'overload_at': overload_at,
+        'samples': samples,
+        # values
+        'lvlc_success': {c: v / samples * 100 for c, v in lvlc_success.items()},
+        'avg_try': tries_sum / max(1, successes),
+        'first_tries': first_tries / samples * 100,
+        'first_ten': first_ten / samples * 100,
+        'overloads': overloads / samples * 100
+    }
+
+
+# half-width of a 99.7% interval for a rate in percent estimated from n samples
+def rate_ci(rate, n, z=3.0):
+    r = rate / 100
+    return z * math.sqrt(max(r * (1 - r), 1 / n) / n) * 100
+
+
+# compare estimator with exact big tests on the given (small) tree, returns list of rows
+# (metric, params, exact, estimate, tolerance, ok)
+def crosscheck(smt_file, hf, missed_updates, cache_levels, overload_at, entropy, samples):
+    smt = ops_big_tests.load_smt(smt_file)
+    leaves = smt.int_sort_leaves
+    target_pos = hashf.get_int(hf('4'))  # target of the big tests
+    prefix_counts = tree_prefix_counts(leaves, target_pos, smt.depth)
+    rows = []
+    for k in missed_updates:
+        est = estimate_repair(smt.depth, len(leaves), k, cache_levels, overload_at, samples, prefix_counts)
+        for c in cache_levels:
+            exact = ops_big_tests.bigtest_repair_lvl_cache(smt_file, hf, c, k, entropy)
+            tol = rate_ci(exact['success'], exact['rounds']) + rate_ci(est['lvlc_success'][c], samples)
+            rows.append(('lvlc_success', f'clvl {c}, k {k}', exact['success'], est['lvlc_success'][c], tol))
+        exact = ops_big_tests.bigtest_repair_rnd_nodes(smt_file, hf, k, overload_at, entropy)
+        for metric in ['first_tries', 'first_ten', 'overloads']:
+            tol = rate_ci(exact[metric], exact['rounds']) + rate_ci(est[metric], samples)
+            rows.append((metric, f'k {k}', exact[metric], est[metric], tol))
+    rows = [r + (abs(r[2] - r[3]) <= r[4],) for r in rows]
+    print(f'{"metric":<14} {"params":<16} {"exact":>8} {"estimate":>8} {"tol":>6}')
+    for metric, params, exact, est, tol, ok in rows:
+        print(f'{metric:<14} {params:<16} {exact:>8.2f} {est:>8.2f} {tol:>6.2f} {"" if ok else "MISMATCH"}')
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='prefix-level estimator for repair success')
+    parser.add_argument('--depth', type=int, default=256)
+    parser.add_argument('--leaves', type=int, default=100000, help='leaves in the tree (besides target)')
+    parser.add_argument('--missed-updates', nargs='+', type=int, default=[1, 2, 3, 5, 10, 20, 30, 50, 100])
+    parser.add_argument('--cache-levels', nargs='+', type=int, default=[7, 8, 9, 10, 11, 12, 13])
+    parser.add_argument('--overload-at', type=int, default=100)
+    parser.add_argument('--samples', type=int, default=1000000)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--crosscheck', metavar='SMT_FILE', help='compare with exact big tests on this tree')
+    parser.add_argument('--hash-function', default='minhash', choices=list(hashf.hash_functions))
+    parser.add_argument('--entropy', type=int, default=1000, help='rounds of the exact big tests')
+    args = parser.parse_args(argv)
+
+    if args.crosscheck:
+        rows = crosscheck(args.crosscheck, hashf.hash_functions[args.hash_function], args.missed_updates,
+                          args.cache_levels, args.overload_at, args.entropy, args.samples)
+        return 0 if all(r[-1] for r in rows) else 1
+
+    for k in args.missed_updates:
+        start = time.perf_counter()
+        r = estimate_repair(args.depth, args.leaves, k, args.cache_levels, args.overload_at, args.samples,
+                            seed=args.seed)
+        elapsed = time.perf_counter() - start
+        lvlc = ', '.join(f'clvl {c}: {v:1.3f}%' for c, v in r['lvlc_success'].items())
+        print(f'{k} missed updates: lvlc success {lvlc}')
+        print(f'  PoI repair avg. try {r["avg_try"]:1.3g}, first tries {r["first_tries"]:1.3g}%, '
+              f'first 10 tries {r["first_ten"]:1.3g}%, overloads {r["overloads"]:1.3g}% '
+              f'({args.samples / elapsed:1.3g} samples/s)')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
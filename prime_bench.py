@@ -0,0 +1,134 @@
+import argparse
+import json
+import random
+import sys
+
+import hashf
+import wire
+from node import Node
+from sim import BigNetSim
+from sim_config import SimConfig
+
+# wire sizes of the two prime root layouts (SimConfig.prime_layout), encoded with wire.WireCodec:
+# - per encounter: the prime root every encounter starts with
+# - per prime update: prime root + roots (parity) or digests of the descent (merkle), by no. of differing parts,
+#   measured with the real Node methods on random roots, parity fails are counted & cost all roots
+# - optionally paired sims (same crn_seed) for the totals of a whole run
+# e.g. python3 prime_bench.py --parts 52 --changed 1 2 5 10 20 52 --sim
+
+
+def layout_config(layout, parts, args):
+    c = SimConfig()
+    c.prime_layout = layout
+    c.no_smt_parts = parts
+    c.hash_function = hashf.hash_functions[args.hash_function]
+    c.hash_depth = args.depth
+    c.recalc_fields()
+    if (parts - c.main_parities) % c.aggregated_parities:
+        raise ValueError(f'{parts} parts are not {c.main_parities} + a multiple of {c.aggregated_parities} '
+                         f'(SimConfig.main_parities, aggregated_parities)')
+    return c
+
+
+def random_digest(rnd, c):
+    return c.hash_function(str(rnd.random()))
+
+
+# bytes of one prime update of a node whose roots differ from the helper's in changed parts, & if parity failed
+def update_size(c, codec, rnd, changed):
+    helper_roots = [random_digest(rnd, c) for _ in range(c.no_smt_parts)]
+    outdated_roots = helper_roots.copy()
+    for p in rnd.sample(range(c.no_smt_parts), changed):
+        outdated_roots[p] = random_digest(rnd, c)
+    helper = Node(0, 0, [], 0, helper_roots, None, c)
+    helper.prime_root = helper.calc_prime_root()
+    outdated = Node(1, 0, [], 0, outdated_roots, None, c)
+    outdated.prime_root = outdated.calc_prime_root()
+    if c.prime_layout == 'merkle':
+        wrong_parts, sent_digests = outdated.set_prime_merkle_wrong_parts(helper.prime_root, helper.smt_roots)
+        selected = helper.get_merkle_smt_roots(wrong_parts)
+        size = codec.prime_root_size + sent_digests * codec.digest_bytes
+    else:
+        selected = helper.get_ided_smt_roots(*outdated.set_prime_id_wrong_parts(helper.prime_root))
+        size = codec.prime_root_size + codec.roots_size(selected)
+    if not outdated.set_ided_smt_roots(selected):
+        # as in BigNetSim.update_prime, all roots are exchanged
+        return size + codec.roots_size(list(enumerate(helper_roots))), True
+    return size, False
+
+
+def bench_updates(args):
+    results = []
+    for parts in args.parts:
+        for layout in ('parity', 'merkle'):
+            c = layout_config(layout, parts, args)
+            codec = wire.WireCodec(c)
+            rnd = random.Random(args.seed)
+            for changed in sorted({min(k, parts) for k in args.changed}):
+                sizes, fails = [], 0
+                for _ in range(args.trials):
+                    size, failed = update_size(c, codec, rnd, changed)
+                    sizes.append(size)
+                    fails += failed
+                results.append({'layout': layout, 'parts': parts, 'changed': changed,
+                                'encounter_bytes': codec.prime_root_size, 'update_bytes': sum(sizes) / len(sizes),
+                                'parity_fails': fails / args.trials})
+    return results
+
+
+# paired runs of both layouts on the same trajectory
+def bench_sim(args):
+    results = []
+    for layout in ('parity', 'merkle'):
+        c = SimConfig()
+        c.prime_layout = layout
+        c.wire_sizes = True
+        c.crn_seed = args.seed
+        c.sanity_checks = False
+        c.recalc_fields()
+        s = BigNetSim(c)
+        s.sim()
+        results.append({'layout': layout, 'all_bytes': s.msg_sizes_all, 'update_bytes': s.msg_sizes_update,
+                        'prime_updates': s.prime_successes + s.parity_fails, 'encounters': s.total_encounters})
+    return results
+
+
+def print_updates(results):
+    print(f'{"parts":>6} {"changed":>8} {"layout":>7} {"encounter B":>12} {"update B":>10} {"parity fails":>13}')
+    for r in results:
+        print(f'{r["parts"]:>6} {r["changed"]:>8} {r["layout"]:>7} {r["encounter_bytes"]:>12} '
+              f'{r["update_bytes"]:>10.1f} {r["parity_fails"] * 100:>12.2f}%')
+
+
+def print_sim(results):
+    for r in results:
+        print(f'sim {r["layout"]}: {r["all_bytes"] / 1024:1.1f} KB sent by nodes, '
+              f'{r["update_bytes"] / max(1, r["prime_updates"]):1.1f} B per prime update '
+              f'({r["prime_updates"]} updates, {r["encounters"]} encounters)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='wire sizes of the parity & merkle prime root layouts')
+    parser.add_argument('--parts', nargs='+', type=int, default=[52], help='no. of smt parts')
+    parser.add_argument('--changed', nargs='+', type=int, default=[1, 2, 3, 5, 10, 20, 52],
+                        help='no. of parts differing between outdated node & helper')
+    parser.add_argument('--hash-function', default='minhash', choices=list(hashf.hash_functions))
+    parser.add_argument('--depth', type=int, default=256)
+    parser.add_argument('--trials', type=int, default=200, help='random root sets per point')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--sim', action='store_true', help='also run paired sims with the default config')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args(argv)
+
+    updates = bench_updates(args)
+    print_updates(updates)
+    sims = bench_sim(args) if args.sim else []
+    print_sim(sims)
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'args': vars(args), 'updates': updates, 'sims': sims}, fp, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+
+from tqdm import tqdm
+
+import hashf
+import sim_config
+from smt import SMT
+
+# content-addressed cache of passive forests (the SMT parts holding the passive certs, see CA.initialize)
+# a forest only depends on hash function, depth, no. of parts & no. of passive certs, so it is stored as
+# <digest of the other params>-<passive_nodes>.bns in the cache dir, a header repeats all params & is checked on load
+# passive cert i always goes to part i % no_smt_parts, so a smaller forest is the prefix of a bigger one:
+# the biggest cached forest with <= passive_nodes certs is loaded & only the rest is built
+
+MAGIC = b'VCERSETUP1\n'
+CERT_OFFSET = 10000000000  # passive cert i is hash_function(str(CERT_OFFSET + i))
+
+
+def hash_function_name(hash_function):
+    hash_function = getattr(hash_function, 'hash_function', hash_function)  # hash accounting wrapper
+    for name, hf in hashf.hash_functions.items():
+        if hf is hash_function:
+            return name
+    raise ValueError(f'hash function {hash_function} is not in hashf.hash_functions')
+
+
+# params a forest depends on, besides the no. of passive certs
+def forest_params(c: sim_config.SimConfig):
+    return {'hash_function': hash_function_name(c.hash_function), 'hash_depth': c.hash_depth,
+            'no_smt_parts': c.no_smt_parts, 'cert_offset': CERT_OFFSET}
+
+
+def forest_key(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def read_header(fp):
+    if fp.readline() != MAGIC:
+        return None
+    return json.loads(fp.readline())
+
+
+# returns smts or None if the file does not hold exactly this forest
+def load_forest(file_name, params, passive_nodes):
+    with open(file_name, 'rb') as fp:
+        header = read_header(fp)
+        if header != dict(params, passive_nodes=passive_nodes):
+            logging.warning(f'{file_name} does not match its name, header: {header}')
+            return None
+        smts = pickle.load(fp)
+    if len(smts) != params['no_smt_parts'] or any(s.depth != params['hash_depth'] for s in smts):
+        logging.warning(f'{file_name} does not match its header')
+        return None
+    return smts
+
+
+def save_forest(file_name, params, passive_nodes, smts):
+    with open(file_name + '.tmp', 'wb') as fp:
+        fp.write(MAGIC)
+        fp.write(json.dumps(dict(params, passive_nodes=passive_nodes), sort_keys=True).encode() + b'\n')
+        pickle.dump(smts, fp, pickle.HIGHEST_PROTOCOL)
+    os.replace(file_name + '.tmp', file_name)
+
+
+# cached forests of this key: [(passive_nodes, file name)], biggest first
+def cached_forests(cache_dir, key):
+    result = []
+    for f in os.listdir(cache_dir):
+        name, ext = os.path.splitext(f)
+        if ext == '.bns' and name.startswith(key + '-') and name[len(key) + 1:].isdigit():
+            result.append((int(name[len(key) + 1:]), os.path.join(cache_dir, f)))
+    return sorted(result, reverse=True)
+
+
+# passive cert i is a leaf of part i % no_smt_parts
+def has_passive_cert(smts, c: sim_config.SimConfig, i):
+    cert = c.hash_function(str(CERT_OFFSET + i))
+    return smts[i % c.no_smt_parts].get_hash(hashf.get_int(cert), c.hash_depth) != ''
+
+
+# legacy single forest file (SimConfig.smt_setup_file), written with the same header as cached forests
+# older files without a header are checked by probing the first & last passive cert & the one after it,
+# which catches other hash functions (leaves are their digests) & no. of passive certs
+# raises ValueError if the file does not match
+def load_setup_file(c: sim_config.SimConfig):
+    params = forest_params(c)
+    with open(c.smt_setup_file, 'rb') as fp:
+        header = read_header(fp)
+        if header is None:
+            fp.seek(0)
+        smts = pickle.load(fp)
+    if header is not None:
+        if header != dict(params, passive_nodes=c.passive_nodes):
+            raise ValueError(f'{c.smt_setup_file} was built with {header}, use setup_cache_dir to build forests '
+                             f'per config')
+    elif len(smts) != c.no_smt_parts or any(s.depth != c.hash_depth for s in smts) or \
+            not all(has_passive_cert(smts, c, i) for i in {0, c.passive_nodes - 1} if i < c.passive_nodes) or \
+            has_passive_cert(smts, c, c.passive_nodes):
+        raise ValueError(f'{c.smt_setup_file} does not hold the {c.passive_nodes} passive certs of this config '
+                         f'(no. of parts, depth, hash function or no. of passive certs differ), use setup_cache_dir to build forests '
+                         f'per config')
+    return smts
+
+
+def save_setup_file(c: sim_config.SimConfig, smts):
+    save_forest(c.smt_setup_file, forest_params(c), c.passive_nodes, smts)
+
+
+# passive forest of the config, from the cache or (partly) built & cached
+def load_passive_smts(c: sim_config.SimConfig):
+    os.makedirs(c.setup_cache_dir, exist_ok=True)
+    params = forest_params(c)
+    key = forest_key(params)
+    smts = None
+    built = 0
+    for passive_nodes, file_name in cached_forests(c.setup_cache_dir, key):
+        if passive_nodes <= c.passive_nodes:
+            smts = load_forest(file_name, params, passive_nodes)
+            if smts is not None:
+                built = passive_nodes
+                break
+    if smts is None:
+        smts = [SMT(c.hash_function, c.hash_depth) for _ in range(c.no_smt_parts)]
+    if built < c.passive_nodes:
+        logging.info(f'building passive forest {key}: {built} -> {c.passive_nodes} certs')
+        for i in tqdm(range(built, c.passive_nodes)):
+            smts[i % c.no_smt_parts].add_node(c.hash_function(str(CERT_OFFSET + i)))
+        save_forest(os.path.join(c.setup_cache_dir, f'{key}-{c.passive_nodes}.bns'), params, c.passive_nodes, smts)
+    return smts
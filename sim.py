@@ -2,6 +2,10 @@ from ca import CA
 from node import Node
 from cacher import Cacher
 import smt_util
+import hashf
+import tracer
+import wire
+from smt import SMT
 from typing import List
 from typing import Set
 from sim_config import SimConfig
@@ -11,10 +15,23 @@ from tqdm import tqdm
 import time
 import sys
 import copy
+import contextlib
+import os
+
+
+NO_ACC_SCOPE = contextlib.nullcontext()
+NEW_ISSUE_ID = 20000000000  # node ids of inserted new issues, not simulated as nodes (like passive nodes)
+
+
+# a sim's nodes are not in the CA's write-ahead log, so a sim cannot continue from one -> wal_dir has to be empty
+def check_wal_dir(c):
+    if c.wal_dir and os.path.isdir(c.wal_dir) and os.listdir(c.wal_dir):
+        raise ValueError(f'wal_dir {c.wal_dir} is not empty, the sim cannot recover its nodes from it')
 
 
 class BigNetSim:
-    def __init__(self, config):
+    # ca: already initialized CA shared with other variants (see MultiVariantSim), None sets up an own one
+    def __init__(self, config, ca=None):
         random.seed()  # set a number for repeatable debugging
         logging.basicConfig(level=logging.WARNING)
 
@@ -23,6 +40,7 @@ class BigNetSim:
         self.failed_repairs = 0
         self.successful_repairs = 0
         self.lvlc_repairs = 0
+        self.sub_cache_repairs = 0  # lvlc repairs that needed the sub-tree caches of the hybrid cache
         self.repair_try_aggr = 0
         self.prime_successes = 0
         self.parity_fails = 0
@@ -39,20 +57,39 @@ class BigNetSim:
         self.aggr_update_size = 0
         self.prune_count = 0
         self.aggr_prune_size = 0
+        self.delta_resets = 0  # resets served from the CA's journal
+        self.merkle_digests = 0  # digests sent while descending Merkle prime roots
 
         # initialize ca
         self.c = config
-        self.smtu = smt_util.SMTutil(self.c.hash_function, self.c.hash_depth)
-        self.ca = CA(self.c)
+        self.tracer = tracer.Tracer() if self.c.trace_file else tracer.NULL_TRACER
+        self.smtu = smt_util.SMTutil(self.c.hash_function, self.c.hash_depth, self.c.intern_digests)
+        self.codec = wire.WireCodec(self.c) if self.c.wire_sizes else None
+        self.sub_cache_depths = self.c.sub_cache_depths()
         self.all_nodes: List[Node] = []
         self.revoked_nodes: List[Node] = []
-
-        logging.info('setting up CA...')
-        self.ca.initialize()
+        self.new_issues = 0  # inserted so far
+
+        self.own_ca = ca is None
+        if ca is None:
+            logging.info('setting up CA...')
+            check_wal_dir(self.c)
+            self.ca = CA(self.c)
+            self.ca.initialize()
+        else:
+            self.ca = ca
         prime_root = self.ca.get_prime()
         smt_roots = self.ca.get_smt_roots()
         lvl_caches = self.ca.get_lvl_caches(self.c.cache_level)
 
+        # hash accounting: nodes get a counting hash function, the CA keeps the raw one
+        self.hash_acc = None
+        node_config = self.c
+        if self.c.hash_accounting:
+            self.hash_acc = hashf.HashAccounting()
+            node_config = copy.copy(self.c)
+            node_config.hash_function = self.hash_acc.wrap(self.c.hash_function)
+
         # initialize nodes
         logging.info('initializing active nodes...')
         # check for unfilled cache elements -> incomplete lvl-cache
@@ -61,137 +98,65 @@ class BigNetSim:
                 if h == '':
                     logging.error('unfilled cache element found!')
                     sys.exit(-1)
+        # PoIs of all nodes in bulk
+        pois = self.ca.get_node_pois([(i, i % self.c.no_smt_parts) for i in range(self.c.start_no_nodes)])
         for i in tqdm(range(self.c.no_cacher)):
             smt_part = i % self.c.no_smt_parts
-            poi, poi_bm = self.ca.get_node_poi(i, smt_part)
+            poi, poi_bm = pois[i]
             node = Cacher(self.c.cache_level, copy.deepcopy(lvl_caches), i, smt_part,
-                          poi, poi_bm, smt_roots.copy(), copy.deepcopy(prime_root), self.c)
+                          poi, poi_bm, smt_roots.copy(), copy.deepcopy(prime_root), node_config,
+                          self.get_sub_caches(i, range(self.c.no_smt_parts)))
             self.all_nodes.append(node)
 
         for i in tqdm(range(self.c.no_cacher, self.c.start_no_nodes)):
             smt_part = i % self.c.no_smt_parts
-            poi, poi_bm = self.ca.get_node_poi(i, smt_part)
-            node = Node(i, smt_part, poi, poi_bm, smt_roots.copy(), copy.deepcopy(prime_root), self.c)
+            poi, poi_bm = pois[i]
+            node = Node(i, smt_part, poi, poi_bm, smt_roots.copy(), copy.deepcopy(prime_root), node_config)
             self.all_nodes.append(node)
 
     def sim(self):
-        sub_epoch = 1
-        for current_time_step in tqdm(range(self.c.total_time_steps)):
-            ##### each epoch action
-            if sub_epoch % self.c.subs_per_epoch == 0:
-                sub_epoch += 1
-                # update ca
-                self.ca.epoch_tree_change()
-                # update all nodes
-                self.epoch_update_nodes()
-                # insert new certs
-                self.issue_new_certs()
-
-            ##### each sub_epoch action
-            if current_time_step % self.c.time_steps_per_sub_epoch == 0:
-                sub_epoch += 1
-                # issue new certs for revoked nodes
-                self.ca.reissue_nodes(self.revoked_nodes)
-
-                # revoke some nodes
-                revoke_nodes: List[Node] = random.sample(self.all_nodes, self.c.revoked_per_sub_epoch)
-                # skip just re-issued nodes
-                revoke_nodes = [x for x in revoke_nodes if x not in self.revoked_nodes]
-                self.ca.revoke_nodes(revoke_nodes)
-                self.total_revokes += len(revoke_nodes)
-
-                # construct & send update
-                update = self.ca.construct_update(self.revoked_nodes, False)
-                update.extend(self.ca.construct_update(revoke_nodes, True))
-
-                # list for directly updating changed nodes
-                to_update_nodes = self.revoked_nodes.copy()
-                to_update_nodes.extend(revoke_nodes)
-                self.revoked_nodes.clear()  # remove re-issued nodes
-                self.revoked_nodes = revoke_nodes.copy()  # add freshly revoked nodes
-                revoke_nodes.clear()
-                # send update to all nodes
-                self.send_update(update, to_update_nodes)
-                logging.info(f'sent update containing {len(update)} update-pois')
-
-            ##### each time_step action: nodes encounter other nodes
-            self.total_encounters += self.c.encounters_per_node * len(self.all_nodes)
-            for n in self.all_nodes:
-                # skip if no updates needed
-                if not n.outdated_prime and not n.outdated_poi:
-                    if not isinstance(n, Cacher) or not n.outdated_lvlc:
-                        continue
-
-                # random encounters
-                encounters: List[Node] = random.sample(self.all_nodes, self.c.encounters_per_node)
-                for e in encounters:
-                    if e == n:  # happens sometimes...
-                        continue
-                    # MSGs basic prime encounter exchange, always happens
-                    self.msg_sizes_all += self.c.msg_size_prime_root
-                    # check if both are outdated -> no secure channel possible
-                    if e.outdated_poi and not e.outdated_prime and n.outdated_poi and not n.outdated_prime:
-                        self.encounters_both_no_poi += 1
-                    # node cannot help me if he's not fresh at all
-                    if e.outdated_prime:
-                        continue
-
-                    # update prime root
-                    if n.outdated_prime:
-                        self.update_prime(n, e)
-
-                    if isinstance(n, Cacher) and n.outdated_lvlc:
-                        n.update_try_lvlc += 1
-                        # update level-cache directly
-                        if isinstance(e, Cacher) and not e.outdated_lvlc:
-                            self.update_lvl_cache(n, e)
-                        # update level-cache via poi
-                        # -> TONS of overhead, is commented for performance, as virtually no improvement
-                        # elif not e.outdated_poi:
-                        #     self.update_lvl_cache_with_poi(n, e)
-
-                    if self.c.sanity_checks:
-                        outdated_poi = self.ca.get_node_poi(n.node_id, n.smt_part) != (n.poi, n.poi_bm)
-                        if outdated_poi and not n.outdated_poi and not n.revoked:
-                            logging.error(f'Node thinks its poi is good, but is not! node: {n}')
-                            logging.error(f'prime is {n.prime_root == self.ca.prime_root}')
-                            logging.error(f'real root is {self.ca.get_smt_roots()[n.smt_part]}, '
-                                          f'node root is {n.smt_roots[n.smt_part]}')
-                            logging.error(f'real poi: {self.ca.get_node_poi(n.node_id, n.smt_part)}')
-                            logging.error(f'node poi: {n.poi}, bm: {n.poi_bm}')
-                            logging.error(f'prev poi: {n.previous_poi}, bm: {n.previous_poi_bm}')
-                            logging.error(f'prup poi: {n.previous_update_poi}, '
-                                          f'bm: {n.previous_update_poi_bm}, cert: {n.previous_update_hash}, '
-                                          f'revoked: {n.previous_update_revoked}')
-
-                    # distributed repair of poi
-                    if n.outdated_poi:
-                        if not n.revoked:
-                            n.update_try += 1
-                    else:
-                        continue
-
-                    # update poi via lvl-cache
-                    if isinstance(e, Cacher) and not n.lvl_cache_tried and not e.outdated_lvlc:
-                        self.repair_via_lvlc(n, e)
-
-                    # update poi via other poi, if in same part
-                    if n.outdated_poi and not e.outdated_poi and e.smt_part == n.smt_part and \
-                            (not n.revoked or not e.revoked):
-                        self.repair_via_poi(n, e)
-
-                # if try threshold is reached, give up, force repair via CA & reset node
-                if n.outdated_poi and n.update_try > self.c.max_repair_tries:
-                    logging.info('node reached max tries for repair...')
-                    self.reset_outdated(n)
-                    # if isinstance(n, BnsCacher) and n.outdated_lvlc:
-                    #     self.reset_outdated_cacher(n)
-                    self.failed_repairs += 1
-                # Separate failsafe for cache leads to CA sending out tons of data, with virutally no improvement
-                if isinstance(n, Cacher) and n.outdated_lvlc and n.update_try_lvlc > self.c.max_repair_tries:
-                    self.reset_outdated_cacher(n)
+        self.instrument()
+        try:
+            sub_epoch = 1
+            for current_time_step in tqdm(range(self.c.total_time_steps)):
+                ##### each epoch action
+                if sub_epoch % self.c.subs_per_epoch == 0:
+                    sub_epoch += 1
+                    # update ca
+                    self.ca.epoch_tree_change()
+                    self.epoch_step()
+
+                ##### each sub_epoch action
+                if current_time_step % self.c.time_steps_per_sub_epoch == 0:
+                    sub_epoch += 1
+                    # revoke some nodes
+                    revoke_nodes = self.sample_revoke_nodes(current_time_step)
+
+                    # issue new certs for revoked nodes & revoke the new ones in one batch, send update
+                    update, _ = self.ca.apply_batch([(n, False) for n in self.revoked_nodes] +
+                                                    [(n, True) for n in revoke_nodes])
+                    self.revocation_step(update, revoke_nodes, current_time_step)
+                    # the next time step switches the epoch, pre-build its newest tree meanwhile
+                    if self.c.insert_new_issues and sub_epoch % self.c.subs_per_epoch == 0:
+                        self.ca.prepare_next_epoch(self.next_new_issues())
+
+                ##### each time_step action: nodes encounter other nodes
+                self.encounter_step(current_time_step)
+        finally:
+            # classes are patched globally, also unpatch them if the sim fails
+            self.tracer.uninstrument()
+            if self.own_ca:
+                self.ca.close()
 
         ##### ALL DONE: print final evaluation
+        result = self.evaluate()
+        if self.c.trace_file:
+            self.tracer.write_chrome_trace(self.c.trace_file)
+            self.tracer.print_summary()
+        return result
+
+    # print final evaluation & return evaluation results
+    def evaluate(self):
         print(f'total revocations: {self.total_revokes} ({self.total_revokes / self.c.start_no_nodes * 100:1.2f}%)')
         print(f'total nodes needed repairs: {self.successful_repairs + self.failed_repairs}')
         print(f'successful repairs: {self.successful_repairs}, '
@@ -210,10 +175,27 @@ class BigNetSim:
               f'({msgs_repair / msgs_all * 100:1.2f}%)')
         print(f'Nodes having prime root parity fails: {self.parity_fails} '
               f'({self.parity_fails / (self.parity_fails + self.prime_successes) * 100:1.6f}%)')
+        if self.c.prime_layout == 'merkle' and self.prime_successes:
+            print(f'Avg. digests exchanged per prime update: {self.merkle_digests / self.prime_successes:1.2f}')
         print(f'Avg. prune update size: {self.aggr_prune_size / self.prune_count / 1024:1.2f} KB')
         print(f'Total encounters: {self.total_encounters}')
         print(f'Number of encounters where both nodes are outdated: {self.encounters_both_no_poi} ('
               f'{self.encounters_both_no_poi / self.total_encounters * 100:1.6f}%)')
+        if self.c.poi_cache_size:
+            requests = self.ca.poi_cache_hits + self.ca.poi_cache_misses
+            print(f'CA PoI cache hits: {self.ca.poi_cache_hits} '
+                  f'({self.ca.poi_cache_hits / max(1, requests) * 100:1.2f}% of {requests} requests)')
+        if self.c.lvlc_repair_memo:
+            hits = sum(n.lvlc_memo_hits for n in self.all_nodes if isinstance(n, Cacher))
+            requests = hits + sum(n.lvlc_memo_misses for n in self.all_nodes if isinstance(n, Cacher))
+            print(f'Cacher lvlc repair memo hits: {hits} ({hits / max(1, requests) * 100:1.2f}% of {requests} requests)')
+        if self.c.journal_size:
+            print(f'CA resets served as deltas: {self.delta_resets}')
+        if self.sub_cache_depths:
+            print(f'Hybrid cache: sub-tree caches of depths {self.sub_cache_depths}, lvlc repairs needing them: '
+                  f'{self.sub_cache_repairs} ({self.sub_cache_repairs / max(1, self.lvlc_repairs) * 100:1.2f}%)')
+        if self.hash_acc is not None:
+            self.print_hash_accounting()
 
         ##### return evaluation results
         result = [self.total_revokes,  # total_revocations
@@ -231,7 +213,160 @@ class BigNetSim:
                   ]
         return result
 
-    def send_update(self, update, to_update_nodes):
+    # random sample of k nodes, with a crn_seed it only depends on seed & key, not on the state of this sim
+    # -> common random numbers: variants with the same seed draw the same nodes
+    def sample_nodes(self, k, *key):
+        if self.c.crn_seed is None:
+            return random.sample(self.all_nodes, k)
+        rnd = random.Random('/'.join(str(x) for x in (self.c.crn_seed,) + key))
+        return rnd.sample(self.all_nodes, k)
+
+    # each epoch action on the nodes, after the ca changed its trees
+    def epoch_step(self):
+        if self.hash_acc is not None:
+            self.hash_acc.close_epoch()
+        # update all nodes
+        self.epoch_update_nodes()
+        # insert new certs
+        self.issue_new_certs()
+
+    # nodes to revoke in this sub_epoch
+    def sample_revoke_nodes(self, time_step):
+        revoke_nodes: List[Node] = self.sample_nodes(self.c.revoked_per_sub_epoch, 'revoke', time_step)
+        # skip just re-issued nodes
+        return [x for x in revoke_nodes if x not in self.revoked_nodes]
+
+    # each sub_epoch action on the nodes, after the ca re-issued self.revoked_nodes & revoked revoke_nodes
+    def revocation_step(self, update, revoke_nodes, time_step):
+        self.total_revokes += len(revoke_nodes)
+        # list for directly updating changed nodes
+        to_update_nodes = self.revoked_nodes.copy()
+        to_update_nodes.extend(revoke_nodes)
+        self.revoked_nodes = revoke_nodes.copy()  # replace re-issued nodes by freshly revoked nodes
+        # send update to all nodes
+        self.send_update(update, to_update_nodes, time_step)
+        logging.info(f'sent update containing {len(update)} update-pois')
+
+    # take over changes the ca made to nodes (re-issue & revocation) from the variant whose nodes the ca changed
+    def mirror_nodes(self, nodes, other):
+        for n in nodes:
+            o = other.all_nodes[n.node_id]  # node ids are the indexes in all_nodes
+            n.smt_part = o.smt_part
+            n.revoked = o.revoked
+
+    # each time_step action: nodes encounter other nodes
+    def encounter_step(self, time_step):
+        self.total_encounters += self.c.encounters_per_node * len(self.all_nodes)
+        for n in self.all_nodes:
+            # skip if no updates needed
+            if not n.outdated_prime and not n.outdated_poi:
+                if not isinstance(n, Cacher) or not n.outdated_lvlc:
+                    continue
+
+            # random encounters
+            encounters: List[Node] = self.sample_nodes(self.c.encounters_per_node, 'encounter', time_step, n.node_id)
+            for e in encounters:
+                if e == n:  # happens sometimes...
+                    continue
+                # MSGs basic prime encounter exchange, always happens
+                self.msg_sizes_all += self.size_prime_root()
+                # check if both are outdated -> no secure channel possible
+                if e.outdated_poi and not e.outdated_prime and n.outdated_poi and not n.outdated_prime:
+                    self.encounters_both_no_poi += 1
+                # node cannot help me if he's not fresh at all
+                if e.outdated_prime:
+                    continue
+
+                # update prime root
+                if n.outdated_prime:
+                    with self.acc_scope(n, 'prime_check'):
+                        self.update_prime(n, e)
+
+                if isinstance(n, Cacher) and n.outdated_lvlc:
+                    n.update_try_lvlc += 1
+                    # update level-cache directly
+                    if isinstance(e, Cacher) and not e.outdated_lvlc:
+                        with self.acc_scope(n, 'lvlc_update'):
+                            self.update_lvl_cache(n, e)
+                    # update level-cache via poi
+                    elif self.c.lvlc_poi_merge and not e.outdated_poi and \
+                            n.lvl_cache_root(e.smt_part) != n.smt_roots[e.smt_part]:
+                        with self.acc_scope(n, 'lvlc_poi_merge'):
+                            self.update_lvl_cache_with_poi(n, e)
+
+                if self.c.sanity_checks:
+                    outdated_poi = self.ca.get_node_poi(n.node_id, n.smt_part) != (n.poi, n.poi_bm)
+                    if outdated_poi and not n.outdated_poi and not n.revoked:
+                        logging.error(f'Node thinks its poi is good, but is not! node: {n}')
+                        logging.error(f'prime is {n.prime_root == self.ca.prime_root}')
+                        logging.error(f'real root is {self.ca.get_smt_roots()[n.smt_part]}, '
+                                      f'node root is {n.smt_roots[n.smt_part]}')
+                        logging.error(f'real poi: {self.ca.get_node_poi(n.node_id, n.smt_part)}')
+                        logging.error(f'node poi: {n.poi}, bm: {n.poi_bm}')
+                        logging.error(f'prev poi: {n.previous_poi}, bm: {n.previous_poi_bm}')
+                        logging.error(f'prup poi: {n.previous_update_poi}, '
+                                      f'bm: {n.previous_update_poi_bm}, cert: {n.previous_update_hash}, '
+                                      f'revoked: {n.previous_update_revoked}')
+
+                # distributed repair of poi
+                if n.outdated_poi:
+                    if not n.revoked:
+                        n.update_try += 1
+                else:
+                    continue
+
+                # update poi via lvl-cache
+                if isinstance(e, Cacher) and not n.lvl_cache_tried and not e.outdated_lvlc:
+                    with self.acc_scope(n, 'lvlc_repair'):
+                        self.repair_via_lvlc(n, e)
+
+                # update poi via other poi, if in same part
+                if n.outdated_poi and not e.outdated_poi and e.smt_part == n.smt_part and \
+                        (not n.revoked or not e.revoked):
+                    with self.acc_scope(n, 'poi_repair'):
+                        self.repair_via_poi(n, e)
+
+            # if try threshold is reached, give up, force repair via CA & reset node
+            if n.outdated_poi and n.update_try > self.c.max_repair_tries:
+                logging.info('node reached max tries for repair...')
+                self.reset_outdated(n)
+                # if isinstance(n, BnsCacher) and n.outdated_lvlc:
+                #     self.reset_outdated_cacher(n)
+                self.failed_repairs += 1
+            # Separate failsafe for cache leads to CA sending out tons of data, with virutally no improvement
+            if isinstance(n, Cacher) and n.outdated_lvlc and n.update_try_lvlc > self.c.max_repair_tries:
+                self.reset_outdated_cacher(n)
+
+    # trace sim phases, CA mutations & SMT entry points, does nothing if tracing is disabled
+    def instrument(self):
+        self.tracer.instrument(BigNetSim, ['send_update', 'epoch_update_nodes', 'issue_new_certs', 'encounter_step',
+                                           'update_prime', 'update_lvl_cache', 'repair_via_lvlc', 'repair_via_poi',
+                                           'reset_outdated', 'reset_outdated_cacher'], 'sim')
+        self.tracer.instrument(Node, ['process_update'], 'node')
+        self.tracer.instrument(Cacher, ['process_update'], 'node')
+        self.tracer.instrument(CA, ['revoke_nodes', 'reissue_nodes', 'apply_batch', 'construct_update',
+                                    'calc_prime_root', 'epoch_tree_change', 'get_node_poi', 'get_node_pois', 'get_lvl_caches',
+                                    'prepare_next_epoch', 'build_next_epoch', 'merge_next_epoch'], 'ca')
+        self.tracer.instrument(SMT, ['add_node', 'path', 'all_paths', 'construct_lvl_cache'], 'smt')
+        self.tracer.instrument(smt_util.SMTutil, ['calc_path_root', 'update_poi_with_poi', 'update_lvl_cache_with_poi',
+                                                  'update_poi_with_lvl_cache'], 'smt')
+
+    # attribute hash calls of node to op, no-op if hash accounting is disabled
+    def acc_scope(self, node, op):
+        if self.hash_acc is None:
+            return NO_ACC_SCOPE
+        return self.hash_acc.scope(node.node_id, op)
+
+    def print_hash_accounting(self):
+        nodes = len(self.all_nodes)
+        print('Hash calls per node (avg. calls / bytes):')
+        for op, v in sorted(self.hash_acc.per_op().items(), key=lambda x: str(x[0])):
+            print(f'  {op or "other"}: {v[0] / nodes:1.2f} / {v[1] / nodes / 1024:1.2f} KB')
+        print('Hash calls per node & epoch (bucket <= 2**b calls: no. of nodes):')
+        for i, histogram in enumerate(self.hash_acc.epoch_histograms()):
+            print(f'  epoch {i}: {histogram}')
+
+    def send_update(self, update, to_update_nodes, time_step):
         # update = [(part, hash, poi, bm, revoked)]
 
         # check affected smt parts
@@ -247,7 +382,7 @@ class BigNetSim:
             update_per_part[u[0]].append(u)
 
         # select nodes that miss update
-        non_updated_nodes = random.sample(self.all_nodes, self.c.no_missing_nodes)
+        non_updated_nodes = self.sample_nodes(self.c.no_missing_nodes, 'missing', time_step)
         # avoid nodes that are directly affected by an update
         non_updated_nodes: List[Node] = [x for x in non_updated_nodes if x not in to_update_nodes]
         update_count = len(self.all_nodes) - len(non_updated_nodes)
@@ -268,11 +403,12 @@ class BigNetSim:
             if self.c.sanity_checks:
                 tmp_poi = copy.deepcopy(n.poi)
                 tmp_poi_bm = n.poi_bm
-            if isinstance(n, Cacher):
-                cacher_count += 1
-                update_fail = n.process_update(update)
-            else:
-                update_fail = n.process_update(update_per_part[n.smt_part])
+            with self.acc_scope(n, 'poi_update'):
+                if isinstance(n, Cacher):
+                    cacher_count += 1
+                    update_fail = n.process_update(update)
+                else:
+                    update_fail = n.process_update(update_per_part[n.smt_part])
             # sanity-check
             if self.c.sanity_checks and update_fail:
                 poi, poi_bm = self.ca.get_node_poi(n.node_id, n.smt_part)
@@ -289,20 +425,24 @@ class BigNetSim:
                               f'calc_root: {self.smtu.calc_path_root(n.previous_update_hash, n.previous_update_poi, n.previous_update_poi_bm, 0, n.previous_update_revoked)}\n'
                               f'-> update: {update_per_part[n.smt_part]}')
         # MSGs CA update
+        if self.codec is not None:
+            update_size = self.codec.update_size(update, affected_smts) + self.c.sig_size
+        else:
+            # (len(unique_hashes) / len(affected_smts) * self.c.hash_bytes))
+            update_size = self.c.msg_size_prime_root + self.c.sig_size + (len(affected_smts) * self.c.hash_bytes) + \
+                          (len(unique_hashes) * self.c.hash_bytes)
         self.update_count += update_count - cacher_count
-        self.aggr_update_size += (update_count - cacher_count) * \
-                                 (self.c.msg_size_prime_root + self.c.sig_size +
-                                  (len(affected_smts) * self.c.hash_bytes) +
-                                  # (len(unique_hashes) / len(affected_smts) * self.c.hash_bytes))
-                                  (len(unique_hashes) * self.c.hash_bytes))
+        self.aggr_update_size += (update_count - cacher_count) * update_size
         # cacher updates
         self.update_count += cacher_count
-        self.aggr_update_size += cacher_count * (self.c.msg_size_prime_root + self.c.sig_size +
-                                                 (len(affected_smts) * self.c.hash_bytes) +
-                                                 (len(unique_hashes) * self.c.hash_bytes))
+        self.aggr_update_size += cacher_count * update_size
 
     def epoch_update_nodes(self):
         oldest_nodes = []
+        # new state of the ca is the same for all nodes
+        prime_root = self.ca.get_prime()
+        smt_roots = self.ca.get_smt_roots()
+        lvl_caches = self.ca.get_lvl_caches(self.c.cache_level) if self.c.no_cacher else None
         for n in self.all_nodes:
             old_smt_part = n.smt_part
             # identify affected nodes & change smt-part
@@ -316,33 +456,49 @@ class BigNetSim:
             if n.smt_roots[old_smt_part] != self.ca.get_a_smt_root(n.smt_part):
                 n.outdated_poi = True
 
-            n.prime_root = copy.deepcopy(self.ca.get_prime())
-            n.smt_roots = self.ca.get_smt_roots().copy()
+            n.prime_root = copy.deepcopy(prime_root)
+            n.smt_roots = smt_roots.copy()
             n.outdated_prime = False
             if isinstance(n, Cacher):
-                n.lvl_caches = copy.deepcopy(self.ca.get_lvl_caches(self.c.cache_level))
+                n.lvl_caches = copy.deepcopy(lvl_caches)
+                n.lvl_cache_changed()
+                n.sub_caches = self.get_sub_caches(n.node_id, range(self.c.no_smt_parts))
                 n.outdated_lvlc = False
                 n.outdated_roots = []
 
 
         # MSGs prune-update -> sends all hashes of new smt
-        self.msg_sizes_ca_out += len(oldest_nodes) * self.c.hash_bytes + self.c.msg_size_prime_root + self.c.sig_size
+        self.msg_sizes_ca_out += len(oldest_nodes) * self.c.hash_bytes + self.size_prime_root() + self.c.sig_size
         self.prune_count += 1
         self.aggr_prune_size += len(oldest_nodes) * self.c.hash_bytes
 
+    # node ids of the next epoch's new issues (SimConfig.insert_new_issues)
+    def next_new_issues(self):
+        ids = [NEW_ISSUE_ID + self.new_issues + i for i in range(self.c.new_issues_per_epoch)]
+        self.new_issues += self.c.new_issues_per_epoch
+        return ids
+
     def issue_new_certs(self):
-        # we only need to measure here, no need to impl
+        # we only need to measure here, the certs are inserted by the CA if insert_new_issues is set
         self.msg_sizes_ca_out += self.c.new_issues_per_epoch * self.c.hash_bytes
         self.aggr_prune_size += self.c.new_issues_per_epoch * self.c.hash_bytes
 
     def update_prime(self, outdated, helper):
-        wrong_aggr_par_parts, wrong_main_par_parts = outdated.set_prime_id_wrong_parts(helper.prime_root)
-        selected_smt_roots = helper.get_ided_smt_roots(wrong_aggr_par_parts, wrong_main_par_parts)
+        if self.c.prime_layout == 'merkle':
+            wrong_parts, sent_digests = outdated.set_prime_merkle_wrong_parts(helper.prime_root, helper.smt_roots)
+            selected_smt_roots = helper.get_merkle_smt_roots(wrong_parts)
+            self.merkle_digests += sent_digests
+            # MSGs only the differing subtree digests, the last level are the roots
+            roots_size = sent_digests * (self.codec.digest_bytes if self.codec is not None else self.c.hash_bytes)
+        else:
+            wrong_aggr_par_parts, wrong_main_par_parts = outdated.set_prime_id_wrong_parts(helper.prime_root)
+            selected_smt_roots = helper.get_ided_smt_roots(wrong_aggr_par_parts, wrong_main_par_parts)
+            # MSGs only exchanged roots
+            roots_size = self.size_roots(selected_smt_roots)
         if outdated.set_ided_smt_roots(selected_smt_roots):
             self.prime_successes += 1
-            # MSGs only exchanged roots
-            self.msg_sizes_all += len(selected_smt_roots) * self.c.hash_bytes + self.c.sig_size
-            self.msg_sizes_update += len(selected_smt_roots) * self.c.hash_bytes + self.c.sig_size
+            self.msg_sizes_all += roots_size + self.c.sig_size
+            self.msg_sizes_update += roots_size + self.c.sig_size
         else:
             # parity got unlucky, request all
             logging.info(f'prime root parity got unlucky, exchanged all roots')
@@ -358,13 +514,15 @@ class BigNetSim:
                         outdated.outdated_roots.append(i)
                 if len(outdated.outdated_roots) > 1:
                     outdated.outdated_lvlc = True
+                outdated.drop_sub_caches(outdated.outdated_roots)
             # force update prime
             outdated.prime_root = copy.deepcopy(self.ca.get_prime())
             outdated.smt_roots = self.ca.get_smt_roots().copy()
             outdated.outdated_prime = False
             # MSGs prime exchange
-            self.msg_sizes_all += self.c.no_smt_parts * self.c.hash_bytes + self.c.sig_size
-            self.msg_sizes_update += self.c.no_smt_parts * self.c.hash_bytes + self.c.sig_size
+            all_roots = list(enumerate(outdated.smt_roots))
+            self.msg_sizes_all += self.size_roots(all_roots) + self.c.sig_size
+            self.msg_sizes_update += self.size_roots(all_roots) + self.c.sig_size
 
     def update_lvl_cache(self, outdated, helper):
         outdated_lvl_caches = helper.get_some_lvl_caches(outdated.outdated_roots)
@@ -373,34 +531,46 @@ class BigNetSim:
         outdated.update_try_lvlc = 0
         outdated.outdated_roots = []
         # MSGs exchange cache
-        self.msg_sizes_all += self.c.msg_size_lvlc * len(outdated_lvl_caches)
-        self.msg_sizes_repair += self.c.msg_size_lvlc * len(outdated_lvl_caches)
+        self.msg_sizes_all += self.size_lvl_caches(outdated_lvl_caches)
+        self.msg_sizes_repair += self.size_lvl_caches(outdated_lvl_caches)
 
     def update_lvl_cache_with_poi(self, outdated, helper):
-        # update correct cache
-        self.smtu.update_lvl_cache_with_poi(helper.cert, helper.poi, helper.poi_bm,
-                                            outdated.lvl_caches[helper.smt_part], outdated.cache_level, helper.revoked)
-        # check if cache is now good
-        any_outdated = False
-        for i in range(self.c.no_smt_parts):
-            if outdated.smt_roots[i] != self.smtu.lvl_cache_helper(0, 0, outdated.lvl_caches[i], outdated.cache_level):
-                any_outdated = True
-        outdated.outdated_lvlc = any_outdated
+        # update correct cache, then check if all caches are good (only roots of changed caches are hashed again)
+        if outdated.merge_poi(helper.smt_part, helper.cert, helper.poi, helper.poi_bm, helper.revoked) and \
+                helper.smt_part in outdated.outdated_roots:
+            # healed, no longer to be requested from other cachers or the CA
+            outdated.outdated_roots.remove(helper.smt_part)
+        outdated.outdated_lvlc = outdated.lvl_caches_outdated()
+        if not outdated.outdated_lvlc:
+            outdated.update_try_lvlc = 0
+            outdated.outdated_roots = []
         # MSGs
-        self.msg_sizes_all += self.c.msg_size_poi
-        self.msg_sizes_repair += self.c.msg_size_poi
+        self.msg_sizes_all += self.size_poi(helper.poi)
+        self.msg_sizes_repair += self.size_poi(helper.poi)
 
     def repair_via_lvlc(self, outdated, helper):
         # MSGs exchange only poi -> repair on cacher
-        self.msg_sizes_all += self.c.msg_size_poi * 2
-        self.msg_sizes_repair += self.c.msg_size_poi * 2
+        self.msg_sizes_all += self.size_poi(outdated.poi) * 2
+        self.msg_sizes_repair += self.size_poi(outdated.poi) * 2
         if self.c.sanity_checks:
             tmp_poi = copy.deepcopy(outdated.poi)
             tmp_poi_bm = outdated.poi_bm
-        if outdated.try_lvlc_repair(helper.lvl_caches[outdated.smt_part], helper.cache_level):
+        if self.c.lvlc_repair_memo:
+            # computed by the cacher, the requester only gets the segment
+            segment = helper.get_lvlc_segment(outdated.smt_part,
+                                              self.smtu.lvl_cache_prefix(outdated.cert, helper.cache_level))
+            repaired = outdated.try_segment_repair(segment)
+        else:
+            repaired = outdated.try_lvlc_repair(helper.lvl_caches[outdated.smt_part], helper.cache_level)
+        sub_cache_repaired = False
+        if not repaired and helper.sub_caches[outdated.smt_part]:
+            # hybrid cache: the levels below the lvl-cache from the sub-tree caches, applied by the cacher as well
+            repaired = sub_cache_repaired = outdated.try_sub_cache_repair(helper.sub_caches[outdated.smt_part])
+        if repaired:
             logging.info('successfully repaired node via LVLC')
             self.successful_repairs += 1
             self.lvlc_repairs += 1
+            self.sub_cache_repairs += sub_cache_repaired
             self.repair_try_aggr += outdated.update_try
             outdated.update_try = 0
             outdated.outdated_poi = False
@@ -416,8 +586,8 @@ class BigNetSim:
 
     def repair_via_poi(self, outdated, helper):
         # MSGs exchange poi
-        self.msg_sizes_all += self.c.msg_size_poi
-        self.msg_sizes_repair += self.c.msg_size_poi
+        self.msg_sizes_all += self.size_poi(helper.poi)
+        self.msg_sizes_repair += self.size_poi(helper.poi)
         if self.c.sanity_checks:
             tmp_poi = copy.deepcopy(outdated.poi)
             tmp_poi_bm = outdated.poi_bm
@@ -444,10 +614,26 @@ class BigNetSim:
             logging.info('failed to repair node via PoI')
 
     def reset_outdated(self, node):
-        # MSGs request poi from ca
-        self.msg_sizes_ca_out += self.c.msg_size_poi
         # force repair & reset
-        poi, poi_bm = self.ca.get_node_poi(node.node_id, node.smt_part)
+        delta = None
+        if self.c.journal_size:
+            # only request the siblings that changed since the version of the node's PoI root
+            poi_root = self.smtu.calc_path_root(node.cert, node.poi, node.poi_bm, 0, node.revoked)
+            version = self.ca.version_of_root(node.smt_part, poi_root)
+            if version is not None:
+                delta = self.ca.get_poi_delta(node.node_id, node.smt_part, version)
+        if delta is not None:
+            poi = node.poi.copy()
+            poi_bm = self.smtu.update_poi_with_delta(poi, node.poi_bm, delta)
+            # MSGs request delta from ca
+            self.msg_sizes_ca_out += self.size_poi_delta(delta)
+            self.delta_resets += 1
+            if self.c.sanity_checks and self.ca.get_node_poi(node.node_id, node.smt_part) != (poi, poi_bm):
+                logging.error(f'DELTA RESET FAILED for node {node}, delta: {delta}')
+        else:
+            poi, poi_bm = self.ca.get_node_poi(node.node_id, node.smt_part)
+            # MSGs request poi from ca
+            self.msg_sizes_ca_out += self.size_poi(poi)
         node.poi = poi
         node.poi_bm = poi_bm
         node.smt_roots = self.ca.get_smt_roots()
@@ -458,11 +644,156 @@ class BigNetSim:
         node.lvl_cache_tried = False
 
     def reset_outdated_cacher(self, node):
-        outdated_lvl_caches = self.ca.get_some_lvl_caches(node.outdated_roots)
+        outdated_roots = node.outdated_roots
+        if self.c.journal_size:
+            # only request the entries that changed since the version of each cache's root
+            outdated_roots = []
+            for r in node.outdated_roots:
+                lvl_cache = node.lvl_caches[r]
+                version = self.ca.version_of_root(r, self.smtu.lvl_cache_helper(0, 0, lvl_cache, node.cache_level))
+                delta = None if version is None else self.ca.get_lvl_cache_delta(r, version, node.cache_level)
+                if delta is None:
+                    outdated_roots.append(r)
+                    continue
+                for i, h in delta.items():
+                    lvl_cache[i] = h
+                node.lvl_cache_changed(r)
+                self.msg_sizes_ca_out += self.size_lvl_cache_delta(delta)
+                self.msg_sizes_ca_out_lvlc += self.size_lvl_cache_delta(delta)
+                self.delta_resets += 1
+        outdated_lvl_caches = self.ca.get_some_lvl_caches(outdated_roots, node.cache_level)
         node.update_some_lvl_caches(copy.deepcopy(outdated_lvl_caches))
+        if self.sub_cache_depths:
+            sub_caches = self.get_sub_caches(node.node_id, node.outdated_roots)
+            for r in node.outdated_roots:
+                node.sub_caches[r] = sub_caches[r]
+            self.msg_sizes_ca_out += self.size_sub_caches(sub_caches)
+            self.msg_sizes_ca_out_lvlc += self.size_sub_caches(sub_caches)
         node.outdated_lvlc = False
         node.update_try_lvlc = 0
         node.outdated_roots = []
         # MSGs exchange cache
-        self.msg_sizes_ca_out += self.c.msg_size_lvlc * len(outdated_lvl_caches)
-        self.msg_sizes_ca_out_lvlc += self.c.msg_size_lvlc * len(outdated_lvl_caches)
+        self.msg_sizes_ca_out += self.size_lvl_caches(outdated_lvl_caches)
+        self.msg_sizes_ca_out_lvlc += self.size_lvl_caches(outdated_lvl_caches)
+
+    # sub-tree caches of the hybrid cache of a cacher per part, [] for parts not in parts
+    def get_sub_caches(self, node_id, parts):
+        sub_caches = [[] for _ in range(self.c.no_smt_parts)]
+        if self.sub_cache_depths:
+            for p in parts:
+                sub_caches[p] = self.ca.get_sub_caches(node_id, p, self.c.cache_level, self.sub_cache_depths)
+        return sub_caches
+
+    # MSG sizes: encoded sizes if wire_sizes is set (see wire.WireCodec), otherwise the estimates of SimConfig
+    def size_prime_root(self):
+        return self.codec.prime_root_size if self.codec is not None else self.c.msg_size_prime_root
+
+    def size_poi(self, poi):
+        return self.codec.poi_size(poi) if self.codec is not None else self.c.msg_size_poi
+
+    # some_lvl_caches = [(smt_part, lvl_cache)]
+    def size_lvl_caches(self, some_lvl_caches):
+        if self.codec is not None:
+            return sum(self.codec.lvl_cache_size(lvl_cache) for _, lvl_cache in some_lvl_caches)
+        return self.c.msg_size_lvlc * len(some_lvl_caches)
+
+    # sub_caches = sub-tree caches per part, the position of each entry follows from its index as in a lvl-cache
+    def size_sub_caches(self, sub_caches):
+        return sum(2 ** (entry_depth - root_depth) for caches in sub_caches
+                   for _, root_depth, entry_depth, _ in caches) * self.c.hash_bytes
+
+    # roots = [(part, root)]
+    def size_roots(self, roots):
+        if self.codec is not None:
+            return self.codec.roots_size(roots)
+        return len(roots) * self.c.hash_bytes
+
+    # delta = {bit: hash}, changed & non-empty bitmaps as in msg_size_poi
+    def size_poi_delta(self, delta):
+        if self.codec is not None:
+            return self.codec.poi_delta_size(delta)
+        return sum(1 for h in delta.values() if h != '') * self.c.hash_bytes + 2
+
+    # delta = {index: hash}
+    def size_lvl_cache_delta(self, delta):
+        if self.codec is not None:
+            return self.codec.lvl_cache_delta_size(delta)
+        return len(delta) * (self.c.hash_bytes + 2)
+
+
+# runs several protocol variants (e.g. cache_level, max_repair_tries, no_cacher_share) on one simulated trajectory:
+# one CA, same revocations, missed updates & encounter partners (common random numbers), but each variant keeps
+# its own nodes & repair state -> differences between variants are not drowned in noise of separate runs
+class MultiVariantSim:
+    # config fields defining the trajectory, have to be the same for all variants
+    TRAJECTORY_FIELDS = ['hash_function', 'hash_depth', 'no_smt_parts', 'parity_length_bytes', 'main_parities',
+                         'aggregated_parities', 'smt_setup_file', 'setup_cache_dir', 'passive_nodes',
+                         'start_no_nodes', 'no_missing_nodes', 'encounters_per_node', 'time_steps_per_sub_epoch',
+                         'subs_per_epoch', 'epochs', 'revoked_per_sub_epoch', 'insert_new_issues']
+
+    def __init__(self, configs: List[SimConfig]):
+        for c in configs[1:]:
+            for f in self.TRAJECTORY_FIELDS:
+                if getattr(c, f) != getattr(configs[0], f):
+                    raise ValueError(f'variants have to share the trajectory, but {f} differs: '
+                                     f'{getattr(configs[0], f)} != {getattr(c, f)}')
+        # all variants draw from the same seed
+        seed = configs[0].crn_seed if configs[0].crn_seed is not None else random.randrange(2 ** 32)
+        self.configs = []
+        for c in configs:
+            c = copy.copy(c)
+            c.crn_seed = seed
+            self.configs.append(c)
+        self.c = self.configs[0]
+
+        logging.info('setting up CA...')
+        check_wal_dir(self.c)
+        self.ca = CA(self.c)
+        self.ca.initialize()
+        self.sims = [BigNetSim(c, self.ca) for c in self.configs]
+
+    def sim(self):
+        # ca changes are done once, with the nodes of the first variant
+        main = self.sims[0]
+        main.instrument()
+        try:
+            sub_epoch = 1
+            for current_time_step in tqdm(range(self.c.total_time_steps)):
+                ##### each epoch action
+                if sub_epoch % self.c.subs_per_epoch == 0:
+                    sub_epoch += 1
+                    self.ca.epoch_tree_change()
+                    for s in self.sims:
+                        s.epoch_step()
+
+                ##### each sub_epoch action
+                if current_time_step % self.c.time_steps_per_sub_epoch == 0:
+                    sub_epoch += 1
+                    revoke_nodes = main.sample_revoke_nodes(current_time_step)
+                    update, _ = self.ca.apply_batch([(n, False) for n in main.revoked_nodes] +
+                                                    [(n, True) for n in revoke_nodes])
+                    for s in self.sims[1:]:
+                        s_revoke_nodes = s.sample_revoke_nodes(current_time_step)
+                        s.mirror_nodes(s.revoked_nodes + s_revoke_nodes, main)
+                        s.revocation_step(update, s_revoke_nodes, current_time_step)
+                    main.revocation_step(update, revoke_nodes, current_time_step)
+                    if self.c.insert_new_issues and sub_epoch % self.c.subs_per_epoch == 0:
+                        self.ca.prepare_next_epoch(main.next_new_issues())
+
+                ##### each time_step action: nodes encounter other nodes
+                for s in self.sims:
+                    s.encounter_step(current_time_step)
+        finally:
+            main.tracer.uninstrument()
+            self.ca.close()
+
+        ##### ALL DONE: print final evaluation of each variant
+        results = []
+        for i, s in enumerate(self.sims):
+            print(f'##### variant {i}: cache_level {s.c.cache_level}, max_repair_tries {s.c.max_repair_tries}, '
+                  f'no_cacher_share {s.c.no_cacher_share}')
+            results.append(s.evaluate())
+        if self.c.trace_file:
+            main.tracer.write_chrome_trace(self.c.trace_file)
+            main.tracer.print_summary()
+        return results
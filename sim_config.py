@@ -6,6 +6,50 @@ class SimConfig:
     def __init__(self):
         # for debugging, disable for increased performance
         self.sanity_checks = False
+        # count hash calls per node & operation (see hashf.HashAccounting), disable for increased performance
+        self.hash_accounting = False
+        # write a chrome trace of sim phases, CA & SMT operations to this file (see tracer.Tracer), None disables
+        self.trace_file = None
+        # max. no. of PoIs cached by the CA (see CA.get_cached_poi), 0 disables
+        self.poi_cache_size = 10000
+        # common random numbers: revocations, missed updates & encounters only depend on this seed & the time step,
+        # so runs of variants with the same seed see the same trajectory (see sim.MultiVariantSim), None draws freely
+        self.crn_seed = None
+        # admission queue of the CA (see CA.enqueue): apply queued revocations & re-issues as one batch once there are
+        # batch_max_size of them or the oldest one waited batch_max_delay seconds
+        self.batch_max_size = 64
+        self.batch_max_delay = 0.05
+        # account encoded message sizes (see wire.WireCodec) instead of the msg_size_* estimates below
+        self.wire_sizes = False
+        # no. of changed leaves per smt part the CA keeps in its journal, so resets of outdated nodes & cachers only
+        # fetch what changed since the version they hold (see CA.get_poi_delta), 0 disables
+        self.journal_size = 0
+        # write-ahead log of CA mutations in this directory, initialize continues from it (see ca_wal.WAL), None
+        # disables; a new snapshot is written after wal_checkpoint_every log records
+        # sims do not log their nodes & need an empty or new directory
+        self.wal_dir = None
+        self.wal_checkpoint_every = 10000
+        # layout of the prime root: 'parity' (hash of all smt roots + parities identifying changed roots) or 'merkle'
+        # (root of a Merkle tree over the smt roots, changed roots are found by descending it, see SMTutil.merkle_diff)
+        # merkle sends only the digest in every encounter (parity: + 2 bytes per parity), but each prime update costs
+        # more (~1.2x parity's with 1 changed part, ~2x with all changed, see prime_bench.py), so it only pays off if
+        # encounters far outnumber prime updates
+        self.prime_layout = 'parity'
+        # nodes & the CA's trees share one object per distinct digest they keep (see smt_util.DigestPool)
+        self.intern_digests = False
+        # cachers serve lvl-cache repairs from a memo of PoI segments per part, prefix & lvl-cache version, instead of
+        # every requester rebuilding them from the lvl-cache (see Cacher.get_lvlc_segment)
+        self.lvlc_repair_memo = False
+        # outdated cachers also heal their lvl-caches from PoIs of fresh nodes they meet, merging a PoI only rehashes
+        # the lvl-cache entry above its leaf & the entry's ancestors (see Cacher.merge_poi), False: lvl-caches are only
+        # repaired from other cachers & the CA
+        self.lvlc_poi_merge = True
+        # hybrid cache of cachers: besides the lvl-cache, sub-tree caches of sub_cache_depth levels in each part, as
+        # many as fit into hybrid_cache_budget bytes per part incl. the lvl-cache (0 disables); with sub_cache_incr
+        # each further sub-tree cache reaches one level deeper (see CA.get_sub_caches)
+        self.hybrid_cache_budget = 0
+        self.sub_cache_depth = 3
+        self.sub_cache_incr = False
 
         # smt vars
         self.hash_function = hashf.miniminhash
@@ -15,15 +59,21 @@ class SimConfig:
         self.main_parities = 2
         self.aggregated_parities = 10  # how many smt-roots will be aggregated for each parity
         self.no_aggr_parities = int((self.no_smt_parts - self.main_parities) / self.aggregated_parities)
-        self.no_parities = self.no_aggr_parities + self.main_parities
+        self.no_parities = self.no_aggr_parities + self.main_parities if self.prime_layout == 'parity' else 0
         self.prime_counter_size = 4  # 32 bit (UNIX timestamp)
 
         # simulation vars
         self.smt_setup_file = '100kMini.bns'  # stuff thats in the SMT but not actively used
+        # cache dir of passive forests keyed by the params they are built with (see setup_cache), replaces
+        # smt_setup_file if set
+        self.setup_cache_dir = None
         self.passive_nodes = 100000
         self.start_no_nodes = 1000
         self.new_issues_per_epoch_share = 0.01
         self.new_issues_per_epoch = math.ceil(self.start_no_nodes * self.new_issues_per_epoch_share)
+        # new issues are only counted in msg sizes, True also inserts their certs into the newest tree of each
+        # epoch, pre-built in the background during the epoch's last sub-epoch (see CA.prepare_next_epoch)
+        self.insert_new_issues = False
         self.no_cacher_share = 0.1
         self.no_cacher = math.ceil(self.start_no_nodes * self.no_cacher_share)
         self.cache_level = 7  # 7 -> 100k; 10 -> 1M
@@ -53,7 +103,7 @@ class SimConfig:
 
     def recalc_fields(self):
         self.no_aggr_parities = int((self.no_smt_parts - self.main_parities) / self.aggregated_parities)
-        self.no_parities = self.no_aggr_parities + self.main_parities
+        self.no_parities = self.no_aggr_parities + self.main_parities if self.prime_layout == 'parity' else 0
         self.new_issues_per_epoch = math.ceil(self.start_no_nodes * self.new_issues_per_epoch_share)
         self.no_cacher = math.ceil(self.start_no_nodes * self.no_cacher_share)
         self.no_missing_nodes = math.ceil(self.start_no_nodes * self.no_missing_nodes_share)
@@ -66,6 +116,23 @@ class SimConfig:
         self.msg_size_lvlc = 2 ** self.cache_level * self.hash_bytes
         self.msg_size_complete_lvlc = self.no_smt_parts * self.msg_size_lvlc
 
+    # depths of the sub-tree caches of the hybrid cache, [] if disabled
+    def sub_cache_depths(self):
+        if not self.hybrid_cache_budget:
+            return []
+        entries = self.hybrid_cache_budget // self.hash_bytes - 2 ** self.cache_level
+        if entries < 0:
+            raise ValueError(f'hybrid_cache_budget of {self.hybrid_cache_budget} bytes does not fit the lvl-cache '
+                             f'({2 ** self.cache_level * self.hash_bytes} bytes)')
+        depths = []
+        depth = self.sub_cache_depth
+        while entries >= 2 ** depth and depth <= self.hash_depth:
+            depths.append(depth)
+            entries -= 2 ** depth
+            if self.sub_cache_incr:
+                depth += 1
+        return depths
+
     # convert a smt_part to corresponding par_part
     def get_par_part(self, part):
         # main parity
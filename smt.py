@@ -1,7 +1,11 @@
+import bisect
 import hashf
+import smt_util
 
 
 class SMT:
+    intern = False  # keep new digests in the digest pool (SimConfig.intern_digests), class default for old pickles
+
     def __init__(self, hash_function, depth):
         self.hash_function = hash_function
         self.depth = depth
@@ -71,6 +75,8 @@ class SMT:
                 rhash = self.get_hash(neighbor, self.depth - i)
 
             hashadd = hashf.hashadd(self.hash_function, lhash, rhash)  # calculate new sub-root of lvl
+            if self.intern:
+                hashadd = smt_util.digest_pool.keep(hashadd)
             self.set_hash(hash_bm, self.depth - i - 1, hashadd)
         self.roothash = self.get_hash(0, 0)  # set new root
         return self.roothash
@@ -98,6 +104,50 @@ class SMT:
                 path.append(neighbor_hash)  # store hash for PoI
         return path, path_bm
 
+    # PoIs of many leaves at once, same result as path() for each leaf, returns {leaf hash: (path, path_bm)}
+    # walks the tree depth-first once, but only visits nodes where leaves branch off (sorted leaf positions)
+    # -> one LUT look-up per non-empty PoI element instead of depth look-ups per leaf, neighboring leaves
+    # share the sibling stack down to where they split up
+    def all_paths(self, leaf_hashes):
+        result = {}
+        wanted = {}  # pos -> hash of requested leaves in the tree
+        for h in leaf_hashes:
+            pos = hashf.get_int(h)
+            if (pos, self.depth) in self.nodes:
+                wanted[pos] = h
+            else:
+                result[h] = self.path(h)  # not in the tree (e.g. revoked)
+        if not wanted:
+            return result
+        leaves = sorted(pos for pos, depth in self.nodes if depth == self.depth)
+        wanted_leaves = sorted(wanted)
+        stack = []  # non-empty siblings from the root downwards
+
+        # leaves[lo:hi] & wanted_leaves[wlo:whi] are below the current node
+        def walk(lo, hi, wlo, whi, path_bm):
+            if hi - lo == 1:
+                # single leaf below, all remaining siblings are empty
+                result[wanted[leaves[lo]]] = (stack[::-1], path_bm)
+                return
+            # leaves split up below depth split
+            split = self.depth - (leaves[lo] ^ leaves[hi - 1]).bit_length()
+            shift = self.depth - split - 1
+            rpos = ((leaves[lo] >> shift) | 1) << shift
+            lpos = rpos & ~(1 << shift)
+            mid = bisect.bisect_left(leaves, rpos, lo, hi)
+            wmid = bisect.bisect_left(wanted_leaves, rpos, wlo, whi)
+            if wlo < wmid:
+                stack.append(self.nodes[(rpos, split + 1)])
+                walk(lo, mid, wlo, wmid, path_bm | (1 << shift))
+                stack.pop()
+            if wmid < whi:
+                stack.append(self.nodes[(lpos, split + 1)])
+                walk(mid, hi, wmid, whi, path_bm | (1 << shift))
+                stack.pop()
+
+        walk(0, len(leaves), 0, len(wanted_leaves), 0)
+        return result
+
     # construct level-cache with LUT
     def construct_lvl_cache(self, cache_level):
         target_cache_size = 2 ** cache_level
@@ -109,3 +159,15 @@ class SMT:
             # use LUT on pos to just look-up correct hash
             ordered_cache[i] = self.get_hash(pos, cache_level)
         return ordered_cache
+
+    # construct a sub-tree cache: the non-empty hashes cache_depth levels below the node at start_depth above pos
+    # {(pos, depth): hash}, as SMTutil.update_poi_with_sub_cache takes it
+    def construct_sub_cache(self, pos, start_depth, cache_depth):
+        sub_cache = {}
+        sub_pos = pos & ~(2 ** (self.depth - start_depth) - 1)
+        for i in range(2 ** cache_depth):
+            tmp_pos = sub_pos | (i << self.depth - start_depth - cache_depth)
+            add_hash = self.get_hash(tmp_pos, start_depth + cache_depth)
+            if add_hash != '':
+                sub_cache[(tmp_pos, start_depth + cache_depth)] = add_hash
+        return sub_cache
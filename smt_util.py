@@ -1,12 +1,97 @@
 import hashf
 import copy
+import weakref
+
+
+# digest str that can be referenced weakly, only created by DigestPool
+# copies are the digest itself & pickles plain str (trees & caches are deep-copied & pickled)
+class Digest(str):
+    __slots__ = ('__weakref__',)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return str, (str(self),)
+
+
+# one Digest object per distinct digest kept by the trees, caches & nodes of a process (SimConfig.intern_digests)
+# the pool only holds weak references: a digest is dropped with its last holder, unlike interned strings (immortal
+# from CPython 3.12 on), so the pool only grows with the digests in use
+class DigestPool:
+    def __init__(self):
+        self.refs = {}  # weak reference -> itself, weak references hash & compare like their live digests
+
+    def keep(self, digest):
+        if type(digest) is Digest:
+            return digest
+        digest = Digest(digest)
+        kept = self.refs.get(weakref.ref(digest))
+        if kept is not None:
+            return kept()
+        ref = weakref.ref(digest, self.drop)
+        self.refs[ref] = ref
+        return digest
+
+    # a dead reference only equals itself, so exactly its entry is removed
+    def drop(self, ref):
+        self.refs.pop(ref, None)
+
+    def __len__(self):
+        return len(self.refs)
+
+
+digest_pool = DigestPool()
 
 
 # helper class for nodes to handle PoIs & Caches
 class SMTutil:
-    def __init__(self, hash_function, depth):
+    def __init__(self, hash_function, depth, intern=False):
         self.hash_function = hash_function
         self.depth = depth
+        self.intern = intern
+
+    # digest to keep in a PoI, level-cache or tree: with intern (SimConfig.intern_digests) equal digests kept by
+    # different nodes & the CA's trees share one object (see DigestPool)
+    def keep(self, digest):
+        return digest_pool.keep(digest) if self.intern else digest
+
+    # levels of a Merkle tree over the smt roots (merkle prime layout), leaves are padded with '' to a power of 2
+    # levels[0] are the leaves, levels[-1] = [prime hash]
+    def merkle_levels(self, roots):
+        level = list(roots)
+        while len(level) & (len(level) - 1):
+            level.append('')
+        levels = [level]
+        while len(level) > 1:
+            level = [hashf.hashadd(self.hash_function, level[i], level[i + 1]) for i in range(0, len(level), 2)]
+            levels.append(level)
+        return levels
+
+    # find the parts where my_roots differ from other_roots by descending both Merkle trees from the top
+    # for every differing inner node the other side sends both children, so only differing subtrees are exchanged
+    # & no differing part is missed; on the last level the sent children are the smt roots themselves
+    # children only covering padding are known to both sides & not sent
+    # returns ([differing parts], no. of sent digests)
+    def merkle_diff(self, my_roots, other_roots):
+        mine = self.merkle_levels(my_roots)
+        other = self.merkle_levels(other_roots)
+        differing = [0] if mine[-1][0] != other[-1][0] else []
+        sent_digests = 0
+        for lvl in range(len(mine) - 2, -1, -1):
+            children = []
+            for i in differing:
+                for child in (2 * i, 2 * i + 1):
+                    if child << lvl >= len(my_roots):
+                        continue
+                    sent_digests += 1
+                    if mine[lvl][child] != other[lvl][child]:
+                        children.append(child)
+            differing = children
+        return [p for p in differing if p < len(my_roots)], sent_digests
 
     # calc path root for PoI verification
     def calc_path_root(self, my_hash, path, path_bm, lvl=0, revoked=False):
@@ -96,7 +181,7 @@ class SMTutil:
 
         # construct hash via new poi
         if not is_removal:
-            update_hash = self.calc_path_root(new_hash, new_path, new_path_bm, (target_pos + 1), revoked)
+            update_hash = self.keep(self.calc_path_root(new_hash, new_path, new_path_bm, (target_pos + 1), revoked))
         else:
             update_hash = None
 
@@ -128,7 +213,7 @@ class SMTutil:
             part_no = part_no >> 1
 
         # replace
-        lvl_cache[part_no] = new_cache_hash
+        lvl_cache[part_no] = self.keep(new_cache_hash)
 
     # update a PoI with a given level-cache
     # assumes all relevant cache level hashes are filled for all hashes (highly likely)
@@ -148,10 +233,45 @@ class SMTutil:
             # calculate fitting hash from lvl_cache
             calc_hash = self.lvl_cache_helper(part_no_neg, i + 1, lvl_cache, cache_level)
             # replace in my PoI, should be always right (inside cache level)
-            my_path[len(my_path) - 1 - i] = calc_hash
+            my_path[len(my_path) - 1 - i] = self.keep(calc_hash)
             # for next iteration return pervious bit to original part_no
             part_no_neg = part_no_neg ^ (1 << cache_level - 1 - i)
 
+    # first cache_level bits of a hash, the level-cache entry its leaf is below
+    def lvl_cache_prefix(self, my_hash, cache_level):
+        return hashf.get_int(my_hash) >> (self.depth - cache_level)
+
+    # top cache_level hashes of the PoIs of all leaves with this prefix, top down, as update_poi_with_lvl_cache sets them
+    def lvl_cache_segment(self, prefix, lvl_cache, cache_level):
+        part_no_neg = ~prefix
+        segment = []
+        for i in range(cache_level):
+            segment.append(self.keep(self.lvl_cache_helper(part_no_neg, i + 1, lvl_cache, cache_level)))
+            part_no_neg = part_no_neg ^ (1 << cache_level - 1 - i)
+        return segment
+
+    # update a PoI with a segment of lvl_cache_segment
+    def update_poi_with_segment(self, my_path, segment):
+        for i, h in enumerate(segment):
+            my_path[len(my_path) - 1 - i] = h
+
+    # apply a delta from the CA (see CA.get_poi_delta) to my PoI, returns new my_path_bm! (not updateable via params)
+    def update_poi_with_delta(self, my_path, my_path_bm, delta):
+        for bit in sorted(delta):
+            new_hash = delta[bit]
+            # PoI is ordered bottom up, only non-empty siblings
+            i = bin(my_path_bm & ((1 << bit) - 1)).count('1')
+            if (my_path_bm >> bit) & 1:
+                if new_hash == '':
+                    del my_path[i]
+                    my_path_bm &= ~(1 << bit)
+                else:
+                    my_path[i] = new_hash
+            elif new_hash != '':
+                my_path.insert(i, new_hash)
+                my_path_bm |= 1 << bit
+        return my_path_bm
+
     # helper for constructing subroot of a level-cache
     # target is bitmap of targeted hash & on_lvl describes which level is of interest (eg 1 is first branch in SMT)
     def lvl_cache_helper(self, target, on_lvl, lvl_cache, cache_level):
@@ -167,6 +287,24 @@ class SMTutil:
         right = self.lvl_cache_helper(targetright, on_lvl + 1, lvl_cache, cache_level)
         return hashf.hashadd(self.hash_function, left, right)
 
+    # levels of the tree above a lvl-cache: levels[k] holds the 2 ** k hashes on depth k, levels[0][0] is the root
+    # lvl_cache_helper(0, 0, ..) calculates, levels[cache_level] is the lvl-cache itself
+    def lvl_cache_tree(self, lvl_cache, cache_level):
+        levels = [lvl_cache]
+        for _ in range(cache_level):
+            below = levels[0]
+            levels.insert(0, [hashf.hashadd(self.hash_function, below[i], below[i + 1])
+                              for i in range(0, len(below), 2)])
+        return levels
+
+    # set entry index of the lvl-cache of a lvl_cache_tree & rehash only its ancestors, returns the new root
+    def update_lvl_cache_tree(self, levels, index, new_hash):
+        levels[-1][index] = self.keep(new_hash)
+        for k in range(len(levels) - 2, -1, -1):
+            index >>= 1
+            levels[k][index] = hashf.hashadd(self.hash_function, levels[k + 1][2 * index], levels[k + 1][2 * index + 1])
+        return levels[0][0]
+
     # lookup helper for sub-trees
     # get hash at coordinate (BitArray), also for coordinates < self.depth!
     def get_hash_dict(self, pos, depth, posdict, remove=False):
@@ -205,7 +343,7 @@ class SMTutil:
                 continue
 
             # if relevant calculate up to diff_pos
-            update_hash = self.sub_cache_helper(k[0], target_pos + 1, sub_cache, k[1])
+            update_hash = self.keep(self.sub_cache_helper(k[0], target_pos + 1, sub_cache, k[1]))
 
             # find correct position in poi
             # check if bitmap @ target_pos is set -> is_update
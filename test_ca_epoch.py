@@ -0,0 +1,104 @@
+import os
+import tempfile
+from types import SimpleNamespace
+
+import hashf
+from ca import CA
+from sim_config import SimConfig
+
+NEW_ISSUES = list(range(20000000000, 20000000008))
+
+
+def epoch_config(wal_dir=None):
+    c = SimConfig()
+    c.hash_function = hashf.miniminhash
+    c.hash_depth = 32
+    c.poi_cache_size = 1000
+    c.journal_size = 50
+    c.wal_dir = wal_dir
+    c.recalc_fields()
+    return c
+
+
+def small_ca(c):
+    ca = CA(c)
+    for i in range(300):
+        ca.add_node(i, i % c.no_smt_parts, calc_prime=False)
+    ca.calc_prime_root()
+    ca.start_journal()
+    return ca
+
+
+def state(ca):
+    return ca.get_smt_roots(), ca.get_prime(), ca.rotations, [dict(s.nodes) for s in ca.smts]
+
+
+# reference: the new issues inserted synchronously into the oldest tree right before the switch
+def sync_switch(ca, node_ids):
+    for node_id in node_ids:
+        ca.add_node(node_id, 0, calc_prime=False)
+    ca.epoch_tree_change()
+
+
+# a pre-built switch ends in the same trees, cached PoIs & journal as inserting synchronously
+def test_prebuilt_switch_matches_synchronous():
+    c = epoch_config()
+    ca, reference = small_ca(c), small_ca(c)
+    # cached PoIs of the oldest tree have to be updated by the merge
+    cached = [(i, 0) for i in range(0, 300, c.no_smt_parts)]
+    for ca_ in (ca, reference):
+        for node_id, part in cached:
+            ca_.get_node_poi(node_id, part)
+    version = ca.version
+    ca.prepare_next_epoch(NEW_ISSUES)
+    ca.epoch_tree_change()
+    sync_switch(reference, NEW_ISSUES)
+    try:
+        assert state(ca) == state(reference)
+        assert ca.poi_cache == reference.poi_cache
+        assert ca.changes_since(c.no_smt_parts - 1, version) == reference.changes_since(c.no_smt_parts - 1, version)
+        for node_id, _ in cached:
+            assert ca.get_node_poi(node_id, c.no_smt_parts - 1) == ca.smts[-1].path(c.hash_function(str(node_id)))
+    finally:
+        ca.close()
+
+
+# a write to the oldest tree during the pre-build waits for it & the switch inserts synchronously
+def test_write_to_oldest_tree_during_prebuild():
+    c = epoch_config()
+    ca, reference = small_ca(c), small_ca(c)
+    revoke = [SimpleNamespace(node_id=i, smt_part=0, revoked=False) for i in range(0, 300, c.no_smt_parts)]
+    ca.prepare_next_epoch(NEW_ISSUES)
+    ca.revoke_nodes(revoke[:3])
+    ca.epoch_tree_change()
+    reference.revoke_nodes([SimpleNamespace(**vars(n)) for n in revoke[:3]])
+    sync_switch(reference, NEW_ISSUES)
+    ca.close()
+    assert state(ca) == state(reference)
+
+
+# merged new issues are logged & replayed, a pending pre-build is dropped on close
+def test_prebuilt_switch_is_recovered():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = epoch_config(os.path.join(tmp, 'wal'))
+        c.passive_nodes = 300
+        c.start_no_nodes = 60
+        c.smt_setup_file = os.path.join(tmp, 'setup.bns')
+        ca = CA(c)
+        ca.initialize()
+        ca.prepare_next_epoch(NEW_ISSUES)
+        ca.epoch_tree_change()
+        ca.prepare_next_epoch([20000000100])
+        expected = state(ca)
+        ca.close()
+        recovered = CA(c)
+        recovered.initialize()
+        assert state(recovered) == expected
+        recovered.close()
+
+
+if __name__ == '__main__':
+    test_prebuilt_switch_matches_synchronous()
+    test_write_to_oldest_tree_during_prebuild()
+    test_prebuilt_switch_is_recovered()
+    print('ok')
@@ -0,0 +1,123 @@
+import random
+import sys
+import threading
+from types import SimpleNamespace
+
+import hashf
+from ca import CA
+from ca_mvcc import MVCCServer
+from sim_config import SimConfig
+
+
+def small_ca(no_nodes):
+    c = SimConfig()
+    c.hash_function = hashf.miniminhash
+    c.hash_depth = 32
+    c.recalc_fields()
+    ca = CA(c)
+    for i in range(no_nodes):
+        ca.add_node(i, i % c.no_smt_parts, calc_prime=False)
+    ca.calc_prime_root()
+    return ca
+
+
+# readers on the thread pool only ever see complete versions while a writer revokes & re-issues nodes
+def test_concurrent_reads_are_consistent():
+    ca = small_ca(500)
+    server = MVCCServer(ca, workers=4, max_layers=3)
+    bases = [s.nodes.layers[-1] for s in ca.smts]
+    nodes = [SimpleNamespace(node_id=i, smt_part=i % ca.c.no_smt_parts, revoked=False) for i in range(500)]
+    primes = {server.version: ca.get_prime()}  # prime root of each published version
+    done = threading.Event()
+    errors = []
+
+    def writer():
+        rnd = random.Random(1)
+        try:
+            for _ in range(60):
+                revoke = rnd.sample([n for n in nodes if not n.revoked], 5)
+                server.revoke_nodes(revoke)
+                primes[server.version] = ca.get_prime()
+                server.reissue_nodes(rnd.sample([n for n in nodes if n.revoked], 3))
+                primes[server.version] = ca.get_prime()
+        finally:
+            done.set()
+
+    def reader(seed):
+        rnd = random.Random(seed)
+        while not done.is_set():
+            node_id = rnd.randrange(500)
+            part = rnd.randrange(ca.c.no_smt_parts)
+            poi, poi_bm, version, smt_root, prime_root = server.get_node_poi(node_id, part)
+            cert = ca.c.hash_function(str(node_id))
+            # a valid PoI of the cert, revoked or not, or of its absence
+            if smt_root not in (ca.smtu.calc_path_root(cert, poi, poi_bm),
+                                ca.smtu.calc_path_root(cert, poi, poi_bm, 0, True)):
+                errors.append(f'PoI of {node_id} in part {part} does not match root of version {version}')
+            if version in primes and primes[version] != prime_root:
+                errors.append(f'prime root of version {version} mixed with another version')
+
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # interleave readers & writer as much as possible
+    try:
+        futures = [server.executor.submit(reader, seed) for seed in range(3)]
+        writer()
+        for f in futures:
+            f.result()
+    finally:
+        sys.setswitchinterval(old_interval)
+        server.shutdown()
+
+    assert not errors, errors[:5]
+    # merged delta layers stay on top of the shared base
+    for s, base in zip(ca.smts, bases):
+        assert len(s.nodes.layers) <= 3
+        assert s.nodes.layers[-1] is base
+
+
+# a merged version reads exactly like the layered one, incl. removals of base entries
+def test_freeze_keeps_base_and_removals():
+    ca = small_ca(200)
+    server = MVCCServer(ca, workers=1, max_layers=2)
+    nodes = [SimpleNamespace(node_id=i, smt_part=i % ca.c.no_smt_parts, revoked=False) for i in range(200)]
+    reference = small_ca(200)
+    for i in range(0, 200, 7):
+        server.revoke_nodes([nodes[i]])
+        reference.revoke_nodes([SimpleNamespace(node_id=i, smt_part=i % ca.c.no_smt_parts, revoked=False)])
+    server.shutdown()
+    for s, r in zip(ca.smts, reference.smts):
+        assert s.roothash == r.roothash
+        keys = set(r.nodes).union(*s.nodes.layers)
+        assert all(s.nodes.get(k) == r.nodes.get(k) for k in keys)
+
+
+# batch PoIs walk all entries of a version, newest layer wins & removals are skipped
+def test_get_node_pois_on_layered_nodes():
+    ca = small_ca(200)
+    server = MVCCServer(ca, workers=2, max_layers=3)
+    reference = small_ca(200)
+    nodes = [SimpleNamespace(node_id=i, smt_part=i % ca.c.no_smt_parts, revoked=False) for i in range(200)]
+    ref_nodes = [SimpleNamespace(node_id=i, smt_part=i % ca.c.no_smt_parts, revoked=False) for i in range(200)]
+    for i in range(0, 200, 5):
+        server.revoke_nodes([nodes[i]])
+        reference.revoke_nodes([ref_nodes[i]])
+    for i in range(0, 200, 15):
+        server.reissue_nodes([nodes[i]])
+        reference.reissue_nodes([ref_nodes[i]])
+    requests = [(i, i % ca.c.no_smt_parts) for i in range(200)]
+    try:
+        assert len(ca.smts[0].nodes.layers) > 1
+        for s, r in zip(ca.smts, reference.smts):
+            assert len(s.nodes) == len(r.nodes)
+            assert dict(s.nodes.items()) == r.nodes
+        assert ca.get_node_pois(requests) == reference.get_node_pois(requests)
+        assert [r[:2] for r in server.get_node_pois(requests)] == ca.get_node_pois(requests)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    test_concurrent_reads_are_consistent()
+    test_freeze_keeps_base_and_removals()
+    test_get_node_pois_on_layered_nodes()
+    print('ok')
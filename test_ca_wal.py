@@ -0,0 +1,87 @@
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import hashf
+from ca import CA
+from sim_config import SimConfig
+
+
+def wal_config(wal_dir, hash_depth=32):
+    c = SimConfig()
+    c.hash_function = hashf.miniminhash
+    c.hash_depth = hash_depth
+    c.passive_nodes = 300
+    c.start_no_nodes = 60
+    c.smt_setup_file = os.path.join(wal_dir, '..', f'setup-{hash_depth}.bns')
+    c.wal_dir = wal_dir
+    c.recalc_fields()
+    return c
+
+
+def open_ca(c):
+    ca = CA(c)
+    ca.initialize()
+    return ca
+
+
+def state(ca):
+    return ca.get_smt_roots(), ca.get_prime(), ca.rotations
+
+
+def last_segment(wal_dir):
+    return os.path.join(wal_dir, max(f for f in os.listdir(wal_dir) if f.endswith('.log')))
+
+
+# revocations, re-issues & epoch changes survive a reopen, a torn last record is dropped
+def test_recover_after_reopen():
+    with tempfile.TemporaryDirectory() as tmp:
+        c = wal_config(os.path.join(tmp, 'wal'))
+        ca = open_ca(c)
+        nodes = [SimpleNamespace(node_id=i, smt_part=i % c.no_smt_parts, revoked=False) for i in range(60)]
+        ca.revoke_nodes(nodes[:10])
+        ca.epoch_tree_change()
+        # nodes move down one part with their trees (see BigNetSim.epoch_update_nodes)
+        for n in nodes:
+            n.smt_part = (n.smt_part - 1) % c.no_smt_parts
+        ca.reissue_nodes(nodes[:4])
+        ca.revoke_nodes(nodes[20:25])
+        expected = state(ca)
+        ca.close()
+
+        ca = open_ca(c)
+        assert state(ca) == expected
+        # the last mutation is torn: its record is only partly on disk
+        ca.revoke_nodes(nodes[30:31])
+        assert state(ca) != expected
+        ca.close()
+        segment = last_segment(c.wal_dir)
+        with open(segment, 'r+b') as fp:
+            fp.truncate(os.path.getsize(segment) - 3)
+
+        ca = open_ca(c)
+        assert state(ca) == expected
+        # the log continues after the cut
+        ca.revoke_nodes(nodes[30:31])
+        expected = state(ca)
+        ca.close()
+        assert state(open_ca(c)) == expected
+
+
+# a log of other params is refused instead of restored
+def test_recover_refuses_other_params():
+    with tempfile.TemporaryDirectory() as tmp:
+        wal_dir = os.path.join(tmp, 'wal')
+        open_ca(wal_config(wal_dir)).close()
+        try:
+            open_ca(wal_config(wal_dir, hash_depth=24))
+        except ValueError:
+            return
+        raise AssertionError('recovered a CA of another hash_depth')
+
+
+if __name__ == '__main__':
+    test_recover_after_reopen()
+    test_recover_refuses_other_params()
+    print('ok')
@@ -90,7 +90,7 @@ class TestSMT:
         # insert into LUT
         self.set_hash(hash_bm, self.depth, new_hash)
         # optional, but nice to have for some tests
-        bisect.insort(self.int_sort_leaves, hash_bm)
+        self.insert_leaf(hash_bm)
 
         # update all positions by going upwards
         for i in range(self.depth):
@@ -109,6 +109,10 @@ class TestSMT:
         self.roothash = self.get_hash(0, 0)  # set new root
         return self.roothash
 
+    # keep int_sort_leaves sorted
+    def insert_leaf(self, hash_bm):
+        bisect.insort(self.int_sort_leaves, hash_bm)
+
     # construct PoI with LUT for a leaf
     def path(self, my_hash):
         path = []
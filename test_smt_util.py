@@ -0,0 +1,53 @@
+import copy
+import gc
+import pickle
+
+import hashf
+from smt import SMT
+from smt_util import Digest, SMTutil, digest_pool
+
+
+# equal digests kept by different holders are one object, dropped from the pool with their last holder
+def test_digest_pool_shares_and_drops():
+    smtu = SMTutil(hashf.miniminhash, 32, intern=True)
+    a = smtu.keep(hashf.miniminhash('pool a'))
+    b = smtu.keep(hashf.miniminhash('pool ' + 'a'))
+    assert a is b and a == hashf.miniminhash('pool a')
+    size = len(digest_pool)
+    del a, b
+    gc.collect()
+    assert len(digest_pool) == size - 1
+    # without intern digests are kept as they are
+    plain = hashf.miniminhash('pool b')
+    assert SMTutil(hashf.miniminhash, 32).keep(plain) is plain
+
+
+# copies stay the pooled object, pickles hold plain str (setup files, WAL snapshots)
+def test_digest_copies_and_pickles():
+    d = digest_pool.keep('0123abcd')
+    assert copy.deepcopy([d])[0] is d and copy.copy(d) is d
+    loaded = pickle.loads(pickle.dumps(d))
+    assert type(loaded) is str and loaded == d
+    assert digest_pool.keep(loaded) is d
+
+
+# a pooling tree & a node computing the same digest share it
+def test_tree_digests_are_pooled():
+    smt = SMT(hashf.miniminhash, 32)
+    smt.intern = True
+    certs = [hashf.miniminhash(str(i)) for i in range(50)]
+    for cert in certs:
+        smt.add_node(cert)
+    assert type(smt.roothash) is Digest
+    smtu = SMTutil(hashf.miniminhash, 32, intern=True)
+    for (_, depth), val in smt.nodes.items():
+        if depth < smt.depth:
+            # a recomputed digest is a new str of the same value
+            assert smtu.keep(str(val)) is val
+
+
+if __name__ == '__main__':
+    test_digest_pool_shares_and_drops()
+    test_digest_copies_and_pickles()
+    test_tree_digests_are_pooled()
+    print('ok')
@@ -0,0 +1,124 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+
+# span tracer for phases of the simulation & CA, exports chrome trace-event json (chrome://tracing, perfetto)
+# methods are traced by patching their class, so nothing is patched & timed while tracing is off
+class Tracer:
+    def __init__(self, max_events=1000000):
+        self.max_events = max_events  # raw events kept for the trace file, summary counts all
+        self.events = []  # (name, cat, start_ns, duration_ns, thread)
+        self.stats = {}  # name -> [count, total_ns, max_ns]
+        self.dropped_events = 0
+        self.patched = []  # (cls, attribute name, original)
+        self.pid = os.getpid()
+        self.t0 = time.perf_counter_ns()
+
+    def record(self, name, cat, start, duration):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats[name] = [0, 0, 0]
+        stat[0] += 1
+        stat[1] += duration
+        if duration > stat[2]:
+            stat[2] = duration
+        if len(self.events) < self.max_events:
+            self.events.append((name, cat, start, duration, threading.get_ident()))
+        else:
+            self.dropped_events += 1
+
+    def span(self, name, cat='sim'):
+        return Span(self, name, cat)
+
+    # trace all calls of the given methods of cls until uninstrument() is called
+    # methods that are traced already (by any tracer) are left as they are, so they are not timed twice
+    def instrument(self, cls, names, cat='sim'):
+        for name in names:
+            original = cls.__dict__[name]
+            if getattr(original, 'traced_span', None) is not None:
+                continue
+            setattr(cls, name, self.traced(original, f'{cls.__name__}.{name}', cat))
+            self.patched.append((cls, name, original))
+
+    def uninstrument(self):
+        for cls, name, original in reversed(self.patched):
+            setattr(cls, name, original)
+        self.patched = []
+
+    def traced(self, func, name, cat):
+        clock = time.perf_counter_ns
+        record = self.record
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, cat, start, clock() - start)
+        wrapper.traced_span = name
+        return wrapper
+
+    def write_chrome_trace(self, file_name):
+        thread_ids = {}
+        trace_events = []
+        for name, cat, start, duration, thread in self.events:
+            trace_events.append({'name': name, 'cat': cat, 'ph': 'X',
+                                 'ts': (start - self.t0) / 1000, 'dur': duration / 1000,  # micro seconds
+                                 'pid': self.pid, 'tid': thread_ids.setdefault(thread, len(thread_ids))})
+        with open(file_name, 'w') as fp:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms',
+                       'otherData': {'dropped_events': self.dropped_events}}, fp)
+
+    # rows of (name, count, total_s, avg_ms, max_ms), sorted by total time
+    def summary(self):
+        rows = []
+        for name, (count, total, maxi) in self.stats.items():
+            rows.append((name, count, total / 1e9, total / count / 1e6, maxi / 1e6))
+        rows.sort(key=lambda r: r[2], reverse=True)
+        return rows
+
+    def print_summary(self):
+        print(f'{"span":<40} {"count":>10} {"total s":>10} {"avg ms":>10} {"max ms":>10}')
+        for name, count, total, avg, maxi in self.summary():
+            print(f'{name:<40} {count:>10} {total:>10.3f} {avg:>10.4f} {maxi:>10.4f}')
+        if self.dropped_events:
+            print(f'({self.dropped_events} events not written to trace, increase max_events)')
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'cat', 'start')
+
+    def __init__(self, tracer, name, cat):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.cat, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+
+# disabled tracer, spans are a shared null context and nothing gets instrumented
+class NullTracer:
+    null_span = contextlib.nullcontext()
+
+    def span(self, name, cat='sim'):
+        return self.null_span
+
+    def instrument(self, cls, names, cat='sim'):
+        pass
+
+    def uninstrument(self):
+        pass
+
+
+NULL_TRACER = NullTracer()
@@ -0,0 +1,216 @@
+import struct
+
+import hashf
+import sim_config
+
+# compact binary encoding of PoIs, update messages, level-caches, prime roots & root exchanges
+# digests are sent raw (hex -> bytes), empty hashes are never sent but marked in bitmaps
+# decoding works on memoryviews: digests are returned as views into the message, convert with hex_digests() if needed
+# layouts:
+#   poi:        path_bm (depth bits, big endian) | digest per set bit, bottom up (same order as SMT.path)
+#   update:     count (u16) | prime root | roots of affected parts | entries
+#               entry: part (u8) | revoked (u8) | cert digest | poi
+#   lvl cache:  non-empty bitmap (2 ** cache_level bits, big endian) | digest per non-empty entry
+#   prime root: prime digest | aggregated parities | empty bitmap of main parities (u8) | main parities
+#               only the prime digest in the merkle layout (SimConfig.prime_layout)
+#   roots:      count (u8) | entries, entry: part (u8, +128 if root is empty) | root digest if not empty
+#   poi delta:  changed bitmap (like path_bm) | non-empty bitmap | digest per non-empty changed sibling, bottom up
+#   lvl cache delta: count (u16) | entries, entry: index (u16, +32768 if empty) | digest if not empty
+
+EMPTY_ROOT = 0x80
+EMPTY_INDEX = 0x8000
+
+
+class WireCodec:
+    def __init__(self, config):
+        self.c: sim_config.SimConfig = config
+        self.digest_bytes = len(self.c.hash_function('digest size')) // 2
+        self.bm_bytes = (self.c.hash_depth + 7) // 8
+        self.par_bytes = self.c.parity_length_bytes
+        self.merkle = self.c.prime_layout == 'merkle'
+        self.prime_root_size = self.digest_bytes if self.merkle else \
+            self.digest_bytes + self.par_bytes * self.c.no_parities + 1
+
+    # raw digests of a hex hash list, '' is not allowed
+    def pack_digests(self, hashes):
+        return bytes.fromhex(''.join(hashes))
+
+    # hex hashes of a digest view, this is where allocation happens
+    def hex_digests(self, view):
+        d = self.digest_bytes
+        return [view[i:i + d].hex() for i in range(0, len(view), d)]
+
+    def encode_poi(self, poi, poi_bm):
+        return poi_bm.to_bytes(self.bm_bytes, 'big') + self.pack_digests(poi)
+
+    # returns (poi_bm, digests view, end offset)
+    def decode_poi(self, buf, off=0):
+        view = memoryview(buf)
+        poi_bm = int.from_bytes(view[off:off + self.bm_bytes], 'big')
+        off += self.bm_bytes
+        end = off + bin(poi_bm).count('1') * self.digest_bytes
+        return poi_bm, view[off:end], end
+
+    def poi_size(self, poi):
+        return self.bm_bytes + len(poi) * self.digest_bytes
+
+    def encode_prime_root(self, prime_root):
+        prime_hash, aggr_parities, main_parities = prime_root
+        if self.merkle:
+            return bytes.fromhex(prime_hash)
+        empty = 0
+        for i, p in enumerate(main_parities):
+            if p == '':
+                empty |= 1 << i
+        return bytes.fromhex(prime_hash) + \
+            b''.join(hashf.get_int(p).to_bytes(self.par_bytes, 'big') for p in aggr_parities) + \
+            bytes([empty]) + b''.join(bytes(self.par_bytes) if p == '' else bytes.fromhex(p) for p in main_parities)
+
+    # returns (prime_root, end offset), prime_root as CA.calc_prime_root builds it
+    def decode_prime_root(self, buf, off=0):
+        view = memoryview(buf)
+        d, pb = self.digest_bytes, self.par_bytes
+        prime_hash = view[off:off + d].hex()
+        off += d
+        if self.merkle:
+            return (prime_hash, [], []), off
+        aggr_parities = []
+        for _ in range(self.c.no_aggr_parities):
+            aggr_parities.append(hashf.from_int(int.from_bytes(view[off:off + pb], 'big'), pb))
+            off += pb
+        empty = view[off]
+        off += 1
+        main_parities = []
+        for i in range(self.c.main_parities):
+            main_parities.append('' if (empty >> i) & 1 else view[off:off + pb].hex())
+            off += pb
+        return (prime_hash, aggr_parities, main_parities), off
+
+    # update = [(part, hash, poi, bm, revoked)], roots = [(part, root)] of the affected parts
+    def encode_update(self, update, prime_root, roots):
+        out = [struct.pack('>H', len(update)), self.encode_prime_root(prime_root), self.encode_roots(roots)]
+        for part, cert, poi, poi_bm, revoked in update:
+            out.append(struct.pack('>BB', part, 1 if revoked else 0))
+            out.append(bytes.fromhex(cert))
+            out.append(self.encode_poi(poi, poi_bm))
+        return b''.join(out)
+
+    # returns (prime_root, roots, [(part, cert view, poi_bm, poi view, revoked)])
+    def decode_update(self, buf):
+        view = memoryview(buf)
+        count, = struct.unpack_from('>H', view, 0)
+        prime_root, off = self.decode_prime_root(view, 2)
+        roots, off = self.decode_roots(view, off)
+        d = self.digest_bytes
+        entries = []
+        for _ in range(count):
+            part, revoked = view[off], view[off + 1]
+            cert = view[off + 2:off + 2 + d]
+            poi_bm, poi, off = self.decode_poi(view, off + 2 + d)
+            entries.append((part, cert, poi_bm, poi, revoked == 1))
+        return prime_root, roots, entries
+
+    def update_size(self, update, roots):
+        return 2 + self.prime_root_size + self.roots_size(roots) + \
+            sum(2 + self.digest_bytes + self.poi_size(u[2]) for u in update)
+
+    def encode_lvl_cache(self, lvl_cache):
+        present = 0
+        for i, h in enumerate(lvl_cache):
+            if h != '':
+                present |= 1 << (len(lvl_cache) - 1 - i)
+        return present.to_bytes((len(lvl_cache) + 7) // 8, 'big') + self.pack_digests(h for h in lvl_cache if h != '')
+
+    # returns (non-empty bitmap, digests view, end offset), entry i is present if bit (2 ** cache_level - 1 - i) is set
+    def decode_lvl_cache(self, buf, cache_level, off=0):
+        view = memoryview(buf)
+        bm_bytes = (2 ** cache_level + 7) // 8
+        present = int.from_bytes(view[off:off + bm_bytes], 'big')
+        off += bm_bytes
+        end = off + bin(present).count('1') * self.digest_bytes
+        return present, view[off:end], end
+
+    def lvl_cache_size(self, lvl_cache):
+        return (len(lvl_cache) + 7) // 8 + sum(1 for h in lvl_cache if h != '') * self.digest_bytes
+
+    # roots = [(part, root)], eg. Node.get_ided_smt_roots
+    def encode_roots(self, roots):
+        out = [bytes([len(roots)])]
+        for part, root in roots:
+            if root == '':
+                out.append(bytes([part | EMPTY_ROOT]))
+            else:
+                out.append(bytes([part]) + bytes.fromhex(root))
+        return b''.join(out)
+
+    # returns ([(part, root)], end offset)
+    def decode_roots(self, buf, off=0):
+        view = memoryview(buf)
+        count = view[off]
+        off += 1
+        roots = []
+        for _ in range(count):
+            part = view[off]
+            off += 1
+            if part & EMPTY_ROOT:
+                roots.append((part & ~EMPTY_ROOT, ''))
+            else:
+                roots.append((part, view[off:off + self.digest_bytes].hex()))
+                off += self.digest_bytes
+        return roots, off
+
+    def roots_size(self, roots):
+        return 1 + sum(1 if root == '' else 1 + self.digest_bytes for _, root in roots)
+
+    # delta = {bit: hash}, see CA.get_poi_delta
+    def encode_poi_delta(self, delta):
+        changed = 0
+        present = 0
+        for bit, h in delta.items():
+            changed |= 1 << bit
+            if h != '':
+                present |= 1 << bit
+        return changed.to_bytes(self.bm_bytes, 'big') + present.to_bytes(self.bm_bytes, 'big') + \
+            self.pack_digests(delta[bit] for bit in sorted(delta) if delta[bit] != '')
+
+    # returns (changed bitmap, non-empty bitmap, digests view, end offset)
+    def decode_poi_delta(self, buf, off=0):
+        view = memoryview(buf)
+        changed = int.from_bytes(view[off:off + self.bm_bytes], 'big')
+        off += self.bm_bytes
+        present = int.from_bytes(view[off:off + self.bm_bytes], 'big')
+        off += self.bm_bytes
+        end = off + bin(present).count('1') * self.digest_bytes
+        return changed, present, view[off:end], end
+
+    def poi_delta_size(self, delta):
+        return 2 * self.bm_bytes + sum(1 for h in delta.values() if h != '') * self.digest_bytes
+
+    # delta = {index: hash}, see CA.get_lvl_cache_delta
+    def encode_lvl_cache_delta(self, delta):
+        out = [struct.pack('>H', len(delta))]
+        for i in sorted(delta):
+            if delta[i] == '':
+                out.append(struct.pack('>H', i | EMPTY_INDEX))
+            else:
+                out.append(struct.pack('>H', i) + bytes.fromhex(delta[i]))
+        return b''.join(out)
+
+    # returns ({index: hash}, end offset)
+    def decode_lvl_cache_delta(self, buf, off=0):
+        view = memoryview(buf)
+        count, = struct.unpack_from('>H', view, off)
+        off += 2
+        delta = {}
+        for _ in range(count):
+            i, = struct.unpack_from('>H', view, off)
+            off += 2
+            if i & EMPTY_INDEX:
+                delta[i & ~EMPTY_INDEX] = ''
+            else:
+                delta[i] = view[off:off + self.digest_bytes].hex()
+                off += self.digest_bytes
+        return delta, off
+
+    def lvl_cache_delta_size(self, delta):
+        return 2 + sum(2 if h == '' else 2 + self.digest_bytes for h in delta.values())